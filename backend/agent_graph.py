@@ -1,66 +1,62 @@
 from langgraph.graph import StateGraph
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
-from langchain_core.runnables import Runnable
-from typing import TypedDict, List, Union
-from datetime import datetime, timedelta
-import google.generativeai as genai
-from google_calendar import create_event
-from gmail_tools import send_email_message, summarize_last_email
+from langchain_core.runnables import Runnable, RunnableLambda
+from typing import TypedDict, List, Union, Optional
+from collections import Counter, namedtuple
+from tools import registry
+from job_queue import job_queue
+from concurrency import generate_content, stream_content_async
+from llm_cache import llm_cache, generate_text, agenerate_text
+from streaming import emit, emit_token, NODE_ENTERED, TOOL_STARTED, TOOL_FINISHED
+from checkpoint_store import get_checkpointer
+from metrics import span
+from session_store import HISTORY_TOKEN_BUDGET, estimate_tokens
+from temporal import normalize_date, normalize_time, preprocess_user_text, timezone_name
+import temporal
 import os
 import json
 import re
-import dateparser
-import dotenv
-
-dotenv.load_dotenv()
+import uuid
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import settings
 
 # ==== Gemini Setup ====
-schedule_meeting_function = {
-    "name": "schedule_meeting",
-    "description": "Schedules a meeting at a given time and date. Only use this for scheduling.",
+# Structured slot-filling response, so a single model call per turn either picks a
+# tool or returns the meeting details it could extract.
+capture_meeting_details_function = {
+    "name": "capture_meeting_details",
+    "description": (
+        "Use this when the user is arranging a meeting but has not given all of date, time and "
+        "topic yet. Fill in only the details present in the conversation and ask for the rest "
+        "in follow_up. For anything that is not a request to act, just answer in text."
+    ),
     "parameters": {
         "type": "object",
         "properties": {
-            "date": {"type": "string"},
-            "time": {"type": "string"},
-            "topic": {"type": "string"},
+            "date": {"type": "string", "description": "Meeting date, e.g. 2025-01-31, if known."},
+            "time": {"type": "string", "description": "Meeting time, e.g. 4:30pm, if known."},
+            "topic": {"type": "string", "description": "Meeting topic, if known."},
+            "attendees": {"type": "array", "items": {"type": "string"}, "description": "Email addresses to invite, if any."},
+            "follow_up": {"type": "string", "description": "Question asking the user for the missing details."}
         },
-        "required": ["date", "time", "topic"]
+        "required": ["follow_up"]
     }
 }
 
-# Email sending function declaration
-send_email_function = {
-    "name": "send_email_message",
-    "description": "Sends an email to a recipient with a subject and body.",
-    "parameters": {
-        "type": "object",
-        "properties": {
-            "to_email": {"type": "string", "description": "The recipient's full email address."},
-            "subject": {"type": "string", "description": "The subject line of the email."},
-            "body": {"type": "string", "description": "The content of the email message."}
-        },
-        "required": ["to_email", "subject", "body"]
-    }
-}
-
-# Email summarization function declaration
-summarize_email_function = {
-    "name": "summarize_last_email",
-    "description": "Fetches and summarizes the content of the last received email in the user's inbox.",
-    "parameters": {"type": "object", "properties": {}, "required": []}
-}
-
-google_api_key = os.getenv("GEMINI_API_KEY")
-if not google_api_key:
+if not settings.GEMINI_API_KEY:
     raise ValueError("GEMINI_API_KEY is not set in the environment.")
 
-genai.configure(api_key=google_api_key)
-
-model = genai.GenerativeModel(
-    model_name="gemini-2.5-flash",
-    tools=[{"function_declarations": [schedule_meeting_function, send_email_function, summarize_email_function]}]
+# Both models are built on first use; google.generativeai is imported then too
+model = settings.gemini_model(
+    tools=[{"function_declarations": registry.declarations() + [capture_meeting_details_function]}],
+    # Actions and slot capture come back as function calls; chit-chat and questions as text,
+    # which streams to the client and is the reply
+    tool_config={"function_calling_config": {"mode": "AUTO"}}
 )
+# Fallback extractor for the rare turn where the agent model returns neither text nor a call
+extraction_model = settings.gemini_model()
 
 # ==== LangGraph State ====
 MessageList = List[Union[HumanMessage, AIMessage, ToolMessage]]
@@ -69,9 +65,13 @@ class AgentState(TypedDict):
     messages: MessageList
     context: dict
     user_id: str
+    summary: str
 
 # ==== Convert messages to Gemini-compatible format ====
-def to_gemini_messages(messages: List[Union[HumanMessage, AIMessage, ToolMessage]]) -> List[dict]:
+# Older turns than fit HISTORY_TOKEN_BUDGET only reach the model through the session summary
+
+def to_gemini_messages(messages: List[Union[HumanMessage, AIMessage, ToolMessage]],
+                       summary: Optional[str] = None, token_budget: int = HISTORY_TOKEN_BUDGET) -> List[dict]:
     gemini_msgs = []
     for msg in messages:
         if isinstance(msg, HumanMessage):
@@ -80,46 +80,34 @@ def to_gemini_messages(messages: List[Union[HumanMessage, AIMessage, ToolMessage
             gemini_msgs.append({"role": "model", "parts": [msg.content]})
         elif isinstance(msg, ToolMessage):
             gemini_msgs.append({"role": "function", "parts": [msg.content]})
-    return gemini_msgs
 
-def normalize_date(date_str):
-    if not date_str:
-        return None
-    parsed = dateparser.parse(date_str)
-    if parsed:
-        return parsed.strftime("%Y-%m-%d")
-    return date_str
+    # Newest messages that fit the budget; the latest one is always sent
+    window, used = [], 0
+    for msg in reversed(gemini_msgs):
+        size = estimate_tokens("".join(str(part) for part in msg["parts"]))
+        if window and used + size > token_budget:
+            break
+        window.append(msg)
+        used += size
+    window.reverse()
+    while len(window) > 1 and window[0]["role"] != "user":
+        window.pop(0)
+
+    if summary and window:
+        window[0] = {**window[0], "parts": [f"(Summary of the earlier conversation: {summary})"] + window[0]["parts"]}
+    return window
 
-def normalize_time(time_str):
-    if not time_str:
-        return None
-    time_str = time_str.lower().replace(" ", "")
-    try:
-        # Handle formats like 4pm, 4:30pm, 04:30pm
-        if ":" in time_str:
-            dt = datetime.strptime(time_str, "%I:%M%p")
-        else:
-            dt = datetime.strptime(time_str, "%I%p")
-        return dt.strftime("%I:%M %p")
-    except:
-        return time_str  # fallback
-
-def preprocess_user_text(user_text: str) -> str:
-    """Converts relative date words like 'tomorrow' or 'today' to explicit dates."""
-    today = datetime.now()
-    replacements = {
-        "today": today.strftime("%Y-%m-%d"),
-        "tomorrow": (today + timedelta(days=1)).strftime("%Y-%m-%d"),
-    }
-    for word, date_str in replacements.items():
-        user_text = re.sub(rf"\b{word}\b", date_str, user_text, flags=re.IGNORECASE)
-    return user_text
+def extract_with_gemini(user_text: str, prev_context: dict) -> dict:
+    return _parse_extraction(generate_text(extraction_model, _extraction_prompt(user_text, prev_context),
+                                           operation="extraction"))
 
+async def aextract_with_gemini(user_text: str, prev_context: dict) -> dict:
+    return _parse_extraction(await agenerate_text(extraction_model, _extraction_prompt(user_text, prev_context),
+                                                  operation="extraction"))
 
-def extract_with_gemini(user_text: str, prev_context: dict) -> dict:
+def _extraction_prompt(user_text: str, prev_context: dict) -> str:
     user_text = preprocess_user_text(user_text)
-    missing = [k for k in ["date", "time", "topic"] if not prev_context.get(k)]
-    instruction = (
+    return (
         "You are an assistant that extracts missing meeting details from the user message.\n"
         "Current known values:\n"
         f"- Date: {prev_context.get('date') or 'None'}\n"
@@ -131,9 +119,8 @@ def extract_with_gemini(user_text: str, prev_context: dict) -> dict:
         "{\"date\": \"<date or null>\", \"time\": \"<time or null>\", \"topic\": \"<topic or null>\", \"follow_up\": \"<question if any>\"}"
     )
 
-    model_v2 = genai.GenerativeModel("gemini-2.5-flash")
-    response = model_v2.generate_content(instruction)
-    content = response.text.strip()
+def _parse_extraction(content: str) -> dict:
+    content = content.strip()
 
     print("[🧠 Gemini Raw Response]", content)
 
@@ -156,46 +143,343 @@ def extract_with_gemini(user_text: str, prev_context: dict) -> dict:
         }
 
 
+# ==== Local Intent Router ====
+# Obvious requests are turned into function calls locally; anything scored below
+# the threshold is escalated to Gemini.
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+INTENT_ROUTER_THRESHOLD = float(os.getenv("INTENT_ROUTER_THRESHOLD", "0.8"))
+
+router_stats = Counter()
+_router_stats_lock = threading.Lock()
+
+_EMAIL_ADDRESS = r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"
+_MONTH = r"(?:jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?"
+
+_SUMMARIZE_PATTERN = re.compile(
+    r"\bsummar(?:ize|ise|y)\b.*\b(?:last|latest|most recent|newest)\b.*\b(?:e-?mail|mail|message)\b",
+    re.IGNORECASE | re.DOTALL,
+)
+_FULL_BODY_PATTERN = re.compile(r"\b(?:full|entire|whole|detailed|in detail)\b", re.IGNORECASE)
+_SEND_EMAIL_PATTERN = re.compile(
+    rf"^\s*(?:please\s+)?(?:send\s+(?:an?\s+)?e-?mail\s+to|e-?mail)\s+(?P<to>{_EMAIL_ADDRESS})\s*,?\s*"
+    r"(?:with\s+)?(?:the\s+)?subject\s*[:\-]?\s*[\"']?(?P<subject>.+?)[\"']?\s*,?\s*"
+    r"(?:and\s+)?(?:(?:the\s+)?body|saying|message)\s*[:\-]?\s*(?P<body>.+?)\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+_SCHEDULE_VERB_PATTERN = re.compile(
+    r"^\s*(?:please\s+|can you\s+|could you\s+)?(?:schedule|book|set up|arrange)\s+(?:a\s+|an\s+|the\s+)?",
+    re.IGNORECASE,
+)
+_TIME_PATTERN = re.compile(r"\b(?:at\s+)?(?P<time>\d{1,2}(?::\d{2})?\s*(?:am|pm))(?![\w])", re.IGNORECASE)
+_DATE_PATTERN = re.compile(
+    rf"\b(?:on\s+)?(?P<date>\d{{4}}-\d{{2}}-\d{{2}}|{_MONTH}\s+\d{{1,2}}(?:st|nd|rd|th)?|\d{{1,2}}(?:st|nd|rd|th)?\s+{_MONTH})(?![\w])",
+    re.IGNORECASE,
+)
+_TOPIC_PATTERN = re.compile(r"\b(?:about|regarding|re:|to discuss|on the topic of)\s+(?P<topic>.+?)\s*[.!]?\s*$", re.IGNORECASE)
+_TIME_ONLY_PATTERN = re.compile(r"^\s*(?:at\s+)?(?P<time>\d{1,2}(?::\d{2})?\s*(?:am|pm))\s*[.!]?\s*$", re.IGNORECASE)
+_GENERIC_TOPICS = {"", "meeting", "a meeting", "call", "a call", "meeting with me"}
+
+def _valid_date(date_str: Optional[str]) -> Optional[str]:
+    """Normalized YYYY-MM-DD that is not in the past, or None."""
+    normalized = normalize_date(date_str)
+    if not normalized or not re.fullmatch(r"\d{4}-\d{2}-\d{2}", normalized):
+        return None
+    if normalized < temporal.now().date().isoformat():
+        return None
+    return normalized
+
+def _valid_time(time_str: Optional[str]) -> Optional[str]:
+    normalized = normalize_time(time_str)
+    if not normalized or not re.fullmatch(r"\d{2}:\d{2} [AP]M", normalized):
+        return None
+    return normalized
+
+def route_intent(user_text: str, prev_context: dict) -> Optional[dict]:
+    """Matches obvious requests locally.
+
+    Returns {"function_call": {...}, "confidence": float} or None when nothing matched.
+    """
+    if _SUMMARIZE_PATTERN.search(user_text):
+        args = {"full_body": True} if _FULL_BODY_PATTERN.search(user_text) else {}
+        return {"function_call": {"name": "summarize_last_email", "args": args}, "confidence": 0.9}
+
+    match = _SEND_EMAIL_PATTERN.match(user_text)
+    if match:
+        args = {k: match.group(k).strip() for k in ("to", "subject", "body")}
+        return {
+            "function_call": {
+                "name": "send_email_message",
+                "args": {"to_email": args["to"], "subject": args["subject"], "body": args["body"]},
+            },
+            "confidence": 0.95 if args["subject"] and args["body"] else 0.5,
+        }
+
+    text = preprocess_user_text(user_text)
+    extracted = {}
+    confidence = 0.0
+
+    if _SCHEDULE_VERB_PATTERN.match(text):
+        if re.search(_EMAIL_ADDRESS, text):
+            # Attendee lists are left to Gemini
+            return None
+        remainder = _SCHEDULE_VERB_PATTERN.sub("", text, count=1)
+        time_match = _TIME_PATTERN.search(remainder)
+        if time_match:
+            extracted["time"] = _valid_time(time_match.group("time"))
+            remainder = remainder.replace(time_match.group(0), " ")
+        date_match = _DATE_PATTERN.search(remainder)
+        if date_match:
+            extracted["date"] = _valid_date(date_match.group("date"))
+            remainder = remainder.replace(date_match.group(0), " ")
+
+        topic_match = _TOPIC_PATTERN.search(remainder)
+        if topic_match:
+            extracted["topic"] = topic_match.group("topic").strip()
+            confidence = 0.95
+        else:
+            # "schedule <topic> at <time> on <date>": whatever is left is the topic
+            leftover = re.sub(r"\s+", " ", remainder).strip(" ,.!")
+            leftover = re.sub(r"\s+(?:with|for)$", "", leftover, flags=re.IGNORECASE)
+            if leftover.lower() not in _GENERIC_TOPICS:
+                extracted["topic"] = leftover
+            confidence = 0.85
+    else:
+        time_match = _TIME_ONLY_PATTERN.match(text)
+        if not time_match:
+            return None
+        # Follow-up turn that only answers "what time?"
+        extracted["time"] = _valid_time(time_match.group("time"))
+        confidence = 0.9
+
+    # Same precedence as the Gemini slot-filling merge: values from this message win,
+    # earlier ones only fill the gaps. A complete new request starts from scratch.
+    if all(extracted.get(k) for k in ("date", "time", "topic")):
+        return {"function_call": {"name": "schedule_meeting", "args": extracted}, "confidence": confidence}
+    merged = {k: extracted.get(k) or prev_context.get(k) for k in ("date", "time", "topic")}
+    if not all(merged.values()):
+        return None
+    if prev_context.get("attendees"):
+        merged["attendees"] = prev_context["attendees"]
+    return {"function_call": {"name": "schedule_meeting", "args": merged}, "confidence": confidence}
+
+def _record_route(outcome: str, tool_name: Optional[str] = None):
+    with _router_stats_lock:
+        router_stats[outcome] += 1
+        if tool_name:
+            router_stats[f"{outcome}:{tool_name}"] += 1
+
+def intent_router(state: AgentState) -> AgentState:
+    last_user_msg = next(
+        (msg.content for msg in reversed(state["messages"]) if isinstance(msg, HumanMessage)), ""
+    )
+    prev_context = state.get("context") or {}
+    routed = route_intent(last_user_msg, prev_context) if INTENT_ROUTER_ENABLED else None
+
+    if not routed or routed["confidence"] < INTENT_ROUTER_THRESHOLD:
+        _record_route("escalated")
+        return {**state, "next": "agent"}
+
+    function_call = routed["function_call"]
+    _record_route("local", function_call["name"])
+    print("[⚡ Routed Locally]", function_call)
+
+    ai_msg = tool_call_message(f"Attempting to call {function_call['name']}...", [function_call])
+    context = function_call["args"] if function_call["name"] == "schedule_meeting" else prev_context
+    return {
+        "messages": state["messages"] + [ai_msg],
+        "context": context,
+        "user_id": state["user_id"],
+        "next": "tool"
+    }
+
+def router_snapshot() -> dict:
+    with _router_stats_lock:
+        return dict(router_stats)
+
+
 # ==== Gemini Agent ====
+def turn_contents(state: AgentState) -> List[dict]:
+    """Gemini contents for one turn: the conversation as written, plus today's date and the
+    slot values known so far as a separate hint, so relative dates resolve without
+    rewriting the user's words (e.g. an email body that says "today")."""
+    gemini_msgs = to_gemini_messages(state["messages"], state.get("summary"))
+    prev_context = state.get("context") or {}
+    today = temporal.now()
+    for msg in reversed(gemini_msgs):
+        if msg["role"] == "user":
+            msg["parts"] = list(msg["parts"]) + [
+                f"(Today is {today:%A, %Y-%m-%d} in {timezone_name()}; resolve relative dates against it. "
+                "Known meeting details so far: "
+                f"Date: {prev_context.get('date') or 'None'}, "
+                f"Time: {prev_context.get('time') or 'None'}, "
+                f"Topic: {prev_context.get('topic') or 'None'})"
+            ]
+            break
+    return gemini_msgs
+
+def context_from_call(call) -> dict:
+    """Normalizes capture_meeting_details arguments into the extraction result shape."""
+    args = dict(call.args)
+    return {
+        "date": normalize_date(args.get("date")),
+        "time": normalize_time(args.get("time")),
+        "topic": args.get("topic"),
+        "attendees": list(args.get("attendees") or []),
+        "follow_up": args.get("follow_up")
+    }
+
+FunctionCall = namedtuple("FunctionCall", ["name", "args"])
+
+def function_call_args(function_call) -> dict:
+    """A Gemini function call's args as plain dicts, lists and scalars. dict() alone leaves nested
+    values as proto containers, which neither the checkpointer nor json can serialize."""
+    return type(function_call).to_dict(function_call).get("args") or {}
+# Tool declarations are part of the agent prompt, so its entries get their own namespace
+AGENT_CACHE_NAMESPACE = f"{model.model_name}:agent-calls"
+
+def _cacheable_call(call: FunctionCall) -> bool:
+    """Slot capture and read-only tools. Replaying a cached write decision for an hour would
+    repeat a send or a booking without the model deciding to do it again."""
+    if call.name == "capture_meeting_details":
+        return True
+    spec = registry.get(call.name)
+    return spec is not None and spec.idempotent
+
+def cached_function_calls(contents) -> Optional[List[FunctionCall]]:
+    cached = llm_cache.get(AGENT_CACHE_NAMESPACE, contents)
+    if cached is None:
+        return None
+    calls = [FunctionCall(**call) for call in json.loads(cached)]
+    # Entries stored before writes were excluded may still be in a persistent cache
+    return calls if all(_cacheable_call(call) for call in calls) else None
+
+def cache_function_calls(contents, calls: List[FunctionCall]):
+    # Only function calls are cached; free-text turns go through the (cached) extractor
+    if calls and all(_cacheable_call(call) for call in calls):
+        llm_cache.set(AGENT_CACHE_NAMESPACE, contents, json.dumps([c._asdict() for c in calls]))
+
+def tool_call_message(content: str, calls: List[dict]) -> AIMessage:
+    """AIMessage carrying one or more tool calls, each with its own id for the matching ToolMessage."""
+    return AIMessage(
+        content=content,
+        tool_calls=[
+            {"name": call["name"], "args": dict(call["args"]), "id": f"call_{uuid.uuid4().hex[:16]}"}
+            for call in calls
+        ]
+    )
+
 class GeminiFunctionAgent(Runnable):
     def invoke(self, state: AgentState, config=None) -> AgentState:
-        gemini_msgs = to_gemini_messages(state["messages"])
-        response = model.generate_content(gemini_msgs)
-        content = response.candidates[0].content
+        contents = turn_contents(state)
+        calls, text = cached_function_calls(contents), ""
+        if calls is None:
+            response = generate_content(model, contents, operation="function_call")
+            calls, text = self._function_calls(response), self._response_text(response)
+            cache_function_calls(contents, calls)
+        call, actions = self._split_calls(calls)
+        if actions:
+            return self._route_function_calls(state, actions)
+        if call:
+            return self._merge_context(state, context_from_call(call))
+        if text:
+            return self._direct_reply(state, text)
+
+        # Neither a call nor text; fall back to the dedicated extraction call
+        new_context = extract_with_gemini(self._last_user_message(state), state.get("context", {}))
+        return self._merge_context(state, new_context)
+
+    async def ainvoke(self, state: AgentState, config=None, **kwargs) -> AgentState:
+        emit(NODE_ENTERED, node="agent")
+        contents = turn_contents(state)
+        calls, text = cached_function_calls(contents), ""
+        if calls is None:
+            # Streamed so a text answer reaches /chat/stream clients as it arrives
+            response = await stream_content_async(model, contents, on_text=emit_token, operation="function_call")
+            calls, text = self._function_calls(response), self._response_text(response)
+            cache_function_calls(contents, calls)
+        call, actions = self._split_calls(calls)
+        if actions:
+            return self._route_function_calls(state, actions)
+        if call:
+            result = self._merge_context(state, context_from_call(call))
+        elif text:
+            # Already streamed token by token
+            return self._direct_reply(state, text)
+        else:
+            new_context = await aextract_with_gemini(self._last_user_message(state), state.get("context", {}))
+            result = self._merge_context(state, new_context)
 
-        # Check for immediate function call (used for all tools, including new email tools)
-        if response.candidates and response.candidates[0].content.parts[0].function_call:
-            call = response.candidates[0].content.parts[0].function_call
-            function_call = {
-                "name": call.name,
-                "args": dict(call.args)
-            }
-            ai_msg = AIMessage(
-                content=f"Attempting to call {call.name}...",
-                additional_kwargs={"function_call": function_call}
-            )
-            # Route directly to tool executor for execution
-            return {
-                "messages": state["messages"] + [ai_msg],
-                "context": state["context"],
-                "user_id": state["user_id"],
-                "next": "tool"
-            }
-        
-        last_user_msg = next(
+        if result["next"] == "end":
+            emit_token(result["messages"][-1].content)
+        return result
+
+    @staticmethod
+    def _last_user_message(state: AgentState) -> str:
+        return next(
             (msg.content for msg in reversed(state["messages"]) if isinstance(msg, HumanMessage)), ""
         )
 
+    @staticmethod
+    def _function_calls(response) -> List[FunctionCall]:
+        """Every function call in the response; Gemini may return several parts for one request."""
+        if not response.candidates:
+            return []
+        return [
+            FunctionCall(part.function_call.name, function_call_args(part.function_call))
+            for part in response.candidates[0].content.parts if part.function_call
+        ]
+
+    @staticmethod
+    def _response_text(response) -> str:
+        if not response.candidates:
+            return ""
+        return "".join(part.text for part in response.candidates[0].content.parts if part.text).strip()
+
+    @staticmethod
+    def _direct_reply(state: AgentState, text: str) -> AgentState:
+        """The model answered in text (chit-chat, a question); that is the reply, slots unchanged."""
+        return {
+            "messages": state["messages"] + [AIMessage(content=text)],
+            "context": state.get("context") or {},
+            "user_id": state["user_id"],
+            "next": "end"
+        }
+
+    @staticmethod
+    def _split_calls(calls: List[FunctionCall]):
+        """(first capture_meeting_details call or None, actual tool calls)."""
+        capture = next((c for c in calls if c.name == capture_meeting_details_function["name"]), None)
+        actions = [c for c in calls if c.name != capture_meeting_details_function["name"]]
+        return capture, actions
+
+    @staticmethod
+    def _route_function_calls(state: AgentState, calls: List[FunctionCall]) -> AgentState:
+        names = ", ".join(call.name for call in calls)
+        ai_msg = tool_call_message(
+            f"Attempting to call {names}...",
+            [{"name": call.name, "args": call.args} for call in calls]
+        )
+        # Route directly to tool executor for execution
+        return {
+            "messages": state["messages"] + [ai_msg],
+            "context": state["context"],
+            "user_id": state["user_id"],
+            "next": "tool"
+        }
+
+    @staticmethod
+    def _merge_context(state: AgentState, new_context: dict) -> AgentState:
         prev_context = state.get("context", {})
-        new_context = extract_with_gemini(last_user_msg, prev_context)
 
         print("[🔍 Extracted Context]", new_context)
-        print("[📥 Last User Input]", last_user_msg)
 
-        # Correct merging
+        # Values from this turn win; earlier ones only fill the gaps
         merged_context = {}
         for key in ["date", "time", "topic"]:
-            merged_context[key] = prev_context.get(key) or new_context.get(key)
+            merged_context[key] = new_context.get(key) or prev_context.get(key)
+        attendees = new_context.get("attendees") or prev_context.get("attendees")
+        if attendees:
+            merged_context["attendees"] = attendees
 
         print("[🔗 Final Merged Context]", merged_context)
 
@@ -204,10 +488,7 @@ class GeminiFunctionAgent(Runnable):
                 "name": "schedule_meeting",
                 "args": merged_context
             }
-            ai_msg = AIMessage(
-                content="Let me schedule that for you.",
-                additional_kwargs={"function_call": function_call}
-            )
+            ai_msg = tool_call_message("Let me schedule that for you.", [function_call])
             return {
                 "messages": state["messages"] + [ai_msg],
                 "context": merged_context,
@@ -225,60 +506,117 @@ class GeminiFunctionAgent(Runnable):
         }
 
 # ==== Tool Executor ====
+# How many calls from one model response run at the same time
+TOOL_MAX_PARALLEL = int(os.getenv("TOOL_MAX_PARALLEL", "4"))
+
+def pending_tool_calls(message) -> List[dict]:
+    """Tool calls on the last AIMessage (older checkpoints carry a single additional_kwargs function_call)."""
+    if getattr(message, "tool_calls", None):
+        return message.tool_calls
+    call = getattr(message, "additional_kwargs", {}).get("function_call")
+    return [{**call, "id": "tool_call_id_fallback"}] if call else []
+
 def tool_executor(state: AgentState) -> AgentState:
-    call = state["messages"][-1].additional_kwargs.get("function_call")
-    if not call:
+    calls = pending_tool_calls(state["messages"][-1])
+    if not calls:
         return {**state, "next": "end"}
 
-    tool_name = call["name"]
-    tool_args = call["args"]
-    user_id = state["user_id"]
-    result = {"status": "error", "message": "Unknown function call."}
-    
-    user_result_msg = ""
-    
-    tool_args_with_user = {**tool_args, "user_id": user_id}
-
-    if tool_name == "schedule_meeting":
-        result = create_event(**tool_args_with_user)
-        user_result_msg = f"Meeting scheduled: {result.get('eventLink', 'See result for details')}" if result.get('status') == 'success' else f"Failed to schedule: {result.get('message', 'Unknown error')}"
-
-    elif tool_name == "send_email_message": 
-        result = send_email_message(**tool_args_with_user)
-        user_result_msg = f"Email sent successfully to {tool_args.get('to_email')}. Status: {result.get('status')}." if result.get('status') == 'success' else f"Failed to send email: {result.get('message', 'Unknown error')}"
-        
-    elif tool_name == "summarize_last_email": 
-        result = summarize_last_email(**tool_args_with_user)
-        if result.get('status') == 'success':
-            user_result_msg = f"Last email summary: **{result['summary']}**"
-        else:
-            user_result_msg = f"Failed to summarize email: {result.get('message', 'Unknown error')}"
-        
-    else:
-        user_result_msg = f"Unknown command: {tool_name}"
+    # Deferrable calls are queued here, in the request's context, and answered with a job ID
+    deferred = {
+        i: job_queue.enqueue(state["user_id"], call["name"], call["args"])
+        for i, call in enumerate(calls) if job_queue.defers(call["name"])
+    }
+    inline = [call for i, call in enumerate(calls) if i not in deferred]
+    # Keys are taken in call order, so a retried turn maps each write to its first attempt
+    keys = [job_queue.call_key(state["user_id"], call["name"]) for call in inline]
+    ran = iter([])
+    if inline:
+        # registry.run already hands the tool to the shared pool, so fan out on separate threads
+        # here rather than nesting waits inside that pool
+        with ThreadPoolExecutor(max_workers=min(len(inline), TOOL_MAX_PARALLEL)) as pool:
+            ran = iter(list(pool.map(
+                lambda call, key: job_queue.run_inline(state["user_id"], call["name"], call["args"], key),
+                inline, keys,
+            )))
+    results = [deferred[i] if i in deferred else next(ran) for i in range(len(calls))]
+    return _tool_result_state(state, calls, results)
+
+async def atool_executor(state: AgentState) -> AgentState:
+    calls = pending_tool_calls(state["messages"][-1])
+    if not calls:
+        return {**state, "next": "end"}
 
-    # Append the execution result and the final user-facing reply
+    emit(NODE_ENTERED, node="tool")
+    slots = asyncio.Semaphore(TOOL_MAX_PARALLEL)
+    # Keys are taken in call order, so a retried turn maps each write to its first attempt
+    keys = [None if job_queue.defers(call["name"]) else job_queue.call_key(state["user_id"], call["name"])
+            for call in calls]
+
+    async def run(call: dict, key: Optional[str]) -> dict:
+        async with slots:
+            emit(TOOL_STARTED, name=call["name"], args=call["args"], id=call["id"])
+            if job_queue.defers(call["name"]):
+                result = await job_queue.aenqueue(state["user_id"], call["name"], call["args"])
+            else:
+                result = await job_queue.arun_inline(state["user_id"], call["name"], call["args"], key)
+        emit(TOOL_FINISHED, name=call["name"], status=result.get("status"), id=call["id"], job_id=result.get("job_id"))
+        return result
+
+    results = await asyncio.gather(*(run(call, key) for call, key in zip(calls, keys)))
+    return _tool_result_state(state, calls, list(results))
+
+def _tool_result_state(state: AgentState, calls: List[dict], results: List[dict]) -> AgentState:
+    # One ToolMessage per call, then a single user-facing reply covering all of them
+    tool_messages = [
+        ToolMessage(name=call["name"], content=str(result), tool_call_id=call["id"])
+        for call, result in zip(calls, results)
+    ]
+    replies = [registry.reply(call["name"], call["args"], result) for call, result in zip(calls, results)]
+    # Once the meeting is booked (queued, or still completing) its slots are done; the next
+    # request starts empty
+    booked = any(
+        call["name"] == "schedule_meeting" and result.get("status") in ("success", "queued", "pending")
+        for call, result in zip(calls, results)
+    )
     return {
-        "messages": state["messages"] + [
-            ToolMessage(
-                name=tool_name,
-                content=str(result),
-                tool_call_id="tool_call_id_fallback"
-            ),
-            AIMessage(content=user_result_msg) 
-        ],
-        "context": state["context"],
-        "user_id": user_id,
+        "messages": state["messages"] + tool_messages + [AIMessage(content="\n\n".join(replies))],
+        "context": {} if booked else state["context"],
+        "user_id": state["user_id"],
         "next": "end"
     }
 
 # ==== LangGraph Setup ====
+class TimedNode(Runnable):
+    """Runs a graph node inside a latency span (node.<name> in /metrics)."""
+
+    def __init__(self, node_name: str, node: Runnable):
+        self.node_name = node_name
+        self.node = node
+
+    def invoke(self, state: AgentState, config=None, **kwargs) -> AgentState:
+        with span("node", self.node_name):
+            return self.node.invoke(state, config, **kwargs)
+
+    async def ainvoke(self, state: AgentState, config=None, **kwargs) -> AgentState:
+        with span("node", self.node_name):
+            return await self.node.ainvoke(state, config, **kwargs)
+
 graph = StateGraph(AgentState)
-graph.add_node("agent", GeminiFunctionAgent())
-graph.add_node("tool", tool_executor)
+graph.add_node("router", TimedNode("router", RunnableLambda(intent_router)))
+graph.add_node("agent", TimedNode("agent", GeminiFunctionAgent()))
+graph.add_node("tool", TimedNode("tool", RunnableLambda(tool_executor, afunc=atool_executor)))
 graph.add_node("end", lambda x: x)
 
-graph.set_entry_point("agent")
+graph.set_entry_point("router")
+
+graph.add_conditional_edges(
+    "router",
+    lambda state: state.get("next", "agent"),
+    {
+        "tool": "tool",
+        "agent": "agent"
+    }
+)
 
 graph.add_conditional_edges(
     "agent",
@@ -298,4 +636,18 @@ graph.add_conditional_edges(
 )
 
 graph.set_finish_point("end")
-agent_executor = graph.compile()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def agent_executor():
+    """The compiled graph, built on first use so importing this module opens no checkpoint database.
+
+    With a checkpointer, every run needs a thread config (see checkpoint_store.thread_config).
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = graph.compile(checkpointer=get_checkpointer())
+    return _executor
@@ -2,13 +2,11 @@ from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel
 from google.oauth2.credentials import Credentials
 import json
-from supabase_client import store_credentials
+from supabase_client import store_credentials, invalidate_credentials
 import os 
-import dotenv
+import settings
 router = APIRouter()
 
-dotenv.load_dotenv()
-
 # Define the data structure for the incoming token payload
 class TokenData(BaseModel):
     user_id: str
@@ -49,6 +47,8 @@ async def store_google_tokens(data: TokenData):
     try:
         # Store the serialized credentials (including the refresh token)
         store_credentials(data.user_id, creds)
+        # Cached credentials for this user are now stale
+        invalidate_credentials(data.user_id)
         return {"status": "success", "message": "Tokens stored/updated successfully."}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to store tokens in Supabase: {str(e)}")
@@ -0,0 +1,312 @@
+"""Offline load test: the real FastAPI app against local stand-ins for Gemini, Gmail,
+Calendar and Supabase (see benchmarks/fake_upstreams.py).
+
+Run from backend/:
+    python -m benchmarks.bench_load [--profile default] [--conversations 40] [--concurrency 8]
+    python -m benchmarks.bench_load --check        # exit 1 on a regression against the stored baseline
+    python -m benchmarks.bench_load --update-baseline
+
+Each scenario runs on its own with scripted conversations from `concurrency` virtual
+users and reports turns/s, turn latency percentiles and upstream calls per turn.
+Baselines live in benchmarks/baselines/bench_load.json, keyed by profile and load.
+The app, the stand-ins and the load generator share this machine, so compare runs
+from the same host.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import contextlib
+import datetime
+import statistics
+from collections import Counter
+from benchmarks import fake_upstreams
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "bench_load.json")
+
+# ==== Scenarios ====
+# A turn is (message, gemini script entry or None, substring the reply must contain).
+def _when(i: int):
+    day = datetime.date.today() + datetime.timedelta(days=1 + i % 25)
+    hour = 9 + (i // 25) % 8
+    label = f"{hour if hour <= 12 else hour - 12}{'am' if hour < 12 else 'pm'}"
+    return day.isoformat(), label
+
+def single_shot(i: int) -> list:
+    day, hour = _when(i)
+    return [(f"Schedule a meeting on {day} at {hour} about roadmap review {i}", None, "Meeting scheduled")]
+
+def slot_filling(i: int) -> list:
+    day, hour = _when(i)
+    topic = f"design review {i}"
+    return [
+        (f"I'd like to get the team together for the {topic}",
+         {"call": ("capture_meeting_details", {"topic": topic, "follow_up": "What date works for you?"})},
+         "What date"),
+        # Slot answer: the same call captures the date and asks for the rest
+        (f"Let's do {day} if that works ({i})",
+         {"call": ("capture_meeting_details", {"date": day, "follow_up": "What time?"})},
+         "What time"),
+        (f"at {hour}", None, "Meeting scheduled"),
+    ]
+
+def attendee_meeting(i: int) -> list:
+    # An address in the message sends it past the local router, so Gemini's call (with its
+    # nested attendee list) goes through the tool, the checkpointer and the job store
+    day, hour = _when(i)
+    attendees = [f"carol{i}@example.com", f"dan{i}@example.com"]
+    return [(f"Set up a planning sync with {attendees[0]} and {attendees[1]} on {day} at {hour}",
+             {"call": ("schedule_meeting", {"date": day, "time": hour, "topic": f"planning sync {i}",
+                                            "attendees": attendees})},
+             f"Invited: {attendees[0]}")]
+
+def bulk_events(i: int) -> list:
+    day, _ = _when(i)
+    events = [
+        {"date": day, "time": f"{9 + k}am", "topic": f"1:1 with report {k} ({i})",
+         "attendees": [f"report{k}.{i}@example.com"]}
+        for k in range(3)
+    ]
+    return [(f"Set up 1:1s with my three reports on {day}, round {i}",
+             {"call": ("create_events_bulk", {"events": events})},
+             "Created 3 of 3 events")]
+
+def email_summary(i: int) -> list:
+    return [
+        ("Summarize my latest email", None, "Last email summary"),
+        (f"Give me a digest of my 5 most recent emails, thread {i}",
+         {"call": ("summarize_recent_emails", {"n": 5})},
+         "Digest of your last 5 emails"),
+    ]
+
+def send_email(i: int) -> list:
+    return [(f"Send an email to bob{i}@example.com with subject Status {i} and body All good on my side",
+             None, "Email sent successfully")]
+
+SCENARIOS = {
+    "single_shot": single_shot,
+    "slot_filling": slot_filling,
+    "attendee_meeting": attendee_meeting,
+    "bulk_events": bulk_events,
+    "email_summary": email_summary,
+    "send_email": send_email,
+}
+
+# ==== App under test ====
+def configure_environment(stand_ins):
+    """Points the app at the stand-ins. Must run before main is imported."""
+    for key, value in {
+        "SUPABASE_URL": stand_ins.http_url,
+        "SUPABASE_KEY": "stand-in-key",
+        "GOOGLE_API_ROOT_URL": stand_ins.http_url + "/",
+        "GEMINI_API_KEY": "stand-in-key",
+        "CHECKPOINT_BACKEND": "memory",
+        "SESSION_BACKEND": "memory",
+        "LLM_CACHE_BACKEND": "memory",
+        # The load generator is a handful of users sending back to back; keep the
+        # per-user limits out of the way unless they are what is being measured
+        "CHAT_RATE_LIMIT": "10000:10000:10000:10000",
+        "GEMINI_RATE_LIMIT": "10000:10000:10000:10000",
+        "GMAIL_RATE_LIMIT": "10000:10000:10000:10000",
+        "CALENDAR_RATE_LIMIT": "10000:10000:10000:10000",
+        # Hedged reads depend on timing; off by default so upstream call counts are repeatable
+        "HEDGE_ENABLED": "false",
+        # Warmed up synchronously in run() so imports do not land inside the measurement
+        "STARTUP_WARMUP": "false",
+    }.items():
+        os.environ.setdefault(key, value)
+
+def connect_gemini(target: str):
+    """Replaces the default Gemini clients with ones on an insecure channel to the stand-in."""
+    import grpc
+    from google.ai import generativelanguage_v1beta as glm
+    from google.ai.generativelanguage_v1beta.services.generative_service.transports import (
+        GenerativeServiceGrpcTransport, GenerativeServiceGrpcAsyncIOTransport,
+    )
+    from google.generativeai import client as genai_client
+    import settings
+
+    settings.genai()  # configure() resets the clients, so it must run before they are replaced
+    manager = genai_client._client_manager
+    manager.clients["generative"] = glm.GenerativeServiceClient(
+        transport=GenerativeServiceGrpcTransport(channel=grpc.insecure_channel(target)))
+    manager.clients["generative_async"] = glm.GenerativeServiceAsyncClient(
+        transport=GenerativeServiceGrpcAsyncIOTransport(channel=grpc.aio.insecure_channel(target)))
+
+# ==== Load generation ====
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+async def run_scenario(client, name: str, conversations: int, concurrency: int) -> dict:
+    script = SCENARIOS[name]
+    pending = list(range(conversations))
+    latencies, failures = [], Counter()
+
+    async def virtual_user(n: int):
+        user_id = f"bench-{name}-{n}@example.com"
+        while pending:
+            i = pending.pop(0)
+            session_id = uuid.uuid4().hex
+            for message, gemini, expect in script(i):
+                if gemini:
+                    fake_upstreams.gemini_script[message] = gemini
+                start = time.perf_counter()
+                try:
+                    response = await client.post("/chat", json={"message": message, "user_id": user_id,
+                                                                "session_id": session_id})
+                    reply = response.json().get("reply", "") if response.status_code == 200 else ""
+                except Exception as e:
+                    response, reply = None, ""
+                    failures[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - start)
+                if response is not None and response.status_code != 200:
+                    failures[f"http_{response.status_code}"] += 1
+                elif response is not None and expect not in reply:
+                    failures["unexpected_reply"] += 1
+                if not reply:
+                    break     # the rest of the conversation depends on this turn
+
+    calls_before = fake_upstreams.snapshot_calls()
+    start = time.perf_counter()
+    await asyncio.gather(*(virtual_user(n) for n in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    upstream_calls = fake_upstreams.snapshot_calls() - calls_before
+
+    turns = len(latencies)
+    return {
+        "turns": turns,
+        "turns_per_second": round(turns / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        "error_rate": round(sum(failures.values()) / max(turns, 1), 4),
+        "failures": dict(failures),
+        "calls_per_turn": {op: round(count / max(turns, 1), 3) for op, count in sorted(upstream_calls.items())},
+    }
+
+async def run(args) -> dict:
+    import httpx
+    import uvicorn
+    import socket
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        import main
+        connect_gemini(args.stand_ins.grpc_target)
+        main.warm_up()
+        server = uvicorn.Server(uvicorn.Config(main.app, log_level="warning", access_log=False))
+        serving = asyncio.ensure_future(server.serve(sockets=[sock]))
+        while not server.started:
+            await asyncio.sleep(0.01)
+
+        results = {}
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        base_url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+        async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as client:
+            for name in args.scenarios:
+                results[name] = await run_scenario(client, name, args.conversations, args.concurrency)
+        server.should_exit = True
+        await serving
+    return results
+
+# ==== Baselines ====
+def baseline_key(args) -> str:
+    profile = f"{args.profile}+{args.latency}" if args.latency else args.profile
+    return f"{profile}/c{args.concurrency}/n{args.conversations}"
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Mean latency and throughput may drift by `tolerance`, p95 (noisier at these sample
+    sizes) by twice that. Upstream calls per turn may grow by 5% (retries under an error
+    profile vary a little); the error rate by two points."""
+    problems = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["mean_ms"] > base["mean_ms"] * (1 + tolerance):
+            problems.append(f"{name}: mean {result['mean_ms']}ms vs baseline {base['mean_ms']}ms")
+        if result["p95_ms"] > base["p95_ms"] * (1 + 2 * tolerance):
+            problems.append(f"{name}: p95 {result['p95_ms']}ms vs baseline {base['p95_ms']}ms")
+        if result["turns_per_second"] < base["turns_per_second"] * (1 - tolerance):
+            problems.append(f"{name}: {result['turns_per_second']} turns/s vs baseline {base['turns_per_second']}")
+        if result["error_rate"] > base["error_rate"] + 0.02:
+            problems.append(f"{name}: error rate {result['error_rate']:.1%} vs baseline {base['error_rate']:.1%}")
+        for op, per_turn in result["calls_per_turn"].items():
+            allowed = base["calls_per_turn"].get(op, 0.0) * 1.05 + 0.02
+            if per_turn > allowed:
+                problems.append(f"{name}: {op} {per_turn}/turn vs baseline {base['calls_per_turn'].get(op, 0.0)}/turn")
+    return problems
+
+def report(results: dict):
+    print(f"{'scenario':<16} {'turns':>6} {'turns/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for name, r in results.items():
+        print(f"{name:<16} {r['turns']:>6} {r['turns_per_second']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8}"
+              f" {r['p99_ms']:>8} {r['error_rate']:>7.1%}")
+        print("    upstream calls/turn: " + ", ".join(f"{op}={n:g}" for op, n in r["calls_per_turn"].items()))
+        if r["failures"]:
+            print(f"    failures: {r['failures']}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--profile", default="default", choices=sorted(fake_upstreams.PROFILES))
+    parser.add_argument("--latency", default="", help='overrides, e.g. "gemini=800:3000:0.01,google=50:200:0"')
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--conversations", type=int, default=40, help="conversations per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="virtual users per scenario")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--check", action="store_true", help="exit 1 on a regression against the baseline")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed latency/throughput drift")
+    parser.add_argument("--json", action="store_true", help="print the raw results as JSON")
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+
+    random.seed(args.seed)
+    fake_upstreams.profiles = fake_upstreams.parse_profiles(args.profile, args.latency)
+    args.stand_ins = fake_upstreams.StandIns().start()
+    configure_environment(args.stand_ins)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        args.stand_ins.stop()
+
+    print(f"profile {args.profile} ({fake_upstreams.profiles}), {args.conversations} conversations x "
+          f"{args.concurrency} virtual users per scenario")
+    report(results)
+    if args.json:
+        print(json.dumps(results, indent=2))
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baselines = json.load(f)
+    key = baseline_key(args)
+    if args.update_baseline:
+        baselines[key] = {name: {k: v for k, v in r.items() if k != "failures"} for name, r in results.items()}
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline {key} written to {BASELINE_PATH}")
+    elif args.check:
+        if key not in baselines:
+            print(f"No baseline for {key}; run with --update-baseline first.")
+            return 1
+        problems = regressions(results, baselines[key], args.tolerance)
+        for problem in problems:
+            print(f"REGRESSION {problem}")
+        if problems:
+            return 1
+        print(f"No regressions against baseline {key}.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
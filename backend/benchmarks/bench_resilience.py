@@ -0,0 +1,54 @@
+"""Benchmark: success rate and latency of a flaky, slow-tailed stub upstream, called
+directly versus through resilience.call (retries) and resilience.hedged (p95 hedging).
+
+Run from backend/:  python -m benchmarks.bench_resilience [calls] [error_rate] [tail_rate]
+No network access is needed; the stub fails with error_rate and answers slowly with tail_rate.
+"""
+import sys
+import time
+import random
+import statistics
+import resilience
+
+FAST, SLOW = 0.005, 0.2
+
+def main(calls: int = 200, error_rate: float = 0.1, tail_rate: float = 0.05):
+    resilience.RETRY_BASE_DELAY = 0.005
+
+    def upstream(primary: bool = True):
+        time.sleep(SLOW if random.random() < tail_rate else FAST)
+        if random.random() < error_rate:
+            raise ConnectionError("stub upstream failure")
+        return "ok"
+
+    def direct():
+        return upstream()
+
+    def retried():
+        return resilience.call("supabase", upstream)
+
+    def retried_hedged():
+        return resilience.hedged("bench", lambda primary: resilience.call("supabase", upstream, primary))
+
+    for name, fn in [("direct", direct), ("retries", retried), ("retries+hedging", retried_hedged)]:
+        resilience.breakers["supabase"].success()
+        latencies, ok = [], 0
+        for _ in range(calls):
+            start = time.perf_counter()
+            try:
+                fn()
+                ok += 1
+            except Exception:
+                pass
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        print(f"{name:<16} success {ok / calls:6.1%}  p50 {statistics.median(latencies) * 1000:7.1f} ms"
+              f"  p99 {p99 * 1000:7.1f} ms")
+    print(resilience.snapshot())
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 200,
+         float(args[1]) if len(args) > 1 else 0.1,
+         float(args[2]) if len(args) > 2 else 0.05)
@@ -0,0 +1,29 @@
+"""Micro-benchmark: per-call cost of build() versus the pooled service factory.
+
+Run from backend/:  python -m benchmarks.bench_service_pool [iterations]
+No network access is needed; both paths use the bundled discovery documents.
+"""
+import sys
+import timeit
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+from service_pool import ServicePool
+
+def main(iterations: int = 200):
+    creds = Credentials(token="benchmark-token")
+    pool = ServicePool()
+
+    def per_call_build():
+        build('gmail', 'v1', credentials=creds)
+
+    def pooled():
+        service = pool.acquire('gmail', 'v1', "bench@example.com", creds)
+        pool.release(service)
+
+    pooled()  # warm the discovery document cache and the pool
+    for name, fn in [("build() per call", per_call_build), ("service_pool", pooled)]:
+        total = timeit.timeit(fn, number=iterations)
+        print(f"{name:<18} {total / iterations * 1000:8.3f} ms/call  ({iterations} calls)")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
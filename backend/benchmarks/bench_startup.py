@@ -0,0 +1,82 @@
+"""Benchmark: how long `import main` takes in a fresh interpreter, and how long the
+startup warm-up (deferred imports, Gemini and Supabase clients) takes after it.
+
+Run from backend/:  python -m benchmarks.bench_startup [--runs 5] [--budget 2.0] [--top 15]
+Exits 1 when the median import time is over budget (STARTUP_BUDGET, in seconds), so it
+can gate CI. --top lists the slowest modules from one `python -X importtime` run.
+No network access is needed.
+"""
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", "2.0"))
+
+# Runs in the child; the last stdout line is the JSON result
+CHILD = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter() - start
+start = time.perf_counter()
+main.warm_up()
+print(json.dumps({"import": imported, "warm_up": time.perf_counter() - start}))
+"""
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "bench-key")
+    env["STARTUP_WARMUP"] = "false"
+    env["PYTHONWARNINGS"] = "ignore"
+    return env
+
+def measure() -> dict:
+    out = subprocess.run([sys.executable, "-c", CHILD], cwd=BACKEND_DIR, env=_env(),
+                         capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def slowest_imports(top: int) -> list:
+    """(cumulative seconds, module) for the slowest modules imported by main."""
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=BACKEND_DIR,
+                         env=_env(), capture_output=True, text=True, check=True).stderr
+    rows = []
+    for line in err.splitlines():
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \|( *)(\S+)", line)
+        # Only modules imported directly by main or by one of its imports, so nested
+        # packages do not repeat their parents' cost
+        if match and len(match.group(2)) <= 5:
+            rows.append((int(match.group(1)) / 1e6, match.group(2).count(" ") // 2, match.group(3)))
+    return sorted(rows, reverse=True)[:top]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET, help="seconds allowed for import main (median)")
+    parser.add_argument("--top", type=int, default=0, help="list the N slowest imports")
+    args = parser.parse_args(argv)
+
+    results = [measure() for _ in range(args.runs)]
+    for phase in ("import", "warm_up"):
+        values = [r[phase] for r in results]
+        print(f"{phase:8}  median {statistics.median(values) * 1000:7.1f} ms   "
+              f"min {min(values) * 1000:7.1f} ms   max {max(values) * 1000:7.1f} ms")
+
+    if args.top:
+        print("\nslowest imports (cumulative):")
+        for seconds, depth, module in slowest_imports(args.top):
+            print(f"  {seconds * 1000:7.1f} ms  {'  ' * (depth - 1)}{module}")
+
+    median = statistics.median(r["import"] for r in results)
+    if median > args.budget:
+        print(f"\nimport main took {median:.2f}s (median), over the {args.budget:.2f}s budget.")
+        return 1
+    print(f"\nimport main is within the {args.budget:.2f}s budget.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
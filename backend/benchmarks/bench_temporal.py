@@ -0,0 +1,82 @@
+"""Benchmark: date/time normalization through temporal (cached grammar, dateparser as an
+English-only fallback) versus the chain it replaced (dateparser with every language,
+strptime formats, then dateutil fuzzy parsing in create_event).
+
+Run from backend/:  python -m benchmarks.bench_temporal [rounds]
+Prints microseconds per turn (normalize date + time, build the event window) for the
+first round (cold caches) and the remaining rounds, plus where the two chains disagree.
+No network access is needed.
+"""
+import os
+import sys
+import time
+import datetime
+import statistics
+import pytz
+from dateutil import parser
+import temporal
+
+# (date, time) pairs as they arrive from Gemini tool calls and the local router
+SAMPLES = [
+    ("tomorrow", "4pm"), ("today", "10:30 am"), ("2026-11-03", "04:30 PM"), ("next tuesday", "9am"),
+    ("friday", "2:15pm"), ("Nov 5", "11am"), ("5th December", "16:00"), ("day after tomorrow", "noon"),
+    ("in 3 days", "3 pm"), ("December 12, 2026", "9:45am"), ("this thursday", "5pm"), ("Jan 20", "8:30 am"),
+]
+
+# ==== Chain being replaced ====
+def legacy_normalize_date(date_str):
+    import dateparser
+    parsed = dateparser.parse(date_str)
+    return parsed.strftime("%Y-%m-%d") if parsed else date_str
+
+def legacy_normalize_time(time_str):
+    time_str = time_str.lower().replace(" ", "")
+    try:
+        fmt = "%I:%M%p" if ":" in time_str else "%I%p"
+        return datetime.datetime.strptime(time_str, fmt).strftime("%I:%M %p")
+    except ValueError:
+        return time_str
+
+def legacy_turn(date_str, time_str):
+    date_str, time_str = legacy_normalize_date(date_str), legacy_normalize_time(time_str)
+    start = parser.parse(f"{date_str} {time_str}", fuzzy=True)
+    tz = pytz.timezone(temporal.DEFAULT_TIMEZONE)
+    return date_str, time_str, tz.localize(start)
+
+def temporal_turn(date_str, time_str):
+    date_str, time_str = temporal.normalize_date(date_str), temporal.normalize_time(time_str)
+    start, _ = temporal.event_window(date_str, time_str)
+    return date_str, time_str, start
+
+def _time(fn, rounds: int):
+    """(first round µs/turn, later rounds µs/turn) over SAMPLES."""
+    per_round = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for date_str, time_str in SAMPLES:
+            fn(date_str, time_str)
+        per_round.append((time.perf_counter() - start) / len(SAMPLES) * 1e6)
+    return per_round[0], statistics.median(per_round[1:]) if rounds > 1 else per_round[0]
+
+def main(rounds: int = 50):
+    # The old chain reads "today" from the server clock; put both in the same zone
+    os.environ["TZ"] = temporal.DEFAULT_TIMEZONE
+    time.tzset()
+
+    # Both chains import dateparser; time the import separately from parsing
+    start = time.perf_counter()
+    temporal.fallback_parser()
+    print(f"dateparser import: {(time.perf_counter() - start) * 1000:.0f} ms (deferred until a fallback is needed)")
+
+    for name, fn in [("legacy", legacy_turn), ("temporal", temporal_turn)]:
+        cold, warm = _time(fn, rounds)
+        print(f"{name:9} first round {cold:9.1f} us/turn   later rounds {warm:9.1f} us/turn")
+
+    disagreements = [(d, t, legacy_turn(d, t)[2], temporal_turn(d, t)[2]) for d, t in SAMPLES
+                     if legacy_turn(d, t)[2] != temporal_turn(d, t)[2]]
+    for date_str, time_str, old, new in disagreements:
+        print(f"  differs: {date_str!r} {time_str!r}: legacy {old.isoformat()}  temporal {new.isoformat()}")
+    print(f"{len(SAMPLES) - len(disagreements)}/{len(SAMPLES)} samples agree")
+
+if __name__ == "__main__":
+    main(*(int(a) for a in sys.argv[1:2]))
@@ -0,0 +1,319 @@
+"""Local stand-ins for the upstreams /chat depends on, for benchmarks/bench_load.py.
+
+- Gemini: a gRPC server speaking the real GenerativeService protocol
+  (GenerateContent / StreamGenerateContent). Function-call turns are answered from
+  `gemini_script`, keyed by the user's message; prompts without tools get a JSON
+  extraction (if the script has one for the quoted message) or a canned summary.
+- Gmail (messages.list / get / send, batch), Calendar (freeBusy, events.list /
+  insert, batch) and the Supabase `user_tokens` table: one HTTP app.
+
+Every request sleeps for a latency drawn from its upstream's profile and fails with
+its error rate (gRPC UNAVAILABLE / HTTP 503). Calls are counted per operation in `calls`.
+"""
+import math
+import json
+import base64
+import random
+import socket
+import asyncio
+import threading
+import email.parser
+from collections import Counter
+from urllib.parse import urlsplit, parse_qs
+import grpc
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from google.ai import generativelanguage_v1beta as glm
+
+# ==== Latency and error profiles ====
+class Profile:
+    """Lognormal latency with the given median and p99 (milliseconds), plus an error rate."""
+
+    def __init__(self, median_ms: float, p99_ms: float, error_rate: float = 0.0):
+        self.median_ms = median_ms
+        self.p99_ms = p99_ms
+        self.error_rate = error_rate
+        # 2.326 = z-score of the 99th percentile
+        self.sigma = math.log(max(p99_ms, median_ms) / median_ms) / 2.326 if median_ms > 0 else 0.0
+
+    def latency(self) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        return random.lognormvariate(math.log(self.median_ms), self.sigma) / 1000
+
+    def fails(self) -> bool:
+        return random.random() < self.error_rate
+
+    def __repr__(self):
+        return f"{self.median_ms:g}:{self.p99_ms:g}:{self.error_rate:g}"
+
+# upstream -> "median_ms:p99_ms:error_rate"
+PROFILES = {
+    "default": {"gemini": "400:1500:0", "google": "80:400:0", "supabase": "15:60:0"},
+    "fast": {"gemini": "5:20:0", "google": "2:10:0", "supabase": "1:5:0"},
+    "flaky": {"gemini": "400:1500:0.05", "google": "80:400:0.05", "supabase": "15:60:0.02"},
+    "slow-tail": {"gemini": "400:6000:0", "google": "80:2500:0", "supabase": "15:800:0"},
+}
+
+def parse_profiles(name: str, overrides: str = "") -> dict:
+    """Named profile, with "upstream=median:p99:error_rate,..." overrides applied."""
+    specs = dict(PROFILES[name])
+    for item in filter(None, (part.strip() for part in overrides.split(","))):
+        upstream, spec = item.split("=")
+        specs[upstream] = spec
+    return {upstream: Profile(*(float(x) for x in spec.split(":"))) for upstream, spec in specs.items()}
+
+profiles = parse_profiles("default")
+calls = Counter()
+_calls_lock = threading.Lock()
+
+def _count(name: str, n: int = 1):
+    with _calls_lock:
+        calls[name] += n
+
+def snapshot_calls() -> Counter:
+    with _calls_lock:
+        return Counter(calls)
+
+# ==== Gemini (gRPC) ====
+# user message -> {"call": (name, args)} or {"text": str}, plus optional "extraction": {...}
+gemini_script = {}
+
+GEMINI_SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+
+def _last_user_text(request) -> str:
+    for content in reversed(request.contents):
+        if content.role == "user":
+            return " ".join(part.text for part in content.parts if part.text)
+    return ""
+
+def _script_for(text: str) -> dict:
+    for message, entry in gemini_script.items():
+        if message in text:
+            return entry
+    return {}
+
+def _text_response(text: str):
+    return glm.GenerateContentResponse(candidates=[glm.Candidate(
+        content=glm.Content(role="model", parts=[glm.Part(text=text)]), finish_reason="STOP")])
+
+def _gemini_reply(request):
+    text = _last_user_text(request)
+    entry = _script_for(text)
+    if request.tools:
+        if "call" in entry:
+            name, args = entry["call"]
+            return glm.GenerateContentResponse(candidates=[glm.Candidate(
+                content=glm.Content(role="model", parts=[glm.Part(function_call=glm.FunctionCall(name=name, args=args))]),
+                finish_reason="STOP")])
+        if "text" in entry:
+            return _text_response(entry["text"])
+        return glm.GenerateContentResponse(candidates=[glm.Candidate(
+            content=glm.Content(role="model", parts=[glm.Part(function_call=glm.FunctionCall(
+                name="capture_meeting_details", args={"follow_up": "Could you tell me more?"}))]),
+            finish_reason="STOP")])
+    if "extraction" in entry:
+        return _text_response(json.dumps(entry["extraction"]))
+    return _text_response("A short summary of the message: the sender shares a project update and asks for a reply.")
+
+async def _gemini_attempt(context, operation: str):
+    _count(f"gemini.{operation}")
+    profile = profiles["gemini"]
+    await asyncio.sleep(profile.latency())
+    if profile.fails():
+        await context.abort(grpc.StatusCode.UNAVAILABLE, "injected failure")
+
+async def _generate_content(request, context):
+    await _gemini_attempt(context, "generate")
+    return _gemini_reply(request)
+
+async def _stream_generate_content(request, context):
+    await _gemini_attempt(context, "stream")
+    response = _gemini_reply(request)
+    part = response.candidates[0].content.parts[0]
+    if not part.text:
+        yield response
+        return
+    # Text arrives in a few chunks, like the real stream
+    words = part.text.split(" ")
+    step = max(1, len(words) // 3)
+    for start in range(0, len(words), step):
+        yield _text_response(" ".join(words[start:start + step]) + (" " if start + step < len(words) else ""))
+
+def gemini_handler():
+    return grpc.method_handlers_generic_handler(GEMINI_SERVICE, {
+        "GenerateContent": grpc.unary_unary_rpc_method_handler(
+            _generate_content,
+            request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize),
+        "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+            _stream_generate_content,
+            request_deserializer=glm.GenerateContentRequest.deserialize,
+            response_serializer=glm.GenerateContentResponse.serialize),
+    })
+
+# ==== Gmail / Calendar (HTTP) ====
+_ids = Counter()
+
+def _next_id(kind: str) -> str:
+    with _calls_lock:
+        _ids[kind] += 1
+        return f"{kind}{_ids[kind]}"
+
+def _message(msg_id: str) -> dict:
+    body = f"Hi, here is the latest on project {msg_id}. Can you review it by Friday?"
+    return {
+        "id": msg_id, "historyId": "1", "snippet": body[:60],
+        "payload": {
+            "mimeType": "text/plain",
+            "headers": [{"name": "From", "value": "alice@example.com"},
+                        {"name": "Subject", "value": f"Update {msg_id}"},
+                        {"name": "Date", "value": "Mon, 1 Jan 2024 09:00:00 +0000"}],
+            "body": {"data": base64.urlsafe_b64encode(body.encode()).decode()},
+        },
+    }
+
+def _google(method: str, path: str, query: dict, body: dict):
+    """(status, payload) for one Gmail / Calendar REST call."""
+    parts = path.strip("/").split("/")
+    if parts[:4] == ["gmail", "v1", "users", "me"] and parts[4:5] == ["messages"]:
+        rest = parts[5:]
+        if method == "GET" and not rest:
+            _count("gmail.messages.list")
+            n = int(query.get("maxResults", ["1"])[0])
+            return 200, {"messages": [{"id": _next_id("m")} for _ in range(n)]}
+        if method == "POST" and rest == ["send"]:
+            _count("gmail.messages.send")
+            return 200, {"id": _next_id("sent"), "labelIds": ["SENT"]}
+        if method == "GET" and len(rest) == 1:
+            _count("gmail.messages.get")
+            return 200, _message(rest[0])
+    if parts[:2] == ["calendar", "v3"]:
+        rest = parts[2:]
+        if method == "POST" and rest == ["freeBusy"]:
+            _count("calendar.freebusy")
+            return 200, {"calendars": {item["id"]: {"busy": []} for item in body.get("items", [])}}
+        if len(rest) == 3 and rest[0] == "calendars" and rest[2] == "events":
+            if method == "GET":
+                _count("calendar.events.list")
+                return 200, {"items": [], "nextSyncToken": "sync-token"}
+            if method == "POST":
+                _count("calendar.events.insert")
+                event_id = _next_id("evt")
+                return 200, {**body, "id": event_id, "htmlLink": f"https://calendar.example/{event_id}"}
+    return 404, {"error": {"code": 404, "message": f"No stand-in for {method} {path}"}}
+
+def _batch(content_type: str, raw: bytes):
+    """Answers a multipart/mixed batch the way googleapiclient expects it."""
+    outer = email.parser.BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + raw)
+    boundary = "batch_stand_in"
+    chunks = []
+    for part in outer.get_payload():
+        content_id = part["Content-ID"].strip("<>")
+        request_line, _, rest = part.get_payload().partition("\n")
+        method, url, _ = request_line.strip().split(" ", 2)
+        body_text = rest.split("\r\n\r\n", 1)[-1].split("\n\n", 1)[-1] if rest else ""
+        body = json.loads(body_text) if body_text.strip().startswith("{") else {}
+        split = urlsplit(url)
+        if not chunks:
+            _count(f"{split.path.strip('/').split('/')[0]}.batch")
+        status, payload = _google(method, split.path, parse_qs(split.query), body)
+        chunks.append(
+            f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+            f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\n\r\n"
+            f"{json.dumps(payload)}\r\n"
+        )
+    chunks.append(f"--{boundary}--")
+    return "".join(chunks), f"multipart/mixed; boundary={boundary}"
+
+# ==== Supabase (PostgREST) ====
+STORED_CREDENTIALS = {
+    "token": "stand-in-token", "refresh_token": "stand-in-refresh",
+    "client_id": "stand-in-client", "client_secret": "stand-in-secret",
+    "token_uri": "https://oauth2.googleapis.com/token", "expiry": "2099-01-01T00:00:00Z",
+}
+
+http_app = FastAPI()
+
+async def _http_attempt(upstream: str) -> bool:
+    profile = profiles[upstream]
+    await asyncio.sleep(profile.latency())
+    return profile.fails()
+
+def _unavailable(message: str = "injected failure") -> Response:
+    return Response(json.dumps({"error": {"code": 503, "message": message}}), status_code=503,
+                    media_type="application/json")
+
+@http_app.get("/rest/v1/user_tokens")
+async def select_tokens(request: Request):
+    _count("supabase.select")
+    if await _http_attempt("supabase"):
+        return _unavailable()
+    row = {"google_credentials": STORED_CREDENTIALS}
+    single = "vnd.pgrst.object" in request.headers.get("accept", "")
+    return Response(json.dumps(row if single else [row]), media_type="application/json")
+
+@http_app.post("/rest/v1/user_tokens")
+async def upsert_tokens(request: Request):
+    _count("supabase.upsert")
+    if await _http_attempt("supabase"):
+        return _unavailable()
+    return Response(await request.body() or b"[]", status_code=201, media_type="application/json")
+
+@http_app.api_route("/{path:path}", methods=["GET", "POST"])
+async def google_api(path: str, request: Request):
+    if await _http_attempt("google"):
+        return _unavailable()
+    raw = await request.body()
+    if path == "batch" or path.startswith("batch/"):
+        payload, content_type = _batch(request.headers["content-type"], raw)
+        return Response(payload, media_type=content_type)
+    body = json.loads(raw) if raw else {}
+    status, payload = _google(request.method, "/" + path, parse_qs(request.url.query), body)
+    return Response(json.dumps(payload), status_code=status, media_type="application/json")
+
+# ==== Server lifecycle ====
+class StandIns:
+    """Runs the HTTP and gRPC stand-ins on their own event loop thread."""
+
+    def __init__(self):
+        self.http_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.http_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.http_socket.bind(("127.0.0.1", 0))
+        self.http_url = f"http://127.0.0.1:{self.http_socket.getsockname()[1]}"
+        self.grpc_target = None
+        self._ready = threading.Event()
+        self._loop = None
+        self._http_server = None
+        self._grpc_server = None
+        self._thread = threading.Thread(target=self._run, name="stand-ins", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        self._loop.run_until_complete(self._serve())
+
+    async def _serve(self):
+        self._grpc_server = grpc.aio.server()
+        self._grpc_server.add_generic_rpc_handlers((gemini_handler(),))
+        port = self._grpc_server.add_insecure_port("127.0.0.1:0")
+        self.grpc_target = f"127.0.0.1:{port}"
+        await self._grpc_server.start()
+
+        config = uvicorn.Config(http_app, log_level="warning", access_log=False)
+        self._http_server = uvicorn.Server(config)
+        serving = asyncio.ensure_future(self._http_server.serve(sockets=[self.http_socket]))
+        while not self._http_server.started:
+            await asyncio.sleep(0.01)
+        self._ready.set()
+        await serving
+        await self._grpc_server.stop(None)
+
+    def stop(self):
+        if self._http_server:
+            self._http_server.should_exit = True
+        self._thread.join(5)
@@ -0,0 +1,177 @@
+import os
+import time
+import bisect
+import datetime
+import threading
+from collections import OrderedDict
+from typing import Optional
+import pytz
+import settings
+
+# Older than this, the index is re-synced (incrementally, via syncToken) before it answers a
+# slot search. Checks right before an insert always re-sync (refresh=True).
+BUSY_INDEX_MAX_STALENESS = float(os.getenv("BUSY_INDEX_MAX_STALENESS", "30"))
+BUSY_INDEX_HORIZON_DAYS = int(os.getenv("BUSY_INDEX_HORIZON_DAYS", "60"))
+BUSY_INDEX_MAX_USERS = int(os.getenv("BUSY_INDEX_MAX_USERS", "1024"))
+
+EVENT_FIELDS = "items(id,status,transparency,start,end,attendees(self,responseStatus)),nextPageToken,nextSyncToken"
+
+def event_epoch(when: dict, tz_name: str) -> float:
+    if "dateTime" in when:
+        return datetime.datetime.fromisoformat(when["dateTime"].replace("Z", "+00:00")).timestamp()
+    # All-day event: the date is midnight in the calendar's timezone
+    day = datetime.datetime.strptime(when["date"], "%Y-%m-%d")
+    return pytz.timezone(when.get("timeZone") or tz_name).localize(day).timestamp()
+
+class _UserIndex:
+    def __init__(self):
+        self.events = {}        # event id -> (start, end) epoch seconds
+        self.starts = []        # merged busy intervals, sorted by start
+        self.ends = []
+        self.sync_token = None
+        self.window = (0.0, 0.0)
+        self.synced_at = 0.0
+        self.lock = threading.Lock()
+
+    def rebuild(self):
+        starts, ends = [], []
+        for start, end in sorted(self.events.values()):
+            if starts and start <= ends[-1]:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self.starts, self.ends = starts, ends
+
+    def is_free(self, start: float, end: float) -> bool:
+        i = bisect.bisect_right(self.starts, start) - 1
+        if i >= 0 and self.ends[i] > start:
+            return False
+        return not (i + 1 < len(self.starts) and self.starts[i + 1] < end)
+
+    def overlapping(self, start: float, end: float) -> list:
+        i = max(0, bisect.bisect_right(self.starts, start) - 1)
+        busy = []
+        while i < len(self.starts) and self.starts[i] < end:
+            if self.ends[i] > start:
+                busy.append((self.starts[i], self.ends[i]))
+            i += 1
+        return busy
+
+def _frees_time(event: dict) -> bool:
+    """Cancelled, marked free, or an invitation the user declined."""
+    if event.get("status") == "cancelled" or event.get("transparency") == "transparent":
+        return True
+    return any(a.get("self") and a.get("responseStatus") == "declined" for a in event.get("attendees", []))
+
+class BusyIndex:
+    """Per-user sorted, merged busy intervals of the primary calendar.
+
+    Populated from events.list and kept fresh with syncTokens, so availability
+    checks and slot searches are a bisect instead of a freebusy round trip. Answers
+    are never based on data older than BUSY_INDEX_MAX_STALENESS seconds, and with
+    refresh=True (the check right before an insert) they reflect a sync made just now.
+    """
+
+    def __init__(self, max_staleness: float = BUSY_INDEX_MAX_STALENESS,
+                 horizon_days: int = BUSY_INDEX_HORIZON_DAYS, max_users: int = BUSY_INDEX_MAX_USERS):
+        self.max_staleness = max_staleness
+        self.horizon_days = horizon_days
+        self.max_users = max_users
+        self._users: "OrderedDict[str, _UserIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _user(self, user_id: str) -> _UserIndex:
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                index = self._users[user_id] = _UserIndex()
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return index
+
+    def is_free(self, user_id: str, service, start_dt, end_dt, calendar_id: str, tz_name: str,
+                refresh: bool = False) -> Optional[bool]:
+        """True/False from the local index, or None if the range is outside the indexed window."""
+        return self._answer(user_id, service, start_dt, end_dt, calendar_id, tz_name, refresh, _UserIndex.is_free)
+
+    def busy(self, user_id: str, service, start_dt, end_dt, calendar_id: str, tz_name: str,
+             refresh: bool = False) -> Optional[list]:
+        """Merged busy (start, end) epoch intervals overlapping the range, or None if it is
+        outside the indexed window."""
+        return self._answer(user_id, service, start_dt, end_dt, calendar_id, tz_name, refresh, _UserIndex.overlapping)
+
+    def _answer(self, user_id, service, start_dt, end_dt, calendar_id, tz_name, refresh, query):
+        index = self._user(user_id)
+        with index.lock:
+            drifting = index.window[1] - time.time() < self.horizon_days * 86400 / 2
+            if drifting:
+                # Window is running out (or was never filled); a full sync slides it forward
+                index.sync_token = None
+            if refresh or drifting or time.monotonic() - index.synced_at > self.max_staleness:
+                self._sync(index, service, calendar_id, tz_name)
+
+            start, end = start_dt.timestamp(), end_dt.timestamp()
+            if start < index.window[0] or end > index.window[1]:
+                return None
+            return query(index, start, end)
+
+    def add_event(self, user_id: str, event_id: str, start_dt, end_dt):
+        """Records an event we just inserted, without waiting for the next sync."""
+        with self._lock:
+            index = self._users.get(user_id)
+        if index is None:
+            return
+        with index.lock:
+            index.events[event_id] = (start_dt.timestamp(), end_dt.timestamp())
+            index.rebuild()
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def _sync(self, index: _UserIndex, service, calendar_id: str, tz_name: str):
+        events = service.events()
+        if index.sync_token:
+            params = {"syncToken": index.sync_token}
+        else:
+            now = time.time()
+            index.events.clear()
+            index.window = (now - 86400, now + self.horizon_days * 86400)
+            params = {
+                "timeMin": datetime.datetime.fromtimestamp(index.window[0], datetime.timezone.utc).isoformat(),
+                "timeMax": datetime.datetime.fromtimestamp(index.window[1], datetime.timezone.utc).isoformat(),
+            }
+
+        page_token = None
+        while True:
+            try:
+                response = events.list(
+                    calendarId=calendar_id, singleEvents=True, maxResults=2500,
+                    pageToken=page_token, fields=EVENT_FIELDS, **params
+                ).execute()
+            except Exception as e:
+                # 410 Gone: the sync token expired, start over with a full sync
+                if index.sync_token and getattr(getattr(e, "resp", None), "status", None) == 410:
+                    index.sync_token = None
+                    return self._sync(index, service, calendar_id, tz_name)
+                raise
+
+            for event in response.get("items", []):
+                if _frees_time(event):
+                    index.events.pop(event["id"], None)
+                elif "start" in event and "end" in event:
+                    index.events[event["id"]] = (
+                        event_epoch(event["start"], tz_name), event_epoch(event["end"], tz_name)
+                    )
+
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                index.sync_token = response.get("nextSyncToken")
+                break
+
+        index.rebuild()
+        index.synced_at = time.monotonic()
+
+busy_index = BusyIndex()
@@ -0,0 +1,201 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import AsyncIterator, Optional, Sequence
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.sqlite import SqliteSaver
+import settings
+from concurrency import run_blocking
+
+CHECKPOINT_BACKEND = os.getenv("CHECKPOINT_BACKEND", "sqlite")  # "sqlite", "memory" or "off"
+CHECKPOINT_DB_PATH = settings.data_path(os.getenv("CHECKPOINT_DB_PATH", "checkpoints.sqlite3"))
+# Older checkpoints of a thread are dropped; only the newest few are needed to resume or fork.
+CHECKPOINTS_PER_THREAD = int(os.getenv("CHECKPOINTS_PER_THREAD", "10"))
+# Threads untouched for this long are deleted by the periodic sweep.
+CHECKPOINT_THREAD_TTL = float(os.getenv("CHECKPOINT_THREAD_TTL", os.getenv("SESSION_TTL", "86400")))
+CHECKPOINT_SWEEP_INTERVAL = float(os.getenv("CHECKPOINT_SWEEP_INTERVAL", "300"))
+
+def thread_id(user_id: str, session_id: str) -> str:
+    """Graph thread for a chat session; namespaced by user so sessions cannot be shared across users."""
+    return f"{user_id}:{session_id}"
+
+def thread_config(user_id: str, session_id: str) -> RunnableConfig:
+    return {"configurable": {"thread_id": thread_id(user_id, session_id), "user_id": user_id}}
+
+class SQLiteCheckpointer(SqliteSaver):
+    """langgraph's SqliteSaver plus what the thread endpoints need on top of it.
+
+    A threads table records owner and last update for listing, forking and TTL
+    expiry, and only the newest CHECKPOINTS_PER_THREAD checkpoints of a thread are
+    kept (SqliteSaver stores each checkpoint whole, so the rest are never needed to
+    resume). Async methods run the sync ones on the blocking pool, since the graph is
+    driven through both invoke and ainvoke.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_DB_PATH, max_per_thread: int = CHECKPOINTS_PER_THREAD,
+                 ttl: float = CHECKPOINT_THREAD_TTL, sweep_interval: float = CHECKPOINT_SWEEP_INTERVAL):
+        super().__init__(sqlite3.connect(path, check_same_thread=False, timeout=5))
+        self.max_per_thread = max_per_thread
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.time()
+        self.setup()
+        with self.lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS threads (
+                    thread_id TEXT PRIMARY KEY,
+                    user_id TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    forked_from TEXT
+                );
+                CREATE INDEX IF NOT EXISTS threads_user ON threads(user_id, updated_at);
+            """)
+
+    # ==== Writes ====
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        configurable = saved["configurable"]
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO threads (thread_id, user_id, created_at, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(thread_id) DO UPDATE SET updated_at = excluded.updated_at",
+                (configurable["thread_id"], config["configurable"].get("user_id"), now, now),
+            )
+            self._prune(configurable["thread_id"], configurable["checkpoint_ns"])
+        self._maybe_sweep(now)
+        return saved
+
+    def _prune(self, tid: str, checkpoint_ns: str):
+        """Keeps the newest max_per_thread checkpoints (and their pending writes) of a thread."""
+        for table in ("writes", "checkpoints"):
+            self.conn.execute(
+                f"DELETE FROM {table} WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id IN ("
+                "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?)",
+                (tid, checkpoint_ns, tid, checkpoint_ns, self.max_per_thread),
+            )
+
+    # ==== Thread management ====
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM threads WHERE thread_id = ?", (str(thread_id),))
+
+    def list_threads(self, user_id: str, limit: int = 50) -> list:
+        """A user's threads, most recently updated first."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT t.thread_id, t.created_at, t.updated_at, t.forked_from, COUNT(c.checkpoint_id) "
+                "FROM threads t LEFT JOIN checkpoints c ON c.thread_id = t.thread_id "
+                "WHERE t.user_id = ? GROUP BY t.thread_id ORDER BY t.updated_at DESC LIMIT ?",
+                (user_id, limit),
+            ).fetchall()
+        return [
+            {"thread_id": tid, "created_at": created, "updated_at": updated,
+             "forked_from": forked_from, "checkpoints": count}
+            for tid, created, updated, forked_from, count in rows
+        ]
+
+    def copy_thread(self, source_thread_id: str, target_thread_id: str, checkpoint_id: Optional[str] = None,
+                    user_id: Optional[str] = None) -> Optional[str]:
+        """Forks a thread: the target starts from one checkpoint of the source (default: its latest).
+
+        Checkpoints are stored whole, so copying the single checkpoint and its pending
+        writes is enough to resume from it. Returns the copied checkpoint id, or None if
+        there was nothing to copy.
+        """
+        source = {"configurable": {"thread_id": source_thread_id, "checkpoint_ns": ""}}
+        if checkpoint_id:
+            source["configurable"]["checkpoint_id"] = checkpoint_id
+        saved = self.get_tuple(source)
+        if saved is None:
+            return None
+        target = {"configurable": {"thread_id": target_thread_id, "checkpoint_ns": "", "user_id": user_id}}
+        copied = self.put(target, saved.checkpoint, saved.metadata, {})
+        by_task = {}
+        for task_id, channel, value in saved.pending_writes or []:
+            by_task.setdefault(task_id, []).append((channel, value))
+        for task_id, writes in by_task.items():
+            self.put_writes(copied, writes, task_id)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE threads SET forked_from = ? WHERE thread_id = ?", (source_thread_id, target_thread_id)
+            )
+        return copied["configurable"]["checkpoint_id"]
+
+    def expire_threads(self, max_age: Optional[float] = None, user_id: Optional[str] = None) -> int:
+        """Deletes threads not updated within max_age seconds (default: the configured TTL),
+        only user_id's when given."""
+        cutoff = time.time() - (self.ttl if max_age is None else max_age)
+        query, params = "SELECT thread_id FROM threads WHERE updated_at < ?", [cutoff]
+        if user_id is not None:
+            query, params = query + " AND user_id = ?", params + [user_id]
+        with self.lock:
+            stale = [row[0] for row in self.conn.execute(query, params)]
+        for tid in stale:
+            self.delete_thread(tid)
+        return len(stale)
+
+    def _maybe_sweep(self, now: float):
+        with self.lock:
+            if now - self._last_sweep < self.sweep_interval:
+                return
+            self._last_sweep = now
+        expired = self.expire_threads()
+        if expired:
+            print(f"Expired {expired} checkpoint threads")
+
+    # ==== Async API (same queries, off the event loop) ====
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await run_blocking(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[dict] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        items = await run_blocking(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await run_blocking(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple], task_id: str,
+                          task_path: str = "") -> None:
+        await run_blocking(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await run_blocking(self.delete_thread, thread_id)
+
+    async def acopy_thread(self, source_thread_id: str, target_thread_id: str, checkpoint_id: Optional[str] = None,
+                           user_id: Optional[str] = None) -> Optional[str]:
+        return await run_blocking(self.copy_thread, source_thread_id, target_thread_id, checkpoint_id, user_id)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def _make_checkpointer() -> Optional[SQLiteCheckpointer]:
+    if CHECKPOINT_BACKEND == "sqlite":
+        return SQLiteCheckpointer(CHECKPOINT_DB_PATH)
+    if CHECKPOINT_BACKEND == "memory":
+        return SQLiteCheckpointer(":memory:")
+    return None
+
+_checkpointer = None
+_checkpointer_made = False
+_checkpointer_lock = threading.Lock()
+
+def get_checkpointer() -> Optional[SQLiteCheckpointer]:
+    """The shared checkpointer (None when CHECKPOINT_BACKEND is "off"), opened on first use so
+    importing this module creates no database."""
+    global _checkpointer, _checkpointer_made
+    if not _checkpointer_made:
+        with _checkpointer_lock:
+            if not _checkpointer_made:
+                _checkpointer, _checkpointer_made = _make_checkpointer(), True
+    return _checkpointer
@@ -0,0 +1,93 @@
+import os
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import ResourceExhausted
+import settings
+from rate_limiter import acquire, aacquire, quota_exceeded
+import resilience
+from metrics import span
+
+# ==== Concurrency Limits ====
+# How many /chat turns a single worker keeps in flight at once.
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "64"))
+# How many Gemini requests may be outstanding at once.
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "32"))
+# Threads reserved for the blocking googleapiclient / OAuth refresh calls.
+GOOGLE_API_MAX_WORKERS = int(os.getenv("GOOGLE_API_MAX_WORKERS", "32"))
+
+chat_slots = asyncio.Semaphore(CHAT_MAX_CONCURRENCY)
+gemini_slots = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+
+_blocking_pool = ThreadPoolExecutor(
+    max_workers=GOOGLE_API_MAX_WORKERS,
+    thread_name_prefix="google-api",
+)
+
+async def run_blocking(func, *args, **kwargs):
+    """Runs a blocking call in the bounded Google API thread pool without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    # Carry the caller's context so graph config / stream writers stay visible in the worker thread
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_blocking_pool, functools.partial(ctx.run, func, *args, **kwargs))
+
+def submit_blocking(func, *args, **kwargs):
+    """Sync counterpart of run_blocking: schedules the call on the same pool and returns its Future."""
+    ctx = contextvars.copy_context()
+    return _blocking_pool.submit(ctx.run, func, *args, **kwargs)
+
+def generate_content(model, contents, operation: str = "generate", **kwargs):
+    """Blocking Gemini generate_content call, admitted by the rate limiter; transient failures are retried.
+
+    operation names the call in latency metrics (e.g. "function_call", "extraction").
+    """
+    def attempt():
+        acquire("gemini")
+        try:
+            return model.generate_content(contents, **kwargs)
+        except ResourceExhausted as e:
+            raise quota_exceeded("gemini") from e
+    with span("gemini", operation):
+        return resilience.call("gemini", attempt)
+
+async def generate_content_async(model, contents, operation: str = "generate", **kwargs):
+    """Awaits a Gemini generate_content call, admitted by the rate limiter and bounded by GEMINI_MAX_CONCURRENCY."""
+    async def attempt():
+        await aacquire("gemini")
+        async with gemini_slots:
+            try:
+                return await model.generate_content_async(contents, **kwargs)
+            except ResourceExhausted as e:
+                raise quota_exceeded("gemini") from e
+    with span("gemini", operation):
+        return await resilience.acall("gemini", attempt)
+
+async def stream_content_async(model, contents, on_text=None, operation: str = "generate", **kwargs):
+    """Streams a Gemini response, passing each text chunk to on_text, and returns the resolved response.
+
+    A failed stream is only retried if none of its text has reached on_text yet.
+    """
+    emitted = False
+
+    async def attempt():
+        nonlocal emitted
+        await aacquire("gemini")
+        async with gemini_slots:
+            try:
+                response = await model.generate_content_async(contents, stream=True, **kwargs)
+                async for chunk in response:
+                    if not on_text or not chunk.candidates:
+                        continue
+                    for part in chunk.candidates[0].content.parts:
+                        if part.text:
+                            emitted = True
+                            on_text(part.text)
+            except ResourceExhausted as e:
+                raise quota_exceeded("gemini") from e
+            return response
+    with span("gemini", operation):
+        return await resilience.acall("gemini", attempt, idempotent=lambda: not emitted)
+
+def shutdown_blocking_pool():
+    _blocking_pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,145 @@
+import os
+import time
+import asyncio
+import datetime
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Optional, Callable, Awaitable
+from google.oauth2.credentials import Credentials
+import settings
+
+CREDENTIAL_CACHE_SIZE = int(os.getenv("CREDENTIAL_CACHE_SIZE", "1024"))
+# Upper bound on how long an entry lives even if the token itself is valid for longer.
+CREDENTIAL_CACHE_MAX_TTL = float(os.getenv("CREDENTIAL_CACHE_MAX_TTL", "3000"))
+# Entries are dropped this many seconds before the access token actually expires.
+CREDENTIAL_EXPIRY_SKEW = float(os.getenv("CREDENTIAL_EXPIRY_SKEW", "60"))
+
+class CredentialCache:
+    """Per-user LRU cache of Google credentials with expiry-based TTL and single-flight loading.
+
+    Concurrent misses for the same user share one loader call, from threads and coroutines
+    alike, so an expired token is refreshed and upserted once instead of once per in-flight
+    request.
+    """
+
+    def __init__(self, max_entries: int = CREDENTIAL_CACHE_SIZE,
+                 max_ttl: float = CREDENTIAL_CACHE_MAX_TTL,
+                 expiry_skew: float = CREDENTIAL_EXPIRY_SKEW):
+        self.max_entries = max_entries
+        self.max_ttl = max_ttl
+        self.expiry_skew = expiry_skew
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._generations: dict = {}
+        self._lock = threading.Lock()
+        self._flights: "dict[str, Future]" = {}   # user_id -> the load in progress
+
+    def _ttl_for(self, creds: Credentials) -> float:
+        if not creds.expiry:
+            return self.max_ttl
+        # google-auth keeps expiry as a naive UTC datetime
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        remaining = (creds.expiry - now).total_seconds() - self.expiry_skew
+        return min(remaining, self.max_ttl)
+
+    def get(self, user_id: str) -> Optional[Credentials]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if not entry:
+                return None
+            creds, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return creds
+
+    def put(self, user_id: str, creds: Credentials, generation: Optional[int] = None):
+        ttl = self._ttl_for(creds)
+        if ttl <= 0:
+            return
+        with self._lock:
+            # A load that started before an invalidate() must not repopulate stale tokens
+            if generation is not None and generation != self._generations.get(user_id, 0):
+                return
+            self._entries[user_id] = (creds, time.monotonic() + ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _generation(self, user_id: str) -> int:
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def _join_flight(self, user_id: str):
+        """(the user's load in progress, True if the caller just started it and must run it)."""
+        with self._lock:
+            flight = self._flights.get(user_id)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[user_id] = Future()
+            return flight, True
+
+    def _land(self, user_id: str, flight: Future):
+        with self._lock:
+            if self._flights.get(user_id) is flight:
+                del self._flights[user_id]
+
+    def get_or_load(self, user_id: str, loader: Callable[[str], Optional[Credentials]]) -> Optional[Credentials]:
+        creds = self.get(user_id)
+        if creds:
+            return creds
+
+        flight, owner = self._join_flight(user_id)
+        if not owner:
+            return flight.result()
+        try:
+            generation = self._generation(user_id)
+            creds = loader(user_id)
+            if creds:
+                self.put(user_id, creds, generation)
+            flight.set_result(creds)
+            return creds
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        finally:
+            self._land(user_id, flight)
+
+    async def aget_or_load(self, user_id: str,
+                           loader: Callable[[str], Awaitable[Optional[Credentials]]]) -> Optional[Credentials]:
+        creds = self.get(user_id)
+        if creds:
+            return creds
+
+        flight, owner = self._join_flight(user_id)
+        if owner:
+            # A task of its own, so one cancelled caller does not cancel the refresh for everyone else
+            asyncio.ensure_future(self._aload(user_id, loader, flight))
+        return await asyncio.shield(asyncio.wrap_future(flight))
+
+    async def _aload(self, user_id: str, loader, flight: Future):
+        try:
+            generation = self._generation(user_id)
+            creds = await loader(user_id)
+            if creds:
+                self.put(user_id, creds, generation)
+            flight.set_result(creds)
+        except asyncio.CancelledError:
+            flight.cancel()
+            raise
+        except BaseException as e:
+            flight.set_exception(e)
+        finally:
+            self._land(user_id, flight)
+
+credential_cache = CredentialCache()
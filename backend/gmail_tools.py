@@ -1,31 +1,52 @@
 import os
 import base64
 from email.mime.text import MIMEText
-import google.generativeai as genai
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from supabase_client import load_credentials
+from supabase_client import load_credentials, aload_credentials
+from service_pool import service_pool
+from rate_limiter import UpstreamUnavailable
+from concurrency import run_blocking
+from llm_cache import generate_text, agenerate_text
+from streaming import emit_token
 import json
 import re
-import dotenv
+import threading
+from collections import OrderedDict
+from typing import Optional
+import settings
 
-dotenv.load_dotenv()
-
-# Initialize Gemini Client for summarization
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    # from the agent_graph setup if the application is running correctly.
+# Gemini model for summarization, built on first use
+if not settings.GEMINI_API_KEY:
     print("Warning: GEMINI_API_KEY not set. Summarization will fail.")
-genai.configure(api_key=GEMINI_API_KEY)
-SUMMARIZER_MODEL = genai.GenerativeModel("gemini-2.5-flash")
+SUMMARIZER_MODEL = settings.gemini_model()
+
+SUMMARY_MEMO_SIZE = int(os.getenv("SUMMARY_MEMO_SIZE", "1024"))
+SUMMARY_BODY_MAX_CHARS = int(os.getenv("SUMMARY_BODY_MAX_CHARS", "8000"))
+DIGEST_MAX_EMAILS = int(os.getenv("DIGEST_MAX_EMAILS", "25"))
+# Gmail runs the items of one batch request in parallel, so this bounds per-user fan-out.
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "10"))
+# Rough prompt budget for the digest; bodies are truncated to share it (~4 chars per token).
+DIGEST_TOKEN_BUDGET = int(os.getenv("DIGEST_TOKEN_BUDGET", "6000"))
 
 def get_gmail_service(user_id: str):
-    """Loads credentials from Supabase, refreshes if needed, and builds the service."""
+    """Loads credentials from Supabase, refreshes if needed, and leases a pooled service.
+
+    Callers hand the service back with service_pool.release() when done.
+    """
     creds = load_credentials(user_id)
     if not creds:
         return None, "User not authorized or session expired. Please re-connect your Google account."
 
-    service = build('gmail', 'v1', credentials=creds)
+    service = service_pool.acquire('gmail', 'v1', user_id, creds)
+    return service, None
+
+async def aget_gmail_service(user_id: str):
+    """Async variant of get_gmail_service; building a new service runs in the Google API pool."""
+    creds = await aload_credentials(user_id)
+    if not creds:
+        return None, "User not authorized or session expired. Please re-connect your Google account."
+
+    service = await run_blocking(service_pool.acquire, 'gmail', 'v1', user_id, creds)
     return service, None
 
 def send_email_message(user_id: str, to_email: str, subject: str, body: str) -> dict:
@@ -33,7 +54,22 @@ def send_email_message(user_id: str, to_email: str, subject: str, body: str) ->
     service, error = get_gmail_service(user_id)
     if error:
         return {"status": "error", "message": f"Authorization error: {error}"}
-    
+    try:
+        return _send_email(service, to_email, subject, body)
+    finally:
+        service_pool.release(service)
+
+async def asend_email_message(user_id: str, to_email: str, subject: str, body: str) -> dict:
+    """Async variant of send_email_message."""
+    service, error = await aget_gmail_service(user_id)
+    if error:
+        return {"status": "error", "message": f"Authorization error: {error}"}
+    try:
+        return await run_blocking(_send_email, service, to_email, subject, body)
+    finally:
+        service_pool.release(service)
+
+def _send_email(service, to_email: str, subject: str, body: str) -> dict:
     try:
         message = MIMEText(body)
         message['to'] = to_email
@@ -52,36 +88,229 @@ def send_email_message(user_id: str, to_email: str, subject: str, body: str) ->
             "message": f"Email sent to {to_email} with subject '{subject}'. Message ID: {sent_message.get('id')}"
         }
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return {"status": "error", "message": f"An error occurred while sending the email: {str(e)}"}
     
-def summarize_last_email(user_id: str) -> dict:
-    """Fetches the last received email and returns its summary using Gemini."""
+def summarize_last_email(user_id: str, full_body: bool = False) -> dict:
+    """Fetches the last received email and returns its summary using Gemini.
+
+    Summarizes the snippet by default, or the full plain-text body when full_body is set.
+    """
     service, error = get_gmail_service(user_id)
     if error:
         return {"status": "error", "message": f"Authorization error: {error}"}
 
     try:
-        response = service.users().messages().list(userId='me', maxResults=1, labelIds=['INBOX']).execute()
-        
-        messages = response.get('messages', [])
-        if not messages:
+        message = _fetch_last_message(service)
+        if message is None:
+            return {"status": "error", "message": "No emails found in the inbox."}
+
+        memo_key = _summary_memo_key(user_id, message, full_body)
+        summary = _memo_get(memo_key)
+        if summary is None:
+            text = _fetch_plain_text(service, message['id']) if full_body else message.get('snippet', '')
+            summary = generate_text(SUMMARIZER_MODEL, _summary_prompt(text, full_body), operation="summarize")
+            _memo_put(memo_key, summary)
+
+        return {
+            "status": "success",
+            "snippet": message.get('snippet', ''),
+            "summary": summary
+        }
+
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        return {"status": "error", "message": f"An error occurred while summarizing the email: {str(e)}"}
+    finally:
+        service_pool.release(service)
+
+async def asummarize_last_email(user_id: str, full_body: bool = False) -> dict:
+    """Async variant of summarize_last_email; Gmail calls run in the pool, Gemini is awaited."""
+    service, error = await aget_gmail_service(user_id)
+    if error:
+        return {"status": "error", "message": f"Authorization error: {error}"}
+
+    try:
+        message = await run_blocking(_fetch_last_message, service)
+        if message is None:
             return {"status": "error", "message": "No emails found in the inbox."}
-        
-        msg_id = messages[0]['id']
-        message = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-        
-        snippet = message.get('snippet', '')
-        
-        prompt = f"Provide a concise, one-sentence summary of this email snippet: {snippet}"
-        gemini_response = SUMMARIZER_MODEL.generate_content(prompt)
-        summary = gemini_response.text.strip()
+
+        memo_key = _summary_memo_key(user_id, message, full_body)
+        summary = _memo_get(memo_key)
+        if summary is None:
+            if full_body:
+                text = await run_blocking(_fetch_plain_text, service, message['id'])
+            else:
+                text = message.get('snippet', '')
+            summary = await agenerate_text(SUMMARIZER_MODEL, _summary_prompt(text, full_body),
+                                           on_text=emit_token, operation="summarize")
+            _memo_put(memo_key, summary)
+        else:
+            emit_token(summary)
 
         return {
             "status": "success",
-            "snippet": snippet,
+            "snippet": message.get('snippet', ''),
             "summary": summary
         }
 
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        return {"status": "error", "message": f"An error occurred while summarizing the email: {str(e)}"}
+    finally:
+        service_pool.release(service)
+
+def summarize_recent_emails(user_id: str, n: int = 5, label: str = "INBOX", query: str = None) -> dict:
+    """Summarizes the newest n emails (optionally filtered by label / Gmail search query) in one digest."""
+    service, error = get_gmail_service(user_id)
+    if error:
+        return {"status": "error", "message": f"Authorization error: {error}"}
+
+    try:
+        messages = _fetch_recent_messages(service, n, label, query)
+        if not messages:
+            return {"status": "error", "message": "No matching emails found."}
+
+        digest = generate_text(SUMMARIZER_MODEL, _digest_prompt(messages), operation="digest")
+        return {"status": "success", "count": len(messages), "digest": digest}
+
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
-        return {"status": "error", "message": f"An error occurred while summarizing the email: {str(e)}"}
\ No newline at end of file
+        return {"status": "error", "message": f"An error occurred while summarizing recent emails: {str(e)}"}
+    finally:
+        service_pool.release(service)
+
+async def asummarize_recent_emails(user_id: str, n: int = 5, label: str = "INBOX", query: str = None) -> dict:
+    """Async variant of summarize_recent_emails."""
+    service, error = await aget_gmail_service(user_id)
+    if error:
+        return {"status": "error", "message": f"Authorization error: {error}"}
+
+    try:
+        messages = await run_blocking(_fetch_recent_messages, service, n, label, query)
+        if not messages:
+            return {"status": "error", "message": "No matching emails found."}
+
+        digest = await agenerate_text(SUMMARIZER_MODEL, _digest_prompt(messages),
+                                      on_text=emit_token, operation="digest")
+        return {"status": "success", "count": len(messages), "digest": digest}
+
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        return {"status": "error", "message": f"An error occurred while summarizing recent emails: {str(e)}"}
+    finally:
+        service_pool.release(service)
+
+def _fetch_recent_messages(service, n: int, label: str = "INBOX", query: str = None) -> list:
+    """Lists the newest n messages and fetches them with Gmail batch requests instead of one get per message."""
+    n = max(1, min(int(n or 5), DIGEST_MAX_EMAILS))
+    list_args = {"userId": 'me', "maxResults": n, "fields": 'messages/id'}
+    if label:
+        list_args["labelIds"] = [label]
+    if query:
+        list_args["q"] = query
+    ids = [m['id'] for m in service.users().messages().list(**list_args).execute().get('messages', [])]
+
+    fetched = {}
+    def collect(request_id, response, exception):
+        if exception is None:
+            fetched[request_id] = response
+
+    for start in range(0, len(ids), GMAIL_BATCH_SIZE):
+        batch = service.new_batch_http_request(callback=collect)
+        for msg_id in ids[start:start + GMAIL_BATCH_SIZE]:
+            batch.add(
+                service.users().messages().get(
+                    userId='me', id=msg_id, format='full',
+                    fields='id,snippet,payload(headers,mimeType,body/data,parts(mimeType,body/data,parts(mimeType,body/data)))'
+                ),
+                request_id=msg_id,
+            )
+        batch.execute()
+
+    body_chars = DIGEST_TOKEN_BUDGET * 4 // max(len(ids), 1)
+    messages = []
+    for msg_id in ids:
+        message = fetched.get(msg_id)
+        if not message:
+            continue
+        payload = message.get('payload', {})
+        headers = {h['name'].lower(): h['value'] for h in payload.get('headers', [])}
+        messages.append({
+            "from": headers.get('from', ''),
+            "subject": headers.get('subject', ''),
+            "date": headers.get('date', ''),
+            "body": (_plain_text(payload) or message.get('snippet', ''))[:body_chars],
+        })
+    return messages
+
+def _digest_prompt(messages: list) -> str:
+    emails = "\n\n".join(
+        f"Email {i}\nFrom: {m['from']}\nSubject: {m['subject']}\nDate: {m['date']}\n{m['body']}"
+        for i, m in enumerate(messages, start=1)
+    )
+    return (
+        "Write a short digest of these emails: one bullet per email with the sender and a "
+        "one-sentence summary, most important first.\n\n" + emails
+    )
+
+# ==== Lean Gmail fetches ====
+def _fetch_last_message(service) -> Optional[dict]:
+    """Returns id, historyId and snippet of the newest inbox message, or None if the inbox is empty."""
+    response = service.users().messages().list(
+        userId='me', maxResults=1, labelIds=['INBOX'], fields='messages/id'
+    ).execute()
+
+    messages = response.get('messages', [])
+    if not messages:
+        return None
+
+    return service.users().messages().get(
+        userId='me', id=messages[0]['id'], format='minimal', fields='id,historyId,snippet'
+    ).execute()
+
+def _fetch_plain_text(service, msg_id: str) -> str:
+    """Returns the decoded text/plain body of a message, truncated to SUMMARY_BODY_MAX_CHARS."""
+    message = service.users().messages().get(
+        userId='me', id=msg_id, format='full',
+        fields='payload(mimeType,body/data,parts(mimeType,body/data,parts(mimeType,body/data)))'
+    ).execute()
+    return _plain_text(message.get('payload', {}))[:SUMMARY_BODY_MAX_CHARS]
+
+def _plain_text(part: dict) -> str:
+    if part.get('mimeType') == 'text/plain' and part.get('body', {}).get('data'):
+        return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', errors='replace')
+    return "\n".join(filter(None, (_plain_text(p) for p in part.get('parts', []))))
+
+# ==== Summary memo ====
+# Keyed by Gmail message ID + historyId: an unchanged message is never re-summarized.
+_summary_memo: "OrderedDict[tuple, str]" = OrderedDict()
+_summary_memo_lock = threading.Lock()
+
+def _summary_memo_key(user_id: str, message: dict, full_body: bool) -> tuple:
+    return (user_id, message['id'], message.get('historyId'), full_body)
+
+def _memo_get(key: tuple) -> Optional[str]:
+    with _summary_memo_lock:
+        summary = _summary_memo.get(key)
+        if summary is not None:
+            _summary_memo.move_to_end(key)
+        return summary
+
+def _memo_put(key: tuple, summary: str):
+    with _summary_memo_lock:
+        _summary_memo[key] = summary
+        _summary_memo.move_to_end(key)
+        while len(_summary_memo) > SUMMARY_MEMO_SIZE:
+            _summary_memo.popitem(last=False)
+
+def _summary_prompt(text: str, full_body: bool = False) -> str:
+    if full_body:
+        return f"Provide a concise summary (at most three sentences) of this email: {text}"
+    return f"Provide a concise, one-sentence summary of this email snippet: {text}"
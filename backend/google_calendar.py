@@ -1,25 +1,50 @@
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
 from dateutil import parser
 import datetime
-import dotenv
-import pytz
+import settings
 import os
 import re
-from supabase_client import load_credentials
-
-dotenv.load_dotenv()
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from supabase_client import load_credentials, aload_credentials
+from service_pool import service_pool, spare_transport
+from rate_limiter import UpstreamUnavailable
+from concurrency import run_blocking
+from resilience import hedged
+from busy_index import busy_index, event_epoch
+from temporal import current_timezone, timezone_name, event_window, resolve
 
 CALENDAR_ID_DEFAULT = 'primary'
-TZ_KOLKATA = "Asia/Kolkata"
+WORKING_HOURS_DEFAULT = os.getenv("WORKING_HOURS", "09:00-18:00")
+# How far ahead create_event looks for alternatives when the requested slot is taken
+CONFLICT_SEARCH_DAYS = int(os.getenv("CONFLICT_SEARCH_DAYS", "3"))
+# freebusy accepts at most 50 calendars per query, one of which is the organizer's
+MAX_ATTENDEES = 49
+# Calendar batch requests take at most 50 calls
+BULK_MAX_EVENTS = 50
 
 def get_calendar_service(user_id: str):
-    """Loads credentials from Supabase, refreshes if needed, and builds the service."""
+    """Loads credentials from Supabase, refreshes if needed, and leases a pooled service.
+
+    Callers hand the service back with service_pool.release() when done.
+    """
     creds = load_credentials(user_id)
     if not creds:
         return None, "User not authorized or session expired. Please re-connect your calendar."
 
-    service = build('calendar', 'v3', credentials=creds)
+    service = service_pool.acquire('calendar', 'v3', user_id, creds)
+    return service, None
+
+async def aget_calendar_service(user_id: str):
+    """Async variant of get_calendar_service; building a new service runs in the Google API pool."""
+    creds = await aload_credentials(user_id)
+    if not creds:
+        return None, "User not authorized or session expired. Please re-connect your calendar."
+
+    service = await run_blocking(service_pool.acquire, 'calendar', 'v3', user_id, creds)
     return service, None
 
 # Basic email validation
@@ -27,66 +52,689 @@ def is_valid_email(email):
     pattern = r"^[\w\.-]+@[\w\.-]+\.\w+$"
     return re.match(pattern, email) is not None
 
-def is_time_slot_available(service, start_dt, end_dt):
+def is_time_slot_available(service, start_dt, end_dt, user_id: str = None):
+    """True if the slot is free. The check right before an insert, so it is always live: the
+    user's busy index is re-synced first (a syncToken delta), or freebusy is queried."""
+    try:
+        return not own_busy(service, user_id, start_dt, end_dt, refresh=True)
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        return {
+            "status": "error",
+            "message": f"Calendar API error: {str(e)}"
+        }
+
+# ==== Free slot search ====
+def query_busy(service, calendar_ids, start_dt, end_dt) -> dict:
+    """One freebusy query for all calendars; returns {calendar_id: [(start, end), ...]} as aware datetimes.
+
+    Calendars other than the user's own that cannot be read (not shared, unknown
+    address) are left out of the result rather than failing the whole query.
+    """
     body = {
         "timeMin": start_dt.isoformat(),
         "timeMax": end_dt.isoformat(),
-        "timeZone": TZ_KOLKATA,
-        "items": [{"id": CALENDAR_ID_DEFAULT}]
+        "timeZone": timezone_name(),
+        "items": [{"id": cal_id} for cal_id in calendar_ids]
     }
+    request = service.freebusy().query(body=body)
+    hedge_used = False
+
+    def attempt(primary: bool):
+        nonlocal hedge_used
+        if primary:
+            return request.execute()
+        hedge_used = True
+        # The hedge needs its own connection; httplib2 is not thread-safe
+        spare = spare_transport(service)
+        try:
+            return request.execute(http=spare)
+        finally:
+            spare.close()
 
+    response = hedged("calendar.freebusy", attempt)
+    if hedge_used:
+        # The slow primary may still be reading from the service's connection
+        service_pool.discard(service)
+    tz = current_timezone()
+    busy = {}
+    for cal_id in calendar_ids:
+        calendar = response["calendars"].get(cal_id, {})
+        if calendar.get("errors"):
+            if cal_id != CALENDAR_ID_DEFAULT:
+                continue
+            raise ValueError(f"Cannot read availability for {cal_id}: {calendar['errors'][0].get('reason')}")
+        busy[cal_id] = [
+            (parser.isoparse(b["start"]).astimezone(tz), parser.isoparse(b["end"]).astimezone(tz))
+            for b in calendar.get("busy", [])
+        ]
+    return busy
+
+def own_busy(service, user_id, start_dt, end_dt, refresh: bool = False) -> list:
+    """The user's busy intervals in the range as aware datetimes: from their busy index when it
+    covers the range (re-synced first if refresh), otherwise from one freebusy query."""
+    if user_id:
+        try:
+            busy = busy_index.busy(user_id, service, start_dt, end_dt, CALENDAR_ID_DEFAULT, timezone_name(), refresh)
+            if busy is not None:
+                tz = current_timezone()
+                return [(datetime.datetime.fromtimestamp(s, tz), datetime.datetime.fromtimestamp(e, tz)) for s, e in busy]
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            # Fall through to a live freebusy query
+            print(f"Busy index sync failed for {user_id}: {e}")
+    return query_busy(service, [CALENDAR_ID_DEFAULT], start_dt, end_dt)[CALENDAR_ID_DEFAULT]
+
+def merge_intervals(intervals) -> list:
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def _parse_working_hours(working_hours: str):
+    start, end = (resolve(part)[1] for part in working_hours.split("-"))
+    if start is None or end is None:
+        raise ValueError(f"Could not read working hours '{working_hours}'")
+    return start, end
+
+def free_slots(busy, window_start, window_end, duration, working_hours=WORKING_HOURS_DEFAULT,
+               count=3, include_weekends=False) -> list:
+    """Sweeps the merged busy intervals and returns up to `count` (start, end) slots of `duration`
+    inside working hours, earliest first."""
+    tz = current_timezone()
+    wh_start, wh_end = _parse_working_hours(working_hours)
+    busy = merge_intervals((start.astimezone(tz), end.astimezone(tz)) for start, end in busy)
+    window_start, window_end = window_start.astimezone(tz), window_end.astimezone(tz)
+    slots = []
+
+    day = window_start.astimezone(tz).date()
+    while day <= window_end.astimezone(tz).date() and len(slots) < count:
+        if include_weekends or day.weekday() < 5:
+            cursor = max(tz.localize(datetime.datetime.combine(day, wh_start)), window_start)
+            day_end = min(tz.localize(datetime.datetime.combine(day, wh_end)), window_end)
+            # Round up to the next quarter hour so suggestions look like times people pick;
+            # never down, which could suggest a start that has already passed
+            quarter = cursor.replace(minute=cursor.minute - cursor.minute % 15, second=0, microsecond=0)
+            if quarter < cursor:
+                cursor = quarter + datetime.timedelta(minutes=15)
+            for busy_start, busy_end in busy + [(day_end, day_end)]:
+                if busy_end <= cursor:
+                    continue
+                gap_end = min(busy_start, day_end)
+                while cursor + duration <= gap_end and len(slots) < count:
+                    slots.append((cursor, cursor + duration))
+                    cursor += duration
+                cursor = max(cursor, busy_end)
+                if cursor >= day_end or len(slots) >= count:
+                    break
+        day += datetime.timedelta(days=1)
+    return slots
+
+def slot_label(start: datetime.datetime, end: datetime.datetime) -> str:
+    return f"{start.strftime('%a %d %b, %I:%M %p')} - {end.strftime('%I:%M %p')}"
+
+def find_free_slots(user_id: str, duration_minutes=60, start_date=None, days=7,
+                    working_hours=WORKING_HOURS_DEFAULT, count=3):
+    """Finds the earliest free slots in the user's calendar, from the busy index (or one freebusy query)."""
+    service, error = get_calendar_service(user_id)
+    if error:
+        return {"status": "error", "message": f"Authorization error: {error}"}
     try:
-        response = service.freebusy().query(body=body).execute()
-        busy_times = response["calendars"][CALENDAR_ID_DEFAULT].get("busy", [])
-        return len(busy_times) == 0  # True = free
-    except Exception as e:
+        return _find_free_slots(service, user_id, duration_minutes, start_date, days, working_hours, count)
+    finally:
+        service_pool.release(service)
+
+async def afind_free_slots(user_id: str, duration_minutes=60, start_date=None, days=7,
+                           working_hours=WORKING_HOURS_DEFAULT, count=3):
+    """Async variant of find_free_slots."""
+    service, error = await aget_calendar_service(user_id)
+    if error:
+        return {"status": "error", "message": f"Authorization error: {error}"}
+    try:
+        return await run_blocking(_find_free_slots, service, user_id, duration_minutes, start_date, days,
+                                  working_hours, count)
+    finally:
+        service_pool.release(service)
+
+def _find_free_slots(service, user_id, duration_minutes, start_date, days, working_hours, count):
+    try:
+        tz = current_timezone()
+        now = datetime.datetime.now(tz)
+        start_day = resolve(start_date)[0] if start_date else None
+        if start_date and start_day is None:
+            return {"status": "error", "message": f"Could not read the start date '{start_date}'."}
+        window_start = tz.localize(datetime.datetime.combine(start_day, datetime.time())) if start_day else now
+        window_start = max(window_start, now)
+        window_end = window_start + datetime.timedelta(days=int(days or 7))
+        duration = datetime.timedelta(minutes=int(duration_minutes or 60))
+
+        busy = own_busy(service, user_id, window_start, window_end)
+        slots = free_slots(busy, window_start, window_end, duration,
+                           working_hours or WORKING_HOURS_DEFAULT, int(count or 3))
+        if not slots:
+            return {"status": "error", "message": "No free slots found in that window."}
         return {
-            "status": "error",
-            "message": f"Calendar API error: {str(e)}"
+            "status": "success",
+            "slots": [{"start": s.isoformat(), "end": e.isoformat(), "label": slot_label(s, e)} for s, e in slots]
         }
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        return {"status": "error", "message": f"Free slot search failed: {str(e)}"}
+
+def _conflict_response(service, user_id, start_dt, end_dt) -> dict:
+    """Slot-taken error that also offers the next free slots of the same length."""
+    response = {
+        "status": "error",
+        "message": "The selected time slot is not available. Please choose another time."
+    }
+    try:
+        window_end = start_dt + datetime.timedelta(days=CONFLICT_SEARCH_DAYS)
+        # The index was re-synced by the availability check that found the conflict
+        busy = own_busy(service, user_id, start_dt, window_end)
+        slots = free_slots(busy, start_dt, window_end, end_dt - start_dt, include_weekends=True)
+    except Exception as e:
+        print(f"Free slot suggestion failed: {e}")
+        return response
+    if slots:
+        response["suggestions"] = [{"start": s.isoformat(), "end": e.isoformat()} for s, e in slots]
+        response["message"] = (
+            "The selected time slot is not available. Free slots: "
+            + "; ".join(slot_label(s, e) for s, e in slots)
+        )
+    return response
 
-def create_event(user_id: str, date, time, topic):
-    """Schedules an event for the given user ID."""
+def create_event(user_id: str, date, time, topic, attendees=None, flexible=False):
+    """Schedules an event for the given user ID, optionally inviting attendees."""
     service, error = get_calendar_service(user_id)
     if error:
         return {"status": "error", "message": f"Authorization error: {error}"}
+    try:
+        return _create_event(service, user_id, date, time, topic, attendees, flexible)
+    finally:
+        service_pool.release(service)
 
+async def acreate_event(user_id: str, date, time, topic, attendees=None, flexible=False):
+    """Async variant of create_event; freebusy and insert run in the Google API pool."""
+    service, error = await aget_calendar_service(user_id)
+    if error:
+        return {"status": "error", "message": f"Authorization error: {error}"}
     try:
-        # Parse and sanitize natural language input
-        start_dt = parser.parse(f"{date} {time}", fuzzy=True)
-        end_dt = start_dt + datetime.timedelta(hours=1)
-
-        tz = pytz.timezone(TZ_KOLKATA)
-        start_dt = tz.localize(start_dt)
-        end_dt = tz.localize(end_dt)
-
-        # Check slot availability
-        availability = is_time_slot_available(service, start_dt, end_dt)
-        if isinstance(availability, dict) and availability.get("status") == "error":
-            return availability
-
-        if not availability:
-            return {
-                "status": "error",
-                "message": "The selected time slot is not available. Please choose another time."
-            }
+        return await run_blocking(_create_event, service, user_id, date, time, topic, attendees, flexible)
+    finally:
+        service_pool.release(service)
+
+def _attendee_availability(service, user_id, attendees, start_dt, end_dt, flexible):
+    """Checks the organizer (live, through the busy index) and every attendee with one freebusy query.
+
+    Returns (start_dt, end_dt, note, error). When the requested slot is taken and
+    `flexible` is set, the first common free slot replaces it.
+    """
+    window_end = start_dt + datetime.timedelta(days=CONFLICT_SEARCH_DAYS)
+    busy = query_busy(service, attendees, start_dt, window_end)
+    busy[CALENDAR_ID_DEFAULT] = own_busy(service, user_id, start_dt, window_end, refresh=True)
+
+    notes = []
+    unknown = [a for a in attendees if a not in busy]
+    if unknown:
+        notes.append(f"Could not check availability for: {', '.join(unknown)}.")
+
+    conflicts = [
+        cal_id for cal_id, intervals in busy.items()
+        if any(b_start < end_dt and b_end > start_dt for b_start, b_end in intervals)
+    ]
+    if not conflicts:
+        return start_dt, end_dt, " ".join(notes), None
+
+    # Union of everyone's busy time; its gaps are the intersection of their free time
+    all_busy = [interval for intervals in busy.values() for interval in intervals]
+    slots = free_slots(all_busy, start_dt, window_end, end_dt - start_dt,
+                       count=1 if flexible else 3, include_weekends=True)
+    names = ["you" if c == CALENDAR_ID_DEFAULT else c for c in conflicts]
+
+    if flexible and slots:
+        notes.insert(0, f"Requested time was busy for {', '.join(names)}; moved to the first common free slot.")
+        return slots[0][0], slots[0][1], " ".join(notes), None
+
+    error = {
+        "status": "error",
+        "message": f"The selected time slot is not available for {', '.join(names)}.",
+        "suggestions": [{"start": s.isoformat(), "end": e.isoformat()} for s, e in slots]
+    }
+    if slots:
+        error["message"] += " Common free slots: " + "; ".join(slot_label(s, e) for s, e in slots)
+    return start_dt, end_dt, None, error
+
+def _event_times(date, time, duration_minutes=60):
+    # Natural language input ("next tuesday", "4pm") is read in the user's timezone
+    return event_window(date, time, duration_minutes)
+
+def _create_event(service, user_id: str, date, time, topic, attendees=None, flexible=False):
+    try:
+        attendees = [a.strip() for a in (attendees or []) if a and a.strip()]
+        invalid = [a for a in attendees if not is_valid_email(a)]
+        if invalid:
+            return {"status": "error", "message": f"Invalid attendee email: {', '.join(invalid)}"}
+        if len(attendees) > MAX_ATTENDEES:
+            return {"status": "error", "message": f"Too many attendees (max {MAX_ATTENDEES})."}
+
+        start_dt, end_dt = _event_times(date, time)
+
+        note = None
+        if attendees:
+            start_dt, end_dt, note, error = _attendee_availability(service, user_id, attendees, start_dt, end_dt, flexible)
+            if error:
+                return error
+        else:
+            # Check slot availability
+            availability = is_time_slot_available(service, start_dt, end_dt, user_id)
+            if isinstance(availability, dict) and availability.get("status") == "error":
+                return availability
+
+            if not availability:
+                return _conflict_response(service, user_id, start_dt, end_dt)
         
         event = {
             "summary": topic,
-            "start": {"dateTime": start_dt.isoformat(), "timeZone": TZ_KOLKATA},
-            "end": {"dateTime": end_dt.isoformat(), "timeZone": TZ_KOLKATA}
+            "start": {"dateTime": start_dt.isoformat(), "timeZone": timezone_name()},
+            "end": {"dateTime": end_dt.isoformat(), "timeZone": timezone_name()}
         }
+        insert_args = {}
+        if attendees:
+            event["attendees"] = [{"email": a} for a in attendees]
+            insert_args["sendUpdates"] = "all"
 
         result = service.events().insert(
             calendarId=CALENDAR_ID_DEFAULT, 
-            body=event
+            body=event,
+            **insert_args
         ).execute()
+        busy_index.add_event(user_id, result.get("id"), start_dt, end_dt)
+        events_cache.touch(user_id)
 
-        return {
+        response = {
             "status": "success",
             "eventLink": result.get("htmlLink"),
             "eventId": result.get("id"),
         }
+        if attendees:
+            response["attendees"] = attendees
+            response["start"] = start_dt.isoformat()
+        if note:
+            response["note"] = note
+        return response
 
+    except UpstreamUnavailable:
+        raise
     except Exception as e:
         return {"status": "error", "message": f"Event creation failed: {str(e)}"}
+
+# ==== Bulk creation ====
+def create_events_bulk(user_id: str, events):
+    """Creates several events: one freebusy query for all slots, then one batch insert."""
+    service, error = get_calendar_service(user_id)
+    if error:
+        return {"status": "error", "message": f"Authorization error: {error}"}
+    try:
+        return _create_events_bulk(service, user_id, events)
+    finally:
+        service_pool.release(service)
+
+async def acreate_events_bulk(user_id: str, events):
+    """Async variant of create_events_bulk."""
+    service, error = await aget_calendar_service(user_id)
+    if error:
+        return {"status": "error", "message": f"Authorization error: {error}"}
+    try:
+        return await run_blocking(_create_events_bulk, service, user_id, events)
+    finally:
+        service_pool.release(service)
+
+def _create_events_bulk(service, user_id: str, events):
+    events = [dict(e) for e in (events or [])]
+    if not events:
+        return {"status": "error", "message": "No events to create."}
+    if len(events) > BULK_MAX_EVENTS:
+        return {"status": "error", "message": f"Too many events in one request (max {BULK_MAX_EVENTS})."}
+
+    results = [None] * len(events)
+    planned = []  # (index, body, start_dt, end_dt, calendars)
+    for i, item in enumerate(events):
+        topic = item.get("topic")
+        attendees = [a.strip() for a in (item.get("attendees") or []) if a and a.strip()]
+        invalid = [a for a in attendees if not is_valid_email(a)]
+        if not topic or invalid:
+            reason = f"Invalid attendee email: {', '.join(invalid)}" if invalid else "Missing topic."
+            results[i] = {"status": "error", "topic": topic, "message": reason}
+            continue
+        try:
+            start_dt, end_dt = _event_times(item.get("date"), item.get("time"), item.get("duration_minutes"))
+        except (ValueError, OverflowError) as e:
+            results[i] = {"status": "error", "topic": topic, "message": f"Could not read date/time: {e}"}
+            continue
+        body = {
+            "summary": topic,
+            "start": {"dateTime": start_dt.isoformat(), "timeZone": timezone_name()},
+            "end": {"dateTime": end_dt.isoformat(), "timeZone": timezone_name()}
+        }
+        if attendees:
+            body["attendees"] = [{"email": a} for a in attendees]
+        planned.append((i, body, start_dt, end_dt, [CALENDAR_ID_DEFAULT] + attendees))
+
+    if planned:
+        calendars = list(dict.fromkeys(c for p in planned for c in p[4]))
+        if len(calendars) > MAX_ATTENDEES + 1:
+            return {"status": "error", "message": f"Too many distinct attendees (max {MAX_ATTENDEES})."}
+        try:
+            busy = query_busy(service, calendars,
+                              min(p[2] for p in planned), max(p[3] for p in planned))
+        except UpstreamUnavailable:
+            raise
+        except Exception as e:
+            return {"status": "error", "message": f"Calendar API error: {str(e)}"}
+
+        to_insert = []
+        for i, body, start_dt, end_dt, cals in planned:
+            conflicts = [
+                c for c in cals
+                if any(b_start < end_dt and b_end > start_dt for b_start, b_end in busy.get(c, []))
+            ]
+            if conflicts:
+                names = ["you" if c == CALENDAR_ID_DEFAULT else c for c in conflicts]
+                results[i] = {"status": "error", "topic": body["summary"],
+                              "message": f"Slot not available for {', '.join(names)}."}
+                continue
+            # Later items in the same request must not overlap the ones booked before them
+            for c in cals:
+                busy.setdefault(c, []).append((start_dt, end_dt))
+            to_insert.append((i, body, start_dt, end_dt))
+
+        _batch_insert(service, user_id, to_insert, results)
+
+    created = sum(1 for r in results if r["status"] == "success")
+    return {
+        "status": "success" if created else "error",
+        "created": created,
+        "total": len(events),
+        "results": results,
+        "message": f"Created {created} of {len(events)} events."
+    }
+
+def _batch_insert(service, user_id: str, items, results):
+    """Inserts events in one Calendar batch request, recording a per-item result."""
+    if not items:
+        return
+    by_request = {str(i): (i, body, start_dt, end_dt) for i, body, start_dt, end_dt in items}
+
+    def collect(request_id, response, exception):
+        i, body, start_dt, end_dt = by_request[request_id]
+        if exception is not None:
+            results[i] = {"status": "error", "topic": body["summary"], "message": str(exception)}
+            return
+        busy_index.add_event(user_id, response.get("id"), start_dt, end_dt)
+        events_cache.touch(user_id)
+        results[i] = {"status": "success", "topic": body["summary"], "start": start_dt.isoformat(),
+                      "eventLink": response.get("htmlLink"), "eventId": response.get("id")}
+
+    batch = service.new_batch_http_request(callback=collect)
+    for request_id, (i, body, _, _) in by_request.items():
+        insert_args = {"sendUpdates": "all"} if body.get("attendees") else {}
+        batch.add(
+            service.events().insert(calendarId=CALENDAR_ID_DEFAULT, body=body, **insert_args),
+            request_id=request_id,
+        )
+    try:
+        batch.execute()
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        for request_id, (i, body, _, _) in by_request.items():
+            if results[i] is None:
+                results[i] = {"status": "error", "topic": body["summary"], "message": f"Batch insert failed: {e}"}
+
+# ==== Event listing ====
+# Served from a per-user copy of the next EVENTS_CACHE_HORIZON_DAYS of events, kept fresh
+# with syncTokens like the busy index; ranges outside it go straight to events.list.
+EVENTS_CACHE_TTL = float(os.getenv("EVENTS_CACHE_TTL", "30"))
+EVENTS_CACHE_HORIZON_DAYS = int(os.getenv("EVENTS_CACHE_HORIZON_DAYS", "30"))
+EVENTS_CACHE_MAX_USERS = int(os.getenv("EVENTS_CACHE_MAX_USERS", "1024"))
+EVENTS_DEFAULT_DAYS = int(os.getenv("EVENTS_DEFAULT_DAYS", "7"))
+EVENTS_PAGE_MAX = 250
+EVENT_LIST_FIELDS = (
+    "etag,nextPageToken,nextSyncToken,items(id,status,summary,description,location,htmlLink,"
+    "start,end,attendees(email,responseStatus),organizer(email),updated)"
+)
+
+class _UserEvents:
+    def __init__(self):
+        self.events = {}        # event id -> (start, end, event), epoch seconds
+        self.ordered = []       # values of events, sorted by start
+        self.sync_token = None
+        self.window = (0.0, 0.0)
+        self.synced_at = 0.0
+        self.version = 0        # bumped whenever the copy changes; part of the ETag
+        self.lock = threading.Lock()
+
+class EventCache:
+    """Per-user copy of the primary calendar's upcoming events for GET /calendar/events."""
+
+    def __init__(self, ttl: float = EVENTS_CACHE_TTL, horizon_days: int = EVENTS_CACHE_HORIZON_DAYS,
+                 max_users: int = EVENTS_CACHE_MAX_USERS):
+        self.ttl = ttl
+        self.horizon_days = horizon_days
+        self.max_users = max_users
+        self._users: "OrderedDict[str, _UserEvents]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _user(self, user_id: str) -> _UserEvents:
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                entry = self._users[user_id] = _UserEvents()
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return entry
+
+    def events(self, user_id: str, service, start: float, end: float):
+        """(events overlapping [start, end) sorted by start, version), or None if the range is
+        outside what the cache covers."""
+        now = time.time()
+        if start < now - 86400 or end > now + self.horizon_days * 86400:
+            return None
+        entry = self._user(user_id)
+        with entry.lock:
+            if entry.window[1] < end:
+                # Window has slid past the range (or was never filled); start over
+                entry.sync_token = None
+            if entry.sync_token is None or time.monotonic() - entry.synced_at > self.ttl:
+                self._sync(entry, service)
+            items = [event for s, e, event in entry.ordered if e > start and s < end]
+            return items, entry.version
+
+    def touch(self, user_id: str):
+        """Marks the user's copy stale, e.g. after we inserted events, so the next read syncs."""
+        with self._lock:
+            entry = self._users.get(user_id)
+        if entry is not None:
+            entry.synced_at = 0.0
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def _sync(self, entry: _UserEvents, service):
+        tz_name = timezone_name()
+        if entry.sync_token:
+            params = {"syncToken": entry.sync_token}
+        else:
+            now = time.time()
+            entry.events.clear()
+            entry.window = (now - 86400, now + self.horizon_days * 86400)
+            params = {
+                "timeMin": datetime.datetime.fromtimestamp(entry.window[0], datetime.timezone.utc).isoformat(),
+                "timeMax": datetime.datetime.fromtimestamp(entry.window[1], datetime.timezone.utc).isoformat(),
+            }
+
+        changed = "timeMin" in params
+        page_token = None
+        while True:
+            try:
+                response = service.events().list(
+                    calendarId=CALENDAR_ID_DEFAULT, singleEvents=True, maxResults=2500,
+                    pageToken=page_token, fields=EVENT_LIST_FIELDS, **params
+                ).execute()
+            except Exception as e:
+                # 410 Gone: the sync token expired, start over with a full sync
+                if entry.sync_token and getattr(getattr(e, "resp", None), "status", None) == 410:
+                    entry.sync_token = None
+                    return self._sync(entry, service)
+                raise
+
+            for event in response.get("items", []):
+                changed = True
+                if event.get("status") == "cancelled":
+                    entry.events.pop(event["id"], None)
+                elif "start" in event and "end" in event:
+                    entry.events[event["id"]] = (
+                        event_epoch(event["start"], tz_name), event_epoch(event["end"], tz_name), event
+                    )
+
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                entry.sync_token = response.get("nextSyncToken")
+                break
+
+        if changed:
+            entry.ordered = sorted(entry.events.values(), key=lambda item: (item[0], item[1]))
+            entry.version += 1
+        entry.synced_at = time.monotonic()
+
+events_cache = EventCache()
+
+def _event_range(time_min, time_max, tz):
+    """Aware [start, end) from ISO timestamps or dates ('2025-01-31', 'next monday').
+
+    Defaults to the start of today through EVENTS_DEFAULT_DAYS days later, so repeated
+    dashboard loads ask for the same range (and get the same ETag).
+    """
+    def parse(text, default):
+        if not text:
+            return default
+        try:
+            parsed = datetime.datetime.fromisoformat(text.replace("Z", "+00:00"))
+            return parsed if parsed.tzinfo else tz.localize(parsed)
+        except ValueError:
+            day, clock = resolve(text)
+            if day is None:
+                raise ValueError(f"Could not read the time '{text}'")
+            return tz.localize(datetime.datetime.combine(day, clock or datetime.time()))
+
+    today = tz.localize(datetime.datetime.combine(datetime.datetime.now(tz).date(), datetime.time()))
+    start = parse(time_min, today)
+    end = parse(time_max, start + datetime.timedelta(days=EVENTS_DEFAULT_DAYS))
+    if end <= start:
+        raise ValueError("time_max must be after time_min")
+    return start, end
+
+def _etag(*parts) -> str:
+    return 'W/"' + hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()[:20] + '"'
+
+def list_events(user_id: str, time_min=None, time_max=None, page_token=None, max_results=50):
+    """Lists the user's events in [time_min, time_max), earliest first, a page at a time."""
+    service, error = get_calendar_service(user_id)
+    if error:
+        return {"status": "error", "message": f"Authorization error: {error}"}
+    try:
+        return _list_events(service, user_id, time_min, time_max, page_token, max_results)
+    finally:
+        service_pool.release(service)
+
+async def alist_events(user_id: str, time_min=None, time_max=None, page_token=None, max_results=50):
+    """Async variant of list_events; syncing runs in the Google API pool."""
+    service, error = await aget_calendar_service(user_id)
+    if error:
+        return {"status": "error", "message": f"Authorization error: {error}"}
+    try:
+        return await run_blocking(_list_events, service, user_id, time_min, time_max, page_token, max_results)
+    finally:
+        service_pool.release(service)
+
+def _list_events(service, user_id: str, time_min, time_max, page_token, max_results):
+    """Returns {"items", "nextPageToken", "timeZone", "etag"}. Page tokens starting with
+    "c:" are offsets into the cached copy; "g:" wraps a Calendar API page token."""
+    try:
+        tz = current_timezone()
+        start, end = _event_range(time_min, time_max, tz)
+        max_results = max(1, min(int(max_results or 50), EVENTS_PAGE_MAX))
+        page_token = page_token or ""
+
+        if not page_token.startswith("g:"):
+            cached = events_cache.events(user_id, service, start.timestamp(), end.timestamp())
+            if cached is not None:
+                items, version = cached
+                offset = int(page_token[2:] or 0) if page_token.startswith("c:") else 0
+                result = {
+                    "status": "success",
+                    "items": items[offset:offset + max_results],
+                    "timeZone": timezone_name(),
+                    "etag": _etag(user_id, version, start, end, offset, max_results, timezone_name()),
+                }
+                if offset + max_results < len(items):
+                    result["nextPageToken"] = f"c:{offset + max_results}"
+                return result
+            if page_token.startswith("c:"):
+                # The range is no longer cached (e.g. the day rolled over between pages):
+                # re-read it from the first page and apply the offset there
+                return _list_events_from_offset(service, user_id, start, end, int(page_token[2:] or 0), max_results)
+
+        response = service.events().list(
+            calendarId=CALENDAR_ID_DEFAULT, singleEvents=True, orderBy="startTime",
+            timeMin=start.isoformat(), timeMax=end.isoformat(), timeZone=timezone_name(),
+            maxResults=max_results, pageToken=page_token[2:] or None, fields=EVENT_LIST_FIELDS,
+        ).execute()
+        result = {
+            "status": "success",
+            "items": [e for e in response.get("items", []) if e.get("status") != "cancelled"],
+            "timeZone": timezone_name(),
+            "etag": _etag(user_id, response.get("etag"), start, end, page_token, max_results),
+        }
+        if response.get("nextPageToken"):
+            result["nextPageToken"] = "g:" + response["nextPageToken"]
+        return result
+    except UpstreamUnavailable:
+        raise
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    except Exception as e:
+        return {"status": "error", "message": f"Calendar API error: {str(e)}"}
+
+def _list_events_from_offset(service, user_id: str, start, end, offset: int, max_results: int):
+    """Serves a "c:" page without the cache: pages through the Calendar API from the start
+    of the range, skipping the first `offset` events. Keeps handing out "c:" tokens."""
+    items, page_token = [], None
+    while len(items) <= offset + max_results:
+        response = service.events().list(
+            calendarId=CALENDAR_ID_DEFAULT, singleEvents=True, orderBy="startTime",
+            timeMin=start.isoformat(), timeMax=end.isoformat(), timeZone=timezone_name(),
+            maxResults=EVENTS_PAGE_MAX, pageToken=page_token, fields=EVENT_LIST_FIELDS,
+        ).execute()
+        items += [e for e in response.get("items", []) if e.get("status") != "cancelled"]
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            break
+    result = {
+        "status": "success",
+        "items": items[offset:offset + max_results],
+        "timeZone": timezone_name(),
+        "etag": _etag(user_id, [(e.get("id"), e.get("updated")) for e in items[offset:offset + max_results]],
+                      start, end, offset, max_results, timezone_name()),
+    }
+    if offset + max_results < len(items) or page_token:
+        result["nextPageToken"] = f"c:{offset + max_results}"
+    return result
@@ -0,0 +1,395 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import contextvars
+from collections import Counter, OrderedDict, deque
+from typing import Optional
+import settings
+from concurrency import run_blocking
+from metrics import span, add_timing
+from rate_limiter import set_request_user
+from temporal import set_request_timezone, timezone_name
+from tool_registry import registry
+
+# Slow side-effecting tools (send email, create events, summaries) can run as background
+# jobs: the turn replies at once with a job ID and the result is fetched from GET /jobs/{id}
+# or waited for on the /chat/stream channel.
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "false").lower() == "true"
+JOB_BACKEND = os.getenv("JOB_BACKEND", "memory")  # "memory" or "sqlite"
+JOB_DB_PATH = settings.data_path(os.getenv("JOB_DB_PATH", "jobs.sqlite3"))
+# In-process worker threads; 0 leaves the queue to `python -m job_queue` (sqlite backend only)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_TTL = float(os.getenv("JOB_TTL", "86400"))                 # finished jobs (and their keys) kept this long
+JOB_LEASE = float(os.getenv("JOB_LEASE", "300"))               # a running job older than this was lost
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "0.5"))
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, INTERRUPTED = "queued", "running", "succeeded", "failed", "interrupted"
+FINISHED = (SUCCEEDED, FAILED, INTERRUPTED)
+INTERRUPTED_REPLY = "This job was interrupted before it finished. Check before trying again, it may have gone through."
+
+# ==== Turn tracking ====
+class _Turn:
+    """Client idempotency key and the jobs enqueued during one /chat turn."""
+
+    def __init__(self, idempotency_key: Optional[str]):
+        self.idempotency_key = idempotency_key
+        self.jobs = []
+        self._calls = Counter()
+        self._lock = threading.Lock()
+
+    def ordinal(self, tool: str) -> int:
+        with self._lock:
+            self._calls[tool] += 1
+            return self._calls[tool]
+
+_turn = contextvars.ContextVar("job_turn", default=None)
+
+def begin_turn(idempotency_key: Optional[str] = None) -> _Turn:
+    """Starts collecting the jobs this context (and threads it spawns) enqueues."""
+    turn = _Turn(idempotency_key)
+    _turn.set(turn)
+    return turn
+
+def turn_jobs() -> list:
+    """IDs of the jobs enqueued so far in this context's turn."""
+    turn = _turn.get()
+    return list(turn.jobs) if turn else []
+
+def _idempotency_key(user_id: str, tool: str, turn: Optional[_Turn]) -> Optional[str]:
+    """Key under which a retried turn finds the job its first attempt made, even if the model
+    words the args differently. None (never deduplicated) without a client key or for reads;
+    an identical request sent on purpose is a new job."""
+    spec = registry.get(tool)
+    if not turn or not turn.idempotency_key or spec is None or spec.idempotent:
+        return None
+    raw = [user_id, turn.idempotency_key, tool, turn.ordinal(tool)]
+    return hashlib.sha256(json.dumps(raw).encode()).hexdigest()
+
+# ==== Stores ====
+class MemoryJobStore:
+    """Process-local queue; jobs are lost on restart."""
+
+    def __init__(self):
+        self._jobs = OrderedDict()      # id -> job, oldest first
+        self._keys = {}                 # idempotency key -> id
+        self._queued = deque()
+        self._lock = threading.Lock()
+
+    def add(self, job: dict, window: float):
+        """Stores job unless one with its key was created within window; returns (job, created)."""
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            existing = self._jobs.get(self._keys.get(job["key"])) if window else None
+            if existing and existing["created_at"] > now - window:
+                return dict(existing), False
+            self._jobs[job["id"]] = dict(job)
+            self._keys[job["key"]] = job["id"]
+            if job["status"] == QUEUED:
+                self._queued.append(job["id"])
+            return job, True
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def claim(self) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            while self._queued:
+                job = self._jobs.get(self._queued.popleft())
+                if job and job["status"] == QUEUED:
+                    job.update(status=RUNNING, updated_at=now, lease_until=now + JOB_LEASE)
+                    return dict(job)
+            return None
+
+    def finish(self, job_id: str, status: str, result: dict, reply: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.update(status=status, result=result, reply=reply, updated_at=time.time())
+
+    def _prune(self, now: float):
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if job["status"] not in FINISHED or job["updated_at"] > now - JOB_TTL:
+                break
+            self._jobs.popitem(last=False)
+            if self._keys.get(job["key"]) == job["id"]:
+                del self._keys[job["key"]]
+
+class SQLiteJobStore:
+    """On-disk queue shared by every uvicorn worker and `python -m job_queue` processes
+    pointed at the same file. Claims take a write lock, so each job runs once."""
+
+    COLUMNS = ("id", "key", "user_id", "tool", "args", "timezone", "status", "result", "reply",
+               "created_at", "updated_at", "lease_until")
+
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, key TEXT NOT NULL, user_id TEXT NOT NULL, tool TEXT NOT NULL, "
+            "args TEXT NOT NULL, timezone TEXT, status TEXT NOT NULL, result TEXT, reply TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL, lease_until REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs(key, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs(status, created_at)")
+
+    def _transaction(self, work):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                value = work()
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return value
+
+    def _row(self, row) -> Optional[dict]:
+        if not row:
+            return None
+        job = dict(zip(self.COLUMNS, row))
+        job["args"] = json.loads(job["args"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def add(self, job: dict, window: float):
+        now = time.time()
+
+        def work():
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at <= ?", (*FINISHED, now - JOB_TTL)
+            )
+            existing = None
+            if window:
+                existing = self._conn.execute(
+                    f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE key = ? AND created_at > ? "
+                    "ORDER BY created_at DESC LIMIT 1", (job["key"], now - window),
+                ).fetchone()
+            if existing:
+                return self._row(existing), False
+            self._conn.execute(
+                f"INSERT INTO jobs ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                tuple(json.dumps(job[c]) if c == "args" else job[c] for c in self.COLUMNS),
+            )
+            return job, True
+        return self._transaction(work)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            return self._row(self._conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone())
+
+    def claim(self) -> Optional[dict]:
+        now = time.time()
+
+        def work():
+            # A worker that died mid-job may or may not have sent the email; never run it again
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, reply = ?, updated_at = ? WHERE status = ? AND lease_until < ?",
+                (INTERRUPTED, INTERRUPTED_REPLY, now, RUNNING, now),
+            )
+            row = self._conn.execute(
+                f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if not row:
+                return None
+            job = self._row(row)
+            job.update(status=RUNNING, updated_at=now, lease_until=now + JOB_LEASE)
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ?, lease_until = ? WHERE id = ?",
+                (RUNNING, now, job["lease_until"], job["id"]),
+            )
+            return job
+        return self._transaction(work)
+
+    def finish(self, job_id: str, status: str, result: dict, reply: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, reply = ?, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result, default=str), reply, time.time(), job_id),
+            )
+
+# ==== Queue ====
+class JobQueue:
+    """Enqueues deferrable tool calls and runs them on worker threads via the tool registry,
+    so each job gets the tool's usual timeout, concurrency limits and metrics."""
+
+    def __init__(self, store, workers: int = JOB_WORKERS):
+        self.store = store
+        self.workers = workers
+        self._wake = threading.Condition()
+        self._threads = []
+        self._stopping = threading.Event()
+
+    def defers(self, name: str) -> bool:
+        spec = registry.get(name)
+        return JOBS_ENABLED and spec is not None and spec.deferrable
+
+    def enqueue(self, user_id: str, tool: str, args: dict) -> dict:
+        """Queues the call and returns a "queued" tool result. When a retried turn repeats a
+        write the first attempt already queued, returns that job's result (or its queued
+        result while it is still pending) instead of running it again."""
+        turn = _turn.get()
+        job_id = uuid.uuid4().hex
+        key = _idempotency_key(user_id, tool, turn)
+        now = time.time()
+        job, created = self.store.add({
+            "id": job_id, "key": key or job_id, "user_id": user_id, "tool": tool, "args": args,
+            "timezone": timezone_name(), "status": QUEUED, "result": None, "reply": None,
+            "created_at": now, "updated_at": now, "lease_until": None,
+        }, JOB_TTL if key else 0)
+        if created:
+            with self._wake:
+                self._wake.notify()
+        else:
+            print(f"Job {job['id']} reused for a retried {tool} call")
+            if job["status"] in FINISHED:
+                return job["result"] or {"status": "error", "message": INTERRUPTED_REPLY}
+        if turn is not None and job["id"] not in turn.jobs:
+            turn.jobs.append(job["id"])
+        return {"status": "queued", "job_id": job["id"], "job_status": job["status"], "duplicate": not created}
+
+    async def aenqueue(self, user_id: str, tool: str, args: dict) -> dict:
+        return await run_blocking(self.enqueue, user_id, tool, args)
+
+    # ==== Inline writes ====
+    # Writes that run inside the turn are recorded under the same key a queued job would get,
+    # so a turn the client retries after a 5xx or a dropped connection does not send or book twice.
+    def call_key(self, user_id: str, tool: str) -> Optional[str]:
+        """Idempotency key for the next call to tool in this turn; take them in call order."""
+        return _idempotency_key(user_id, tool, _turn.get())
+
+    def run_inline(self, user_id: str, tool: str, args: dict, key: Optional[str]) -> dict:
+        """Runs the call now via the registry; with a key, returns the earlier attempt's result instead."""
+        if key is None:
+            return registry.run(tool, args, user_id)
+        job, created = self._start_inline(user_id, tool, args, key)
+        if not created:
+            return self._earlier_attempt(job)
+        try:
+            result = registry.run(tool, args, user_id)
+        except BaseException:
+            self.store.finish(job["id"], INTERRUPTED, None, INTERRUPTED_REPLY)
+            raise
+        self._finish_inline(job, result)
+        return result
+
+    async def arun_inline(self, user_id: str, tool: str, args: dict, key: Optional[str]) -> dict:
+        if key is None:
+            return await registry.arun(tool, args, user_id)
+        job, created = await run_blocking(self._start_inline, user_id, tool, args, key)
+        if not created:
+            return self._earlier_attempt(job)
+        try:
+            result = await registry.arun(tool, args, user_id)
+        except BaseException:
+            await run_blocking(self.store.finish, job["id"], INTERRUPTED, None, INTERRUPTED_REPLY)
+            raise
+        await run_blocking(self._finish_inline, job, result)
+        return result
+
+    def _start_inline(self, user_id: str, tool: str, args: dict, key: str):
+        now = time.time()
+        # Recorded as already running, so workers never pick it up; a process that dies
+        # mid-call leaves it to be marked interrupted once the lease runs out
+        return self.store.add({
+            "id": uuid.uuid4().hex, "key": key, "user_id": user_id, "tool": tool, "args": args,
+            "timezone": timezone_name(), "status": RUNNING, "result": None, "reply": None,
+            "created_at": now, "updated_at": now, "lease_until": now + JOB_LEASE,
+        }, JOB_TTL)
+
+    def _finish_inline(self, job: dict, result: dict):
+        status = SUCCEEDED if result.get("status") == "success" else FAILED
+        self.store.finish(job["id"], status, result, registry.reply(job["tool"], job["args"], result))
+
+    @staticmethod
+    def _earlier_attempt(job: dict) -> dict:
+        print(f"Call {job['id']} reused for a retried {job['tool']} call")
+        if job["status"] in FINISHED:
+            return job["result"] or {"status": "error", "message": INTERRUPTED_REPLY}
+        return {"status": "pending", "message": "An earlier attempt of this request is still running. "
+                                                "Please check before trying again."}
+
+    def get(self, job_id: str, user_id: str) -> Optional[dict]:
+        """The job as returned to clients, or None if it does not exist or belongs to someone else."""
+        job = self.store.get(job_id)
+        if not job or job["user_id"] != user_id:
+            return None
+        return {k: job[k] for k in ("id", "tool", "status", "result", "reply", "created_at", "updated_at")}
+
+    async def wait(self, job_id: str, user_id: str, timeout: float) -> Optional[dict]:
+        """Polls until the job finishes or timeout passes; returns its latest state."""
+        deadline = time.monotonic() + timeout
+        while True:
+            job = await run_blocking(self.get, job_id, user_id)
+            if not job or job["status"] in FINISHED or time.monotonic() >= deadline:
+                return job
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+    # ==== Workers ====
+    def execute(self, job: dict):
+        import tools  # noqa: F401  registers the tool specs in a standalone worker
+        set_request_user(job["user_id"])
+        set_request_timezone(job["user_id"], job["timezone"])
+        add_timing("job.wait", time.time() - job["created_at"])
+        with span("job", job["tool"]):
+            result = registry.run(job["tool"], job["args"], job["user_id"])
+        status = SUCCEEDED if result.get("status") == "success" else FAILED
+        self.store.finish(job["id"], status, result, registry.reply(job["tool"], job["args"], result))
+        print(f"Job {job['id']} ({job['tool']}) {status}")
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = self.store.claim()
+            if job is None:
+                # Woken early by enqueue in this process; the poll picks up other processes' jobs
+                with self._wake:
+                    self._wake.wait(JOB_POLL_INTERVAL)
+                continue
+            # A fresh context per job, so one user's settings never leak into the next
+            contextvars.Context().run(self.execute, job)
+
+    def start(self):
+        if self._threads or self.workers <= 0:
+            return
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True) for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        self._stopping.set()
+        with self._wake:
+            self._wake.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+job_queue = JobQueue(SQLiteJobStore(JOB_DB_PATH) if JOB_BACKEND == "sqlite" else MemoryJobStore())
+
+if __name__ == "__main__":
+    # Standalone worker: JOB_BACKEND=sqlite JOB_WORKERS=4 python -m job_queue
+    if JOB_BACKEND != "sqlite":
+        raise SystemExit("A separate worker process needs JOB_BACKEND=sqlite.")
+    job_queue.workers = max(1, JOB_WORKERS)
+    job_queue.start()
+    print(f"Job worker running {job_queue.workers} threads on {JOB_DB_PATH}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        job_queue.stop()
@@ -0,0 +1,89 @@
+import os
+import re
+import json
+import hashlib
+import threading
+from collections import Counter
+from typing import Optional
+import settings
+from concurrency import generate_content, generate_content_async, stream_content_async
+from kv_store import MemoryBackend, SQLiteBackend
+
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "memory")  # "memory", "sqlite" or "off"
+LLM_CACHE_PATH = settings.data_path(os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite3"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "2048"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+
+# ==== Cache ====
+def normalize_prompt(prompt) -> str:
+    """Stable text form of a prompt: strings have whitespace collapsed, structured contents are JSON-encoded."""
+    if not isinstance(prompt, str):
+        prompt = json.dumps(prompt, sort_keys=True, default=str)
+    return re.sub(r"\s+", " ", prompt).strip()
+
+class LLMCache:
+    """Response cache keyed on model name + normalized prompt, with hit/miss counters."""
+
+    def __init__(self, backend=None, ttl: float = LLM_CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    @staticmethod
+    def key(model_name: str, prompt) -> str:
+        return hashlib.sha256(f"{model_name}\n{normalize_prompt(prompt)}".encode()).hexdigest()
+
+    def _count(self, outcome: str, model_name: str):
+        with self._stats_lock:
+            self.stats[outcome] += 1
+            self.stats[f"{outcome}:{model_name}"] += 1
+
+    def get(self, model_name: str, prompt) -> Optional[str]:
+        if not self.backend:
+            return None
+        value = self.backend.get(self.key(model_name, prompt))
+        self._count("hits" if value is not None else "misses", model_name)
+        return value
+
+    def set(self, model_name: str, prompt, value: str):
+        if self.backend:
+            self.backend.set(self.key(model_name, prompt), value, self.ttl)
+
+    def snapshot(self) -> dict:
+        with self._stats_lock:
+            return {"backend": type(self.backend).__name__ if self.backend else None, **self.stats}
+
+def _make_backend():
+    if LLM_CACHE_BACKEND == "sqlite":
+        return SQLiteBackend(LLM_CACHE_PATH, LLM_CACHE_SIZE, table="llm_cache")
+    if LLM_CACHE_BACKEND == "memory":
+        return MemoryBackend(LLM_CACHE_SIZE)
+    return None
+
+llm_cache = LLMCache(_make_backend())
+
+# ==== Cached Gemini calls ====
+def generate_text(model, prompt, operation: str = "generate") -> str:
+    """model.generate_content(prompt).text through the response cache."""
+    cached = llm_cache.get(model.model_name, prompt)
+    if cached is not None:
+        return cached
+    text = generate_content(model, prompt, operation=operation).text.strip()
+    llm_cache.set(model.model_name, prompt, text)
+    return text
+
+async def agenerate_text(model, prompt, on_text=None, operation: str = "generate") -> str:
+    """Async generate_text; a miss is streamed through on_text, a hit is delivered to it in one piece."""
+    cached = llm_cache.get(model.model_name, prompt)
+    if cached is not None:
+        if on_text:
+            on_text(cached)
+        return cached
+    if on_text:
+        response = await stream_content_async(model, prompt, on_text=on_text, operation=operation)
+    else:
+        response = await generate_content_async(model, prompt, operation=operation)
+    text = response.text.strip()
+    llm_cache.set(model.model_name, prompt, text)
+    return text
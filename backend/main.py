@@ -1,9 +1,60 @@
+import os
+import time
+import asyncio
+import threading
+import uuid
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from langchain_core.messages import HumanMessage
-from agent_graph import agent_executor
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
+from starlette.background import BackgroundTask
 from auth_store import router as auth_router   # Import the auth_store module
+from concurrency import chat_slots, run_blocking, shutdown_blocking_pool
+from streaming import sse, FINAL, ERROR, JOB_FINISHED
+from llm_cache import llm_cache
+from tool_registry import registry as tool_registry
+import rate_limiter
+from rate_limiter import UpstreamUnavailable, admit_chat, set_request_user
+from session_store import session_store, history_messages
+from checkpoint_store import get_checkpointer, thread_id, thread_config
+import resilience
+from resilience import set_deadline
+import metrics
+import settings
+import temporal
+from temporal import set_request_timezone
+from service_pool import service_pool
+from supabase_client import get_supabase
+from google_calendar import alist_events
+from job_queue import JOBS_ENABLED, job_queue, begin_turn, turn_jobs
+
+# Upstream calls made for one /chat turn stop retrying once this many seconds have passed
+CHAT_DEADLINE = float(os.getenv("CHAT_DEADLINE", "60"))
+# /chat/stream stays open this long after the reply for the turn's background jobs to finish
+JOB_STREAM_WAIT = float(os.getenv("JOB_STREAM_WAIT", "60"))
+
+def graph():
+    """agent_graph (LangGraph, the tools and the Gemini models), imported on first use.
+
+    Importing it takes most of the app's import time, so the server starts without it
+    and the startup warm-up loads it in the background.
+    """
+    import agent_graph
+    return agent_graph
+
+def warm_up():
+    """Imports the deferred libraries and builds the Gemini and Supabase clients ahead of the first chat."""
+    start = time.perf_counter()
+    try:
+        agent = graph()
+        agent.agent_executor()  # compiles the graph and opens the checkpoint database
+        agent.model.get()
+        agent.extraction_model.get()
+        temporal.fallback_parser()  # dateparser, for expressions the local grammar cannot read
+        get_supabase()
+        print(f"Startup warm-up finished in {time.perf_counter() - start:.2f}s")
+    except Exception as e:
+        print(f"Startup warm-up failed: {e}")
 
 app = FastAPI()
 app.include_router(auth_router, prefix="/auth", tags=["auth"]) # Import and include the auth_store router
@@ -15,28 +66,331 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.post("/chat")
-async def chat(request: Request):
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """Times every request and, unless disabled, reports its span breakdown in Server-Timing."""
+    breakdown = metrics.start_breakdown()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    route = request.scope.get("route")
+    metrics.spans.observe("http", f"{request.method} {route.path if route else 'unmatched'}",
+                          elapsed, error=response.status_code >= 500)
+    if metrics.METRICS_TIMING_HEADER:
+        # For streamed responses this covers the work done before the first byte
+        response.headers["Server-Timing"] = metrics.server_timing(breakdown, elapsed)
+    return response
+
+@app.exception_handler(UpstreamUnavailable)
+async def upstream_unavailable(request: Request, exc: UpstreamUnavailable):
+    """Quota pressure (429) and open circuits / spent deadlines (503/504) are reported with Retry-After."""
+    return JSONResponse(
+        {"status": "error", "message": str(exc), "retry_after": exc.retry_after},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+async def _chat_inputs(request: Request):
+    """Builds graph inputs from the request body and the server-side session.
+
+    Returns (inputs, session_id, session). A client-supplied context still wins
+    over the stored one, so older clients that echo it back keep working.
+    """
     body = await request.json()
     user_input = body.get("message")
-    prev_context = body.get("context", {}) 
     user_id = body.get("user_id")
     print("Received data:", body)
 
     if not user_id:
          raise HTTPException(status_code=401, detail="User ID (or email) is required for API access.")
 
-    # Pass both user message and current context to agent
+    # Turned away before any work is done when the user or Gemini is over budget
+    admit_chat(user_id)
+    set_request_user(user_id)
+    # IANA name from the client (e.g. "Europe/Berlin"); relative dates and new events use it
+    set_request_timezone(user_id, body.get("timezone"))
+    set_deadline(CHAT_DEADLINE)
+    # A client retrying the same turn sends the same key, so queued emails and events are not repeated
+    begin_turn(body.get("idempotency_key") or request.headers.get("Idempotency-Key"))
+
+    session_id = body.get("session_id") or uuid.uuid4().hex
+    session = session_store.load(user_id, session_id)
+
+    # Pass prior turns, the new user message and current context to agent. The session is the
+    # one record of slot-filling state; checkpoints are only for resuming an interrupted turn
     inputs = {
-        "messages": [HumanMessage(content=user_input)],
-        "context": prev_context,
-        "user_id": user_id
+        "messages": history_messages(session) + [HumanMessage(content=user_input)],
+        "context": body.get("context") or session["context"],
+        "user_id": user_id,
+        "summary": session["summary"]
     }
+    return inputs, session_id, session
+
+def _finish_turn(user_id: str, session_id: str, session: dict, user_text: str, result: dict):
+    """Records the turn in the session; returns the response payload and whether to compact."""
+    reply = result["messages"][-1].content
+    needs_compaction = session_store.record_turn(
+        user_id, session_id, session, user_text, reply, result["context"]
+    )
+    payload = {"reply": reply, "context": result["context"], "session_id": session_id}
+    jobs = turn_jobs()
+    if jobs:
+        payload["jobs"] = jobs
+    return payload, needs_compaction
+
+@app.post("/chat")
+async def chat(request: Request):
+    inputs, session_id, session = await _chat_inputs(request)
+
+    # Bounded so one worker keeps many conversations in flight without unbounded fan-out
+    async with chat_slots:
+        result = await graph().agent_executor().ainvoke(inputs, thread_config(inputs["user_id"], session_id))
+
+    payload, needs_compaction = _finish_turn(
+        inputs["user_id"], session_id, session, inputs["messages"][-1].content, result
+    )
+    # History compaction runs after the response is sent
+    background = BackgroundTask(session_store.compact, inputs["user_id"], session_id) if needs_compaction else None
+    return JSONResponse(payload, background=background)
+
+@app.post("/chat/stream")
+async def chat_stream(request: Request):
+    """Same turn as /chat, streamed as Server-Sent Events: node/tool progress, model tokens, then the final payload."""
+    inputs, session_id, session = await _chat_inputs(request)
+
+    async def events():
+        async with chat_slots:
+            result = None
+            try:
+                async for mode, chunk in graph().agent_executor().astream(
+                    inputs, thread_config(inputs["user_id"], session_id), stream_mode=["custom", "values"]
+                ):
+                    if mode == "custom":
+                        yield sse(chunk["event"], chunk)
+                    else:
+                        result = chunk
+            except UpstreamUnavailable as e:
+                yield sse(ERROR, e.as_result())
+                return
+            except Exception as e:
+                yield sse(ERROR, {"message": str(e)})
+                return
+
+        payload, needs_compaction = _finish_turn(
+            inputs["user_id"], session_id, session, inputs["messages"][-1].content, result
+        )
+        yield sse(FINAL, payload)
+        # Background jobs from this turn, in the order they finish
+        waits = [job_queue.wait(job_id, inputs["user_id"], JOB_STREAM_WAIT) for job_id in payload.get("jobs", [])]
+        for waited in asyncio.as_completed(waits):
+            job = await waited
+            if job:
+                yield sse(JOB_FINISHED, job)
+        if needs_compaction:
+            await session_store.compact(inputs["user_id"], session_id)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/calendar/events")
+async def calendar_events(request: Request, user_id: str, time_min: str = None, time_max: str = None,
+                          page_token: str = None, max_results: int = 50, timezone: str = None):
+    """Lists the user's calendar events straight from Google Calendar, without a model call.
+
+    Answers 304 when If-None-Match carries the ETag of an unchanged page.
+    """
+    set_request_user(user_id)
+    set_request_timezone(user_id, timezone)
+    result = await alist_events(user_id, time_min, time_max, page_token, max_results)
+    if result["status"] != "success":
+        status = 401 if result["message"].startswith("Authorization error") else 400
+        return JSONResponse(result, status_code=status)
+    etag = result.pop("etag")
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(result, headers=headers)
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str, user_id: str):
+    """Forgets a conversation's stored history, context and graph checkpoints."""
+    session_store.delete(user_id, session_id)
+    checkpointer = get_checkpointer()
+    if checkpointer:
+        await checkpointer.adelete_thread(thread_id(user_id, session_id))
+    return {"status": "success"}
+
+# ==== Checkpointed threads ====
+_NO_CHECKPOINTER = {"status": "error", "message": "Checkpointing is disabled (CHECKPOINT_BACKEND=off)."}
+
+@app.get("/threads")
+async def list_threads(user_id: str, limit: int = 50):
+    """A user's checkpointed conversations, most recently updated first."""
+    checkpointer = get_checkpointer()
+    if not checkpointer:
+        return _NO_CHECKPOINTER
+    prefix = thread_id(user_id, "")
+    threads = await run_blocking(checkpointer.list_threads, user_id, limit)
+    for thread in threads:
+        thread["session_id"] = thread.pop("thread_id")[len(prefix):]
+        if thread["forked_from"]:
+            thread["forked_from"] = thread["forked_from"][len(prefix):]
+    return {"threads": threads}
+
+@app.get("/threads/{session_id}/checkpoints")
+async def list_checkpoints(session_id: str, user_id: str):
+    """Saved checkpoints of one thread (newest first), e.g. to pick a fork point."""
+    checkpointer = get_checkpointer()
+    if not checkpointer:
+        return _NO_CHECKPOINTER
+    checkpoints = []
+    async for snapshot in graph().agent_executor().aget_state_history(thread_config(user_id, session_id)):
+        checkpoints.append({
+            "checkpoint_id": snapshot.config["configurable"]["checkpoint_id"],
+            "step": (snapshot.metadata or {}).get("step"),
+            "next": list(snapshot.next),
+            "context": snapshot.values.get("context"),
+            "created_at": snapshot.created_at,
+        })
+    return {"session_id": session_id, "checkpoints": checkpoints}
+
+@app.post("/threads/{session_id}/fork")
+async def fork_thread(session_id: str, user_id: str, checkpoint_id: str = None):
+    """Starts a new session from a checkpoint of this one (default: its latest)."""
+    checkpointer = get_checkpointer()
+    if not checkpointer:
+        return _NO_CHECKPOINTER
+    new_session_id = uuid.uuid4().hex
+    copied = await checkpointer.acopy_thread(
+        thread_id(user_id, session_id), thread_id(user_id, new_session_id), checkpoint_id, user_id
+    )
+    if not copied:
+        return {"status": "error", "message": "No such thread or checkpoint."}
+    session_store.save(user_id, new_session_id, session_store.load(user_id, session_id))
+    return {"status": "success", "session_id": new_session_id, "checkpoint_id": copied}
+
+@app.post("/threads/{session_id}/resume")
+async def resume_thread(session_id: str, user_id: str):
+    """Finishes a turn that was interrupted mid-graph (e.g. a Gemini error or a dropped
+    worker) from its last checkpoint, without re-running the nodes that completed."""
+    checkpointer = get_checkpointer()
+    if not checkpointer:
+        return _NO_CHECKPOINTER
+    set_request_user(user_id)
+    set_request_timezone(user_id)
+    set_deadline(CHAT_DEADLINE)
+    begin_turn()
+    config = thread_config(user_id, session_id)
+    snapshot = await graph().agent_executor().aget_state(config)
+    if not snapshot.next:
+        return {"status": "error", "message": "Nothing to resume for this session."}
+
+    async with chat_slots:
+        result = await graph().agent_executor().ainvoke(None, config)
+
+    user_text = next(
+        (msg.content for msg in reversed(snapshot.values["messages"]) if isinstance(msg, HumanMessage)), ""
+    )
+    session = session_store.load(user_id, session_id)
+    payload, needs_compaction = _finish_turn(user_id, session_id, session, user_text, result)
+    background = BackgroundTask(session_store.compact, user_id, session_id) if needs_compaction else None
+    return JSONResponse(payload, background=background)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, user_id: str):
+    """Status of a background tool job; once finished, its result and the reply to show."""
+    job = await run_blocking(job_queue.get, job_id, user_id)
+    if not job:
+        return JSONResponse({"status": "error", "message": "No such job."}, status_code=404)
+    return job
+
+@app.post("/threads/expire")
+async def expire_threads(user_id: str, max_age: float = None):
+    """Deletes the user's threads idle for longer than max_age seconds (default
+    CHECKPOINT_THREAD_TTL). Everyone else's are left to the periodic sweep."""
+    checkpointer = get_checkpointer()
+    if not checkpointer:
+        return _NO_CHECKPOINTER
+    return {"status": "success", "expired": await run_blocking(checkpointer.expire_threads, max_age, user_id)}
+
+@app.get("/router/stats")
+async def router_stats():
+    """Counts of turns answered by the local intent router vs. escalated to Gemini."""
+    return graph().router_snapshot()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Hit/miss counters for the Gemini response cache."""
+    return llm_cache.snapshot()
+
+@app.get("/limits/stats")
+async def limit_stats():
+    """Token bucket level, queue depth and admitted/queued/rejected counts per upstream."""
+    return rate_limiter.snapshot()
+
+@app.get("/resilience/stats")
+async def resilience_stats():
+    """Circuit breaker state, retry/failure counts and hedged-request counts per upstream."""
+    return resilience.snapshot()
+
+@app.get("/tools/stats")
+async def tool_stats():
+    """Per-tool outcome counts and latency histograms."""
+    return tool_registry.snapshot()
+
+_CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+def _snapshot_families() -> list:
+    """Prometheus families built from the existing /…/stats snapshots."""
+    tools = tool_registry.snapshot()
+    limits = rate_limiter.snapshot()
+    health = resilience.snapshot()
+    cache = llm_cache.snapshot()
+    router = graph().router_snapshot()
+    return [
+        ("astra_tool_seconds", "histogram", "Tool call latency, including waits for a free slot.",
+         [({"tool": name}, (s["latency_seconds"]["buckets"], s["latency_seconds"]["count"], s["latency_seconds"]["sum"]))
+          for name, s in tools.items()]),
+        ("astra_tool_calls_total", "counter", "Tool calls by outcome.",
+         [({"tool": name, "outcome": outcome}, count)
+          for name, s in tools.items() for outcome, count in s["outcomes"].items()]),
+        ("astra_llm_cache_lookups_total", "counter", "Gemini response cache lookups.",
+         [({"result": result}, cache.get(result, 0)) for result in ("hits", "misses")]),
+        ("astra_router_turns_total", "counter", "Turns answered by the local intent router vs. escalated to Gemini.",
+         [({"outcome": key}, count) for key, count in router.items() if ":" not in key]),
+        ("astra_upstream_admissions_total", "counter", "Rate limiter decisions per upstream.",
+         [({"upstream": name, "outcome": key}, count)
+          for name, s in limits.items() for key, count in s.items() if key not in ("queued_now", "tokens")]),
+        ("astra_upstream_queue_depth", "gauge", "Calls waiting in the rate limiter queue.",
+         [({"upstream": name}, s["queued_now"]) for name, s in limits.items()]),
+        ("astra_circuit_state", "gauge", "Circuit breaker state (0 closed, 1 half open, 2 open).",
+         [({"upstream": name}, _CIRCUIT_STATES[s["state"]]) for name, s in health["breakers"].items()]),
+        ("astra_upstream_failures_total", "counter", "Transient upstream failures, retries and calls refused by an open circuit.",
+         [({"upstream": name, "event": key}, count)
+          for name, s in health["breakers"].items() for key, count in s.items()
+          if key not in ("state", "consecutive_failures")]),
+        ("astra_hedged_requests_total", "counter", "Reads that started a hedged duplicate request.",
+         [({"operation": key}, s["hedges"]) for key, s in health["hedging"].items()]),
+    ]
 
-    result = agent_executor.invoke(inputs)
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition of latency spans and the counters behind the /…/stats endpoints."""
+    body = metrics.render(metrics.spans.families() + _snapshot_families())
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
 
-    return JSONResponse({
-        "reply": result["messages"][-1].content,
-        "context": result["context"]  
-    })
+@app.on_event("startup")
+def startup():
+    if settings.STARTUP_WARMUP:
+        threading.Thread(target=warm_up, name="startup-warmup", daemon=True).start()
+    if JOBS_ENABLED:
+        job_queue.start()
 
+@app.on_event("shutdown")
+def shutdown():
+    job_queue.stop()
+    shutdown_blocking_pool()
+    service_pool.close()
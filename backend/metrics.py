@@ -0,0 +1,178 @@
+import os
+import time
+import threading
+import contextlib
+import contextvars
+from collections import Counter, defaultdict, deque
+from typing import Iterable, Optional
+import settings
+
+# Latency histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+# Recent samples per span kept for the p50/p95/p99 gauges
+METRICS_WINDOW = int(os.getenv("METRICS_WINDOW", "1024"))
+# Adds a Server-Timing header with the request's per-span breakdown
+METRICS_TIMING_HEADER = os.getenv("METRICS_TIMING_HEADER", "true").lower() == "true"
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_breakdown = contextvars.ContextVar("request_timings", default=None)
+
+# ==== Histograms ====
+class Histogram:
+    """Cumulative-bucket latency histogram plus a window of recent samples for quantiles."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window: int = METRICS_WINDOW):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def cumulative(self) -> dict:
+        total, out = 0, {}
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            out["+Inf" if bound == float("inf") else f"{bound:g}"] = total
+        return out
+
+    def quantiles(self) -> dict:
+        ordered = sorted(self.recent)
+        if not ordered:
+            return {}
+        return {q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] for q in QUANTILES}
+
+# ==== Spans ====
+class SpanRecorder:
+    """Latency histograms, error counters and in-flight gauges keyed by (kind, name).
+
+    kind groups the hop ("node", "gemini", "calendar", "supabase", ...); name is the
+    operation within it (node name, Gemini call purpose, HTTP method).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(Histogram)
+        self._errors = Counter()
+        self._in_flight = Counter()
+
+    @contextlib.contextmanager
+    def span(self, kind: str, name: str):
+        key = (kind, name)
+        with self._lock:
+            self._in_flight[key] += 1
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            with self._lock:
+                self._errors[key] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._in_flight[key] -= 1
+                self._histograms[key].observe(elapsed)
+            add_timing(f"{kind}.{name}", elapsed)
+
+    def observe(self, kind: str, name: str, seconds: float, error: bool = False):
+        """Records a duration measured elsewhere (e.g. a whole HTTP request)."""
+        with self._lock:
+            self._histograms[(kind, name)].observe(seconds)
+            if error:
+                self._errors[(kind, name)] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                f"{kind}.{name}": {
+                    "count": h.count, "sum": round(h.sum, 6), "errors": self._errors[(kind, name)],
+                    "in_flight": self._in_flight[(kind, name)],
+                    **{f"p{int(q * 100)}": round(v, 6) for q, v in h.quantiles().items()},
+                }
+                for (kind, name), h in self._histograms.items()
+            }
+
+    def families(self) -> list:
+        """Prometheus families for render()."""
+        with self._lock:
+            histograms = {key: (h.cumulative(), h.count, h.sum, h.quantiles()) for key, h in self._histograms.items()}
+            errors = dict(self._errors)
+            in_flight = dict(self._in_flight)
+        label = lambda key: {"kind": key[0], "name": key[1]}
+        return [
+            ("astra_span_seconds", "histogram", "Latency of graph nodes, Gemini calls and upstream API calls.",
+             [(label(key), value) for key, value in histograms.items()]),
+            ("astra_span_seconds_recent", "gauge", "Latency quantiles over the most recent calls.",
+             [({**label(key), "quantile": f"{q:g}"}, v)
+              for key, (_, _, _, quantiles) in histograms.items() for q, v in quantiles.items()]),
+            ("astra_span_errors_total", "counter", "Calls that ended in an exception.",
+             [(label(key), count) for key, count in errors.items()]),
+            ("astra_span_in_flight", "gauge", "Calls currently in progress.",
+             [(label(key), count) for key, count in in_flight.items()]),
+        ]
+
+spans = SpanRecorder()
+span = spans.span
+
+# ==== Per-request breakdown ====
+def start_breakdown() -> dict:
+    """Collects this request's span durations (threads it spawns included) into the returned dict."""
+    breakdown = {"lock": threading.Lock(), "spans": {}}
+    _breakdown.set(breakdown)
+    return breakdown
+
+def add_timing(key: str, seconds: float):
+    """Adds a duration to the current request's breakdown, if one is being collected."""
+    breakdown = _breakdown.get()
+    if breakdown is None:
+        return
+    with breakdown["lock"]:
+        count, total = breakdown["spans"].get(key, (0, 0.0))
+        breakdown["spans"][key] = (count + 1, total + seconds)
+
+def server_timing(breakdown: dict, total: Optional[float] = None) -> str:
+    """Server-Timing header value: one entry per span, summed over repeated calls."""
+    with breakdown["lock"]:
+        entries = [
+            f'{key};dur={seconds * 1000:.1f}' + (f';desc="x{count}"' if count > 1 else "")
+            for key, (count, seconds) in breakdown["spans"].items()
+        ]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+# ==== Prometheus text format ====
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+def render(families: Iterable) -> str:
+    """Renders (name, type, help, samples) families. Histogram samples are
+    (labels, (cumulative buckets, count, sum, ...)); others are (labels, value)."""
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if kind == "histogram":
+                buckets, count, total = value[:3]
+                for le, cumulative in buckets.items():
+                    lines.append(f"{name}_bucket{_labels({**labels, 'le': le})} {cumulative}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {total:.6f}")
+            else:
+                lines.append(f"{name}{_labels(labels)} {value:g}" if isinstance(value, float)
+                             else f"{name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
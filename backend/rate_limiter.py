@@ -0,0 +1,309 @@
+import os
+import math
+import time
+import asyncio
+import threading
+import contextlib
+import contextvars
+from collections import OrderedDict, Counter
+from typing import Optional
+import settings
+
+# ==== Limits ====
+# Per upstream API: "rate:burst:user_rate:user_burst" (requests/second; burst = bucket size).
+UPSTREAM_LIMITS = {
+    "gemini": os.getenv("GEMINI_RATE_LIMIT", "15:30:2:8"),
+    "gmail": os.getenv("GMAIL_RATE_LIMIT", "50:100:10:20"),
+    "calendar": os.getenv("CALENDAR_RATE_LIMIT", "50:100:5:15"),
+    # Admission for /chat turns themselves
+    "chat": os.getenv("CHAT_RATE_LIMIT", "50:100:1:5"),
+}
+# Longest an interactive call may queue before it is turned away with a 429;
+# background work waits up to BACKGROUND_WAIT_FACTOR times longer.
+SCHEDULER_MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT", "3"))
+BACKGROUND_WAIT_FACTOR = float(os.getenv("BACKGROUND_WAIT_FACTOR", "10"))
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "256"))
+SCHEDULER_MAX_USERS = int(os.getenv("SCHEDULER_MAX_USERS", "4096"))
+# Used when an upstream reports a quota error without a Retry-After
+UPSTREAM_QUOTA_BACKOFF = float(os.getenv("UPSTREAM_QUOTA_BACKOFF", "5"))
+
+INTERACTIVE, BACKGROUND = 0, 1
+
+_priority = contextvars.ContextVar("request_priority", default=INTERACTIVE)
+_user = contextvars.ContextVar("request_user", default=None)
+
+API_LABELS = {"gemini": "The assistant", "gmail": "Gmail", "calendar": "Google Calendar", "supabase": "The account store"}
+
+class UpstreamUnavailable(Exception):
+    """An upstream cannot take the call right now; carries the HTTP status and Retry-After to report.
+
+    Tool code lets these propagate instead of folding them into generic error strings.
+    """
+    status_code = 503
+
+    def __init__(self, api: str, retry_after: float, message: str):
+        self.api = api
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(message.format(label=API_LABELS.get(api, api), retry_after=self.retry_after))
+
+    def as_result(self) -> dict:
+        return {"status": "error", "message": str(self), "retry_after": self.retry_after}
+
+class RateLimited(UpstreamUnavailable):
+    """Raised instead of queueing when a call would wait longer than allowed, or an upstream hit its quota."""
+    status_code = 429
+
+    def __init__(self, api: str, retry_after: float):
+        if api == "chat":
+            message = "You're sending messages too quickly. Please try again in {retry_after}s."
+        else:
+            message = "{label} is busy right now. Please try again in {retry_after}s."
+        super().__init__(api, retry_after, message)
+
+# ==== Request context ====
+def set_request_user(user_id: Optional[str]):
+    """Attributes outbound calls made in this context (and threads it spawns) to user_id."""
+    _user.set(user_id)
+
+@contextlib.contextmanager
+def background():
+    """Runs the enclosed calls at background priority, behind interactive /chat turns."""
+    token = _priority.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+# ==== Token buckets ====
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def available(self, now: float) -> float:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def delay(self, now: float, n: float = 1) -> float:
+        """Seconds until n tokens are available."""
+        return max(0.0, (n - self.available(now)) / self.rate)
+
+    def drain(self, seconds: float):
+        """Empties the bucket so nothing is sent for the next `seconds`."""
+        self.available(time.monotonic())
+        self.tokens = min(self.tokens, -self.rate * seconds)
+
+class _Waiter:
+    __slots__ = ("user_id", "priority", "key", "granted", "event", "loop", "future")
+
+    def __init__(self, user_id, priority, key):
+        self.user_id = user_id
+        self.priority = priority
+        self.key = key
+        self.granted = False
+        self.event = None
+        self.loop = None
+        self.future = None
+
+    def wake(self):
+        if self.event is not None:
+            self.event.set()
+        elif self.future is not None:
+            self.loop.call_soon_threadsafe(lambda: self.future.done() or self.future.set_result(None))
+
+class Upstream:
+    """Global and per-user token buckets plus one wait queue for an upstream API.
+
+    Waiters are ordered by priority, then by a per-user virtual finish tag (start-time
+    fair queuing), so interactive calls go first and users with a backlog take turns
+    instead of one user draining the global bucket. A call whose estimated wait exceeds
+    the limit for its priority is rejected with RateLimited right away.
+    """
+
+    def __init__(self, name: str, rate: float, burst: float, user_rate: float, user_burst: float,
+                 max_wait: float = SCHEDULER_MAX_WAIT, max_queue: int = SCHEDULER_MAX_QUEUE):
+        self.name = name
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self._bucket = TokenBucket(rate, burst)
+        self._users: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._tags = {}
+        self._vtime = 0.0
+        self._seq = 0
+        self._queue = []
+        self._lock = threading.Lock()
+        self.stats = Counter()
+
+    def _user_bucket(self, user_id: Optional[str]) -> Optional[TokenBucket]:
+        if user_id is None:
+            return None
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            bucket = self._users[user_id] = TokenBucket(self.user_rate, self.user_burst)
+            while len(self._users) > SCHEDULER_MAX_USERS:
+                old_user, _ = self._users.popitem(last=False)
+                self._tags.pop(old_user, None)
+        self._users.move_to_end(user_id)
+        return bucket
+
+    def _estimated_wait(self, now: float, user_id: Optional[str], priority: int) -> float:
+        ahead = sum(1 for w in self._queue if w.priority <= priority)
+        wait = self._bucket.delay(now, ahead + 1)
+        bucket = self._user_bucket(user_id)
+        if bucket:
+            queued = sum(1 for w in self._queue if w.user_id == user_id)
+            wait = max(wait, bucket.delay(now, queued + 1))
+        return wait
+
+    def _take(self, now: float, user_id: Optional[str]) -> bool:
+        bucket = self._user_bucket(user_id)
+        if self._bucket.available(now) < 1 or (bucket and bucket.available(now) < 1):
+            return False
+        self._bucket.tokens -= 1
+        if bucket:
+            bucket.tokens -= 1
+        return True
+
+    def _dispatch(self, now: float):
+        for waiter in list(self._queue):
+            if self._bucket.available(now) < 1:
+                break
+            # A user out of tokens keeps their place; the next user in line may go
+            if self._take(now, waiter.user_id):
+                self._queue.remove(waiter)
+                self._vtime = max(self._vtime, waiter.key[1])
+                waiter.granted = True
+                waiter.wake()
+
+    def _enqueue(self, user_id: Optional[str], priority: int) -> Optional[_Waiter]:
+        """Takes a token now (returns None), queues a waiter, or raises RateLimited."""
+        now = time.monotonic()
+        if not self._queue and self._take(now, user_id):
+            self.stats["immediate"] += 1
+            return None
+        max_wait = self.max_wait * (BACKGROUND_WAIT_FACTOR if priority == BACKGROUND else 1)
+        wait = self._estimated_wait(now, user_id, priority)
+        if wait > max_wait or len(self._queue) >= self.max_queue:
+            self.stats["rejected"] += 1
+            raise RateLimited(self.name, wait)
+
+        tag = max(self._vtime, self._tags.get(user_id, 0.0)) + 1
+        self._tags[user_id] = tag
+        self._seq += 1
+        waiter = _Waiter(user_id, priority, (priority, tag, self._seq))
+        self._queue.append(waiter)
+        self._queue.sort(key=lambda w: w.key)
+        self.stats["queued"] += 1
+        return waiter
+
+    def _next_check(self, now: float, waiter: _Waiter) -> float:
+        self._dispatch(now)
+        if waiter.granted:
+            return 0.0
+        bucket = self._user_bucket(waiter.user_id)
+        delay = max(self._bucket.delay(now), bucket.delay(now) if bucket else 0.0)
+        # Re-check at least every 250ms: waiters ahead may have given up
+        return min(max(delay, 0.005), 0.25)
+
+    def _abandon(self, waiter: _Waiter):
+        if not waiter.granted and waiter in self._queue:
+            self._queue.remove(waiter)
+            self._dispatch(time.monotonic())
+
+    def acquire(self, user_id: Optional[str] = None, priority: Optional[int] = None):
+        """Blocks until the call may be sent."""
+        with self._lock:
+            waiter = self._enqueue(user_id if user_id is not None else _user.get(),
+                                   _priority.get() if priority is None else priority)
+            if waiter is None:
+                return
+            waiter.event = threading.Event()
+        try:
+            while True:
+                with self._lock:
+                    delay = self._next_check(time.monotonic(), waiter)
+                if waiter.granted:
+                    return
+                waiter.event.wait(delay)
+        finally:
+            with self._lock:
+                self._abandon(waiter)
+
+    async def aacquire(self, user_id: Optional[str] = None, priority: Optional[int] = None):
+        """Waits (without blocking the event loop) until the call may be sent."""
+        with self._lock:
+            waiter = self._enqueue(user_id if user_id is not None else _user.get(),
+                                   _priority.get() if priority is None else priority)
+            if waiter is None:
+                return
+            waiter.loop = asyncio.get_running_loop()
+            waiter.future = waiter.loop.create_future()
+        try:
+            while True:
+                with self._lock:
+                    delay = self._next_check(time.monotonic(), waiter)
+                if waiter.granted:
+                    return
+                await asyncio.wait({waiter.future}, timeout=delay)
+        finally:
+            with self._lock:
+                self._abandon(waiter)
+
+    def admit(self, user_id: Optional[str]):
+        """Non-blocking check: takes a token or raises RateLimited with the time until one frees up."""
+        with self._lock:
+            now = time.monotonic()
+            if not self._take(now, user_id):
+                self.stats["rejected"] += 1
+                bucket = self._user_bucket(user_id)
+                raise RateLimited(self.name, max(self._bucket.delay(now), bucket.delay(now) if bucket else 0.0))
+            self.stats["immediate"] += 1
+
+    def estimated_wait(self, priority: int = INTERACTIVE) -> float:
+        with self._lock:
+            return self._estimated_wait(time.monotonic(), None, priority)
+
+    def penalize(self, seconds: float):
+        """Upstream reported a quota error: hold every caller back for `seconds`."""
+        with self._lock:
+            self._bucket.drain(seconds)
+            self.stats["upstream_quota_errors"] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"queued_now": len(self._queue), "tokens": round(self._bucket.available(time.monotonic()), 2),
+                    **self.stats}
+
+def _make_upstream(name: str, spec: str) -> Upstream:
+    rate, burst, user_rate, user_burst = (float(x) for x in spec.split(":"))
+    return Upstream(name, rate, burst, user_rate, user_burst)
+
+upstreams = {name: _make_upstream(name, spec) for name, spec in UPSTREAM_LIMITS.items()}
+
+# ==== Entry points ====
+def acquire(api: str, user_id: Optional[str] = None):
+    upstreams[api].acquire(user_id)
+
+async def aacquire(api: str, user_id: Optional[str] = None):
+    await upstreams[api].aacquire(user_id)
+
+def admit_chat(user_id: str):
+    """Early 429 for a new /chat turn: the user's turn budget is spent or Gemini is already backed up."""
+    upstreams["chat"].admit(user_id)
+    wait = upstreams["gemini"].estimated_wait(INTERACTIVE)
+    if wait > SCHEDULER_MAX_WAIT:
+        raise RateLimited("gemini", wait)
+
+def quota_exceeded(api: str, retry_after: Optional[float] = None) -> RateLimited:
+    """For an upstream 429/quota error: backs the whole upstream off and returns the error to raise."""
+    retry_after = UPSTREAM_QUOTA_BACKOFF if retry_after is None else retry_after
+    upstreams[api].penalize(retry_after)
+    return RateLimited(api, retry_after)
+
+def snapshot() -> dict:
+    return {name: upstream.snapshot() for name, upstream in upstreams.items()}
@@ -0,0 +1,396 @@
+import os
+import time
+import heapq
+import random
+import socket
+import asyncio
+import contextlib
+import threading
+import contextvars
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+import settings
+from rate_limiter import UpstreamUnavailable
+
+# ==== Settings ====
+RETRY_ATTEMPTS = int(os.getenv("RETRY_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", "0.2"))
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", "2"))
+# Consecutive transient failures that open an upstream's circuit, and how long it stays open
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "15"))
+# Hedged reads: a second attempt starts once the first runs past the observed p95
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+# At most this share of calls may be hedged, so a slow upstream does not get double the load
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1"))
+HEDGE_MAX_WORKERS = int(os.getenv("HEDGE_MAX_WORKERS", "8"))
+# Local fault injection for exercising this layer without a misbehaving upstream:
+# "upstream:error_rate:extra_latency_seconds,..." e.g. "gemini:0.3:0,calendar:0:1.5"
+FAULT_INJECTION = os.getenv("FAULT_INJECTION", "")
+
+_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+class CircuitOpen(UpstreamUnavailable):
+    status_code = 503
+
+    def __init__(self, api: str, retry_after: float):
+        super().__init__(api, retry_after, "{label} is temporarily unavailable. Please try again in {retry_after}s.")
+
+class DeadlineExceeded(UpstreamUnavailable):
+    status_code = 504
+
+    def __init__(self, api: str):
+        super().__init__(api, 1, "{label} took too long to respond. Please try again.")
+
+class InjectedFault(ConnectionError):
+    """Transient failure raised by FAULT_INJECTION."""
+
+# ==== Deadlines ====
+def set_deadline(seconds: float):
+    """Every upstream call made in this context (and threads it spawns) must finish within `seconds`."""
+    _deadline.set(time.monotonic() + seconds)
+
+@contextlib.contextmanager
+def no_deadline():
+    """Lifts the request deadline for work that outlives the response (e.g. background tasks)."""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining() -> Optional[float]:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def _check_deadline(api: str):
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(api)
+
+# ==== Error classification ====
+_TRANSIENT_STATUS = {408, 500, 502, 503, 504}
+
+def is_transient(e: Exception) -> bool:
+    """Network errors and 5xx-style responses are worth retrying; caller errors and our own limits are not."""
+    if isinstance(e, UpstreamUnavailable):
+        return False
+    if isinstance(e, (ConnectionError, TimeoutError, socket.timeout)):
+        return True
+    status = getattr(getattr(e, "resp", None), "status", None)          # googleapiclient HttpError
+    if status is None:
+        status = getattr(e, "code", None)                                # google.api_core / postgrest
+        status = getattr(status, "value", status)
+    try:
+        if int(status) in _TRANSIENT_STATUS:
+            return True
+    except (TypeError, ValueError):
+        pass
+    # httpx (Supabase) transport errors, without importing httpx here
+    return any(cls.__name__ in ("TransportError", "TimeoutException") for cls in type(e).__mro__)
+
+def backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given retry number (1-based)."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+# ==== Circuit breakers ====
+class CircuitBreaker:
+    """Opens after BREAKER_FAILURE_THRESHOLD consecutive transient failures; after the reset
+    timeout a single probe call is let through, and its outcome closes or reopens the circuit."""
+
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return
+            if state == "half_open" and not self.probing:
+                self.probing = True
+                return
+            self.stats["rejected"] += 1
+            retry_after = self.reset_timeout - (time.monotonic() - self.opened_at) if state == "open" else 1
+            raise CircuitOpen(self.name, retry_after)
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self.stats["failures"] += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.probing:
+                    self.stats["opened"] += 1
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+    def release(self):
+        """The call ended without telling us anything about upstream health."""
+        with self._lock:
+            self.probing = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.failures, **self.stats}
+
+breakers = {name: CircuitBreaker(name) for name in ("gemini", "gmail", "calendar", "supabase")}
+
+# ==== Fault injection ====
+def _parse_faults(spec: str) -> dict:
+    faults = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        name, error_rate, latency = item.split(":")
+        faults[name] = (float(error_rate), float(latency))
+    return faults
+
+faults = _parse_faults(FAULT_INJECTION)
+
+def _fault(api: str) -> float:
+    """Returns injected latency for this attempt, or raises an injected transient error."""
+    error_rate, latency = faults.get(api, (0.0, 0.0))
+    if random.random() < error_rate:
+        raise InjectedFault(f"injected {api} fault")
+    return latency
+
+# ==== Retries ====
+def call(api: str, func: Callable, *args, idempotent=True, **kwargs):
+    """Calls func through the upstream's circuit breaker, retrying transient failures of
+    idempotent calls with jittered backoff while the request deadline allows.
+
+    idempotent may be a callable, evaluated after a failure, for calls that stop being
+    safe to repeat part-way through (e.g. a stream that already produced output).
+    """
+    breaker = breakers[api]
+    attempt = 0
+    while True:
+        _check_deadline(api)
+        breaker.allow()
+        try:
+            latency = _fault(api)
+            if latency:
+                time.sleep(latency)
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if not _failed(breaker, e, attempt := attempt + 1, idempotent):
+                raise
+            time.sleep(backoff(attempt))
+            continue
+        breaker.success()
+        return result
+
+async def acall(api: str, factory: Callable, idempotent=True):
+    """Async call(): factory() returns a fresh awaitable for each attempt."""
+    breaker = breakers[api]
+    attempt = 0
+    while True:
+        _check_deadline(api)
+        breaker.allow()
+        try:
+            latency = _fault(api)
+            if latency:
+                await asyncio.sleep(latency)
+            result = await factory()
+        except Exception as e:
+            if not _failed(breaker, e, attempt := attempt + 1, idempotent):
+                raise
+            await asyncio.sleep(backoff(attempt))
+            continue
+        breaker.success()
+        return result
+
+def _failed(breaker: CircuitBreaker, e: Exception, attempt: int, idempotent) -> bool:
+    """Records the failure; True if another attempt should be made."""
+    if not is_transient(e):
+        if isinstance(e, UpstreamUnavailable):
+            # Never reached the upstream (limiter, deadline); says nothing about its health
+            breaker.release()
+        else:
+            # The upstream answered, just not with what we wanted
+            breaker.success()
+        return False
+    breaker.failure()
+    if callable(idempotent):
+        idempotent = idempotent()
+    if not idempotent or attempt >= RETRY_ATTEMPTS or breaker.state != "closed":
+        return False
+    left = remaining()
+    if left is not None and left <= RETRY_MAX_DELAY:
+        return False
+    breaker.stats["retries"] += 1
+    print(f"Retrying {breaker.name} after {type(e).__name__}: {e}")
+    return True
+
+# ==== Hedged reads ====
+class LatencyWindow:
+    """Recent latencies for one operation, for its p95 hedge threshold."""
+
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+        self.calls = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def hedge_delay(self) -> Optional[float]:
+        with self._lock:
+            self.calls += 1
+            if len(self.samples) < HEDGE_MIN_SAMPLES or self.hedges >= HEDGE_MAX_RATIO * self.calls:
+                return None
+            ordered = sorted(self.samples)
+            return max(HEDGE_MIN_DELAY, ordered[int(len(ordered) * 0.95) - 1])
+
+    def hedged(self):
+        with self._lock:
+            self.hedges += 1
+
+latency_windows = {}
+_windows_lock = threading.Lock()
+# Backups only; primaries run on the caller's thread
+_hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_MAX_WORKERS, thread_name_prefix="hedge")
+
+def _window(key: str) -> LatencyWindow:
+    with _windows_lock:
+        return latency_windows.setdefault(key, LatencyWindow())
+
+class _BackupTimer:
+    """One thread that starts each hedge's backup once its primary has run past the delay,
+    so waiting out the delay never holds a pool thread."""
+
+    def __init__(self):
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, delay: float, launch: Callable[[], None]):
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._seq, launch))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="hedge-timer", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cond.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, launch = heapq.heappop(self._heap)
+            launch()
+
+_backup_timer = _BackupTimer()
+
+class _Hedge:
+    """A primary running on the caller's thread and the backup the timer may start for it."""
+
+    def __init__(self, window: LatencyWindow, attempt: Callable[[bool], object]):
+        self.window = window
+        self.attempt = attempt
+        self.context = contextvars.copy_context()
+        self.backup = None
+        self.primary_done = False
+        self.lock = threading.Lock()
+
+    def launch(self):
+        with self.lock:
+            if self.primary_done:
+                return
+            self.window.hedged()
+            self.backup = _hedge_pool.submit(self.context.copy().run, self.attempt, False)
+
+    def finish(self):
+        """Marks the primary finished; returns the backup, if one was started."""
+        with self.lock:
+            self.primary_done = True
+            return self.backup
+
+def hedged(key: str, attempt: Callable[[bool], object]):
+    """Runs attempt(True) on the caller's thread; if it is still running after the operation's
+    p95, also starts attempt(False) on the hedge pool. attempt(False) must not share state
+    (e.g. an httplib2 connection) with the primary. Only for idempotent reads.
+
+    The caller's thread cannot leave a primary it is running, so this returns once the
+    primary does: its result, or when it failed, the backup's. ahedged() returns whichever
+    finishes first."""
+    window = _window(key)
+    delay = window.hedge_delay() if HEDGE_ENABLED else None
+    start = time.monotonic()
+    if delay is None:
+        result = attempt(True)
+        window.add(time.monotonic() - start)
+        return result
+
+    hedge = _Hedge(window, attempt)
+    _backup_timer.schedule(delay, hedge.launch)
+    try:
+        result = attempt(True)
+    except Exception:
+        backup = hedge.finish()
+        if backup is None:
+            raise
+        result = backup.result()
+    else:
+        hedge.finish()
+    window.add(time.monotonic() - start)
+    return result
+
+async def ahedged(key: str, attempt: Callable[[bool], object]):
+    """Async hedged(): attempt(primary) returns an awaitable."""
+    window = _window(key)
+    delay = window.hedge_delay() if HEDGE_ENABLED else None
+    start = time.monotonic()
+    if delay is None:
+        result = await attempt(True)
+        window.add(time.monotonic() - start)
+        return result
+
+    primary = asyncio.ensure_future(attempt(True))
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    tasks = {primary}
+    if not done:
+        window.hedged()
+        tasks.add(asyncio.ensure_future(attempt(False)))
+    try:
+        pending = set(tasks)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = done.pop()
+            if winner.exception() is None or not pending:
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+    window.add(time.monotonic() - start)
+    return winner.result()
+
+def snapshot() -> dict:
+    with _windows_lock:
+        hedging = {key: {"calls": w.calls, "hedges": w.hedges, "samples": len(w.samples)}
+                   for key, w in latency_windows.items()}
+    return {"breakers": {name: b.snapshot() for name, b in breakers.items()}, "hedging": hedging}
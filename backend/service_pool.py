@@ -0,0 +1,175 @@
+import os
+import copy
+import json
+import time
+import threading
+import functools
+from collections import OrderedDict
+import httplib2
+import google_auth_httplib2
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.errors import HttpError
+import settings
+from rate_limiter import upstreams, quota_exceeded
+import resilience
+from metrics import span
+
+SERVICE_POOL_SIZE = int(os.getenv("SERVICE_POOL_SIZE", "64"))
+# Idle services (and their keep-alive connections) older than this are closed.
+SERVICE_POOL_IDLE_TTL = float(os.getenv("SERVICE_POOL_IDLE_TTL", "300"))
+GOOGLE_HTTP_TIMEOUT = float(os.getenv("GOOGLE_HTTP_TIMEOUT", "30"))
+# Sends Google API requests (batches included) to another host, e.g. the benchmark stand-ins
+GOOGLE_API_ROOT_URL = os.getenv("GOOGLE_API_ROOT_URL")
+
+@functools.lru_cache(maxsize=None)
+def discovery_document(api: str, version: str):
+    """Parses the discovery document shipped with google-api-python-client once per process."""
+    doc = get_static_doc(api, version)
+    return json.loads(doc) if doc else None
+
+class UpstreamHttp:
+    """Transport wrapper every Google API request goes through (batches included).
+
+    Each attempt is admitted by the rate limiter and runs behind the API's circuit
+    breaker. Reads (GET, freeBusy) that fail transiently are retried with backoff
+    within the request deadline; writes are never repeated. Quota errors become
+    RateLimited instead of a generic HttpError.
+    """
+
+    def __init__(self, http, api: str, user_id: str = None):
+        self.http = http
+        self.api = api
+        self.user_id = user_id
+
+    def request(self, uri, method="GET", *args, **kwargs):
+        idempotent = method in ("GET", "HEAD") or uri.split("?")[0].endswith("/freeBusy")
+        with span(self.api, method):
+            return resilience.call(self.api, self._attempt, uri, method, *args, idempotent=idempotent, **kwargs)
+
+    def _attempt(self, uri, method, *args, **kwargs):
+        upstreams[self.api].acquire(self.user_id)
+        resp, content = self.http.request(uri, method, *args, **kwargs)
+        if resp.status == 429 or (resp.status == 403 and b"ratelimitexceeded" in (content or b"").lower()):
+            retry_after = resp.get("retry-after")
+            raise quota_exceeded(self.api, float(retry_after) if retry_after and retry_after.isdigit() else None)
+        if resp.status >= 500:
+            # Raised here (same type googleapiclient would raise) so the attempt can be retried
+            raise HttpError(resp, content, uri=uri)
+        return resp, content
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+def _transport(api: str, creds, user_id: str = None):
+    http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=GOOGLE_HTTP_TIMEOUT))
+    return UpstreamHttp(http, api, user_id) if api in upstreams else http
+
+def spare_transport(service):
+    """A separate connection with the service's credentials, e.g. for a hedged duplicate request
+    (httplib2 connections must not be shared between threads). Close it after use."""
+    http = service._http
+    return _transport(http.api, http.http.credentials, http.user_id)
+
+def build_service(api: str, version: str, creds, user_id: str = None):
+    """Builds a Resource from the cached discovery document over its own keep-alive transport."""
+    http = _transport(api, creds, user_id)
+    doc = discovery_document(api, version)
+    if doc is None:
+        # Not bundled with this client version; fall back to fetching it
+        return build(api, version, http=http)
+    # build_from_document fixes up the document in place, so each build gets its own copy
+    doc = copy.deepcopy(doc)
+    if GOOGLE_API_ROOT_URL:
+        doc["rootUrl"] = GOOGLE_API_ROOT_URL
+    return build_from_document(doc, http=http)
+
+def _close(service):
+    try:
+        service._http.close()
+    except Exception:
+        pass
+
+class ServicePool:
+    """Bounded pool of idle Google API services keyed by (api, version, user).
+
+    httplib2 transports are not thread-safe, so a service is leased to one caller
+    at a time: acquire() hands out an idle service (or builds one) and release()
+    returns it for reuse. Services whose credentials were replaced, that sat idle
+    past SERVICE_POOL_IDLE_TTL, or that fall off the LRU end are closed.
+    """
+
+    def __init__(self, max_idle: int = SERVICE_POOL_SIZE, idle_ttl: float = SERVICE_POOL_IDLE_TTL):
+        self.max_idle = max_idle
+        self.idle_ttl = idle_ttl
+        self._idle: "OrderedDict[int, tuple]" = OrderedDict()
+        self._leased: dict = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, api: str, version: str, user_id: str, creds):
+        key = (api, version, user_id)
+        now = time.monotonic()
+        stale = []
+        service = None
+        with self._lock:
+            for sid, (entry_key, entry_creds, svc, last_used) in list(self._idle.items()):
+                if entry_key != key:
+                    continue
+                del self._idle[sid]
+                # Reuse only while the caller still holds the same credentials object
+                if entry_creds is creds and now - last_used < self.idle_ttl:
+                    service = svc
+                    break
+                stale.append(svc)
+            if service is not None:
+                self._leased[id(service)] = (key, creds)
+        for svc in stale:
+            _close(svc)
+
+        if service is None:
+            service = build_service(api, version, creds, user_id)
+            with self._lock:
+                self._leased[id(service)] = (key, creds)
+        return service
+
+    def release(self, service):
+        if service is None:
+            return
+        evicted = []
+        now = time.monotonic()
+        with self._lock:
+            lease = self._leased.pop(id(service), None)
+            if lease is None:
+                return
+            key, creds = lease
+            self._idle[id(service)] = (key, creds, service, now)
+            for sid, (_, _, svc, last_used) in list(self._idle.items()):
+                if len(self._idle) <= self.max_idle and now - last_used < self.idle_ttl:
+                    break
+                del self._idle[sid]
+                evicted.append(svc)
+        for svc in evicted:
+            _close(svc)
+
+    def discard(self, service):
+        """Ends a lease without pooling the service, e.g. while an abandoned hedged request
+        may still be using its connection. It is closed once garbage-collected."""
+        with self._lock:
+            self._leased.pop(id(service), None)
+
+    def invalidate_user(self, user_id: str):
+        """Closes every idle service for a user, e.g. after their tokens change."""
+        with self._lock:
+            doomed = [sid for sid, entry in self._idle.items() if entry[0][2] == user_id]
+            services = [self._idle.pop(sid)[2] for sid in doomed]
+        for svc in services:
+            _close(svc)
+
+    def close(self):
+        with self._lock:
+            services = [entry[2] for entry in self._idle.values()]
+            self._idle.clear()
+        for svc in services:
+            _close(svc)
+
+service_pool = ServicePool()
@@ -0,0 +1,127 @@
+import os
+import json
+from typing import List
+from langchain_core.messages import HumanMessage, AIMessage
+import settings
+from kv_store import MemoryBackend, SQLiteBackend
+from llm_cache import agenerate_text
+from rate_limiter import background
+from resilience import no_deadline
+
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")  # "memory" or "sqlite"
+SESSION_DB_PATH = settings.data_path(os.getenv("SESSION_DB_PATH", "sessions.sqlite3"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", "86400"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+# Beyond this many stored messages, the oldest are folded into the running summary.
+SESSION_MAX_MESSAGES = int(os.getenv("SESSION_MAX_MESSAGES", "20"))
+SESSION_KEEP_MESSAGES = int(os.getenv("SESSION_KEEP_MESSAGES", "8"))
+# Prompt budget for conversation history (~4 chars per token). History past three quarters
+# of it is compacted down to half, so older turns are summarized before the prompt window
+# would have to leave them out.
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "2000"))
+
+SUMMARY_MODEL = settings.gemini_model()
+
+def _new_session() -> dict:
+    return {"history": [], "summary": "", "context": {}}
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def _due_for_compaction(history: list) -> bool:
+    return (len(history) > SESSION_MAX_MESSAGES
+            or sum(estimate_tokens(m["content"]) for m in history) > HISTORY_TOKEN_BUDGET * 3 // 4)
+
+def _kept_messages(history: list) -> int:
+    """How many of the newest messages stay verbatim: whole turns, at most SESSION_KEEP_MESSAGES
+    and half the token budget."""
+    kept, used = 0, 0
+    for message in reversed(history):
+        size = estimate_tokens(message["content"])
+        if kept >= SESSION_KEEP_MESSAGES or used + size > HISTORY_TOKEN_BUDGET // 2:
+            break
+        kept, used = kept + 1, used + size
+    return kept - kept % 2
+
+class SessionStore:
+    """Server-side conversation state per (user_id, session_id).
+
+    A session holds compact history (user turns and final replies only), a running
+    summary of turns that were compacted away, and the slot-filling context.
+    """
+
+    def __init__(self, backend, ttl: float = SESSION_TTL):
+        self.backend = backend
+        self.ttl = ttl
+
+    @staticmethod
+    def key(user_id: str, session_id: str) -> str:
+        return json.dumps([user_id, session_id])
+
+    def load(self, user_id: str, session_id: str) -> dict:
+        raw = self.backend.get(self.key(user_id, session_id))
+        return json.loads(raw) if raw else _new_session()
+
+    def save(self, user_id: str, session_id: str, session: dict):
+        self.backend.set(self.key(user_id, session_id), json.dumps(session), self.ttl)
+
+    def delete(self, user_id: str, session_id: str):
+        self.backend.delete(self.key(user_id, session_id))
+
+    def record_turn(self, user_id: str, session_id: str, session: dict,
+                    user_text: str, reply: str, context: dict) -> bool:
+        """Appends one turn and saves it. Returns True when the session is due for compaction."""
+        session["history"] += [
+            {"role": "user", "content": user_text},
+            {"role": "model", "content": reply},
+        ]
+        session["context"] = context or {}
+        self.save(user_id, session_id, session)
+        return _due_for_compaction(session["history"])
+
+    async def compact(self, user_id: str, session_id: str):
+        """Summarizes all but the newest few messages into the session summary.
+
+        Meant to run after the reply has been sent, so it never adds to turn latency.
+        """
+        session = self.load(user_id, session_id)
+        if not _due_for_compaction(session["history"]):
+            return
+        old = session["history"][:len(session["history"]) - _kept_messages(session["history"])]
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in old)
+        prompt = (
+            "Summarize this conversation between a user and their scheduling/email assistant in at most "
+            "five sentences. Keep names, email addresses, dates, times and anything still unresolved.\n\n"
+            + (f"Earlier summary: {session['summary']}\n\n" if session["summary"] else "")
+            + transcript
+        )
+        try:
+            # Never competes with interactive turns for Gemini quota; runs after the response,
+            # so the turn's deadline does not apply
+            with background(), no_deadline():
+                summary = await agenerate_text(SUMMARY_MODEL, prompt, operation="compaction")
+        except Exception as e:
+            print(f"Session compaction failed for {user_id}: {e}")
+            return
+        # Turns recorded while the summary was generated are in the stored copy, not in ours:
+        # reload and swap out only the prefix that was summarized
+        current = self.load(user_id, session_id)
+        if current["history"][:len(old)] != old:
+            # Compacted by another task in the meantime, or the session was cleared
+            return
+        current["summary"], current["history"] = summary, current["history"][len(old):]
+        self.save(user_id, session_id, current)
+
+def history_messages(session: dict) -> List:
+    """Rebuilds LangChain messages from the stored compact history."""
+    return [
+        HumanMessage(content=m["content"]) if m["role"] == "user" else AIMessage(content=m["content"])
+        for m in session["history"]
+    ]
+
+def _make_backend():
+    if SESSION_BACKEND == "sqlite":
+        return SQLiteBackend(SESSION_DB_PATH, SESSION_MAX, table="sessions")
+    return MemoryBackend(SESSION_MAX)
+
+session_store = SessionStore(_make_backend())
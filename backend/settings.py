@@ -0,0 +1,72 @@
+import os
+import threading
+import dotenv
+
+# Loaded once per process; every module imports settings (directly or through a
+# dependency) instead of reading .env itself.
+dotenv.load_dotenv()
+
+# ==== Gemini ====
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+
+# ==== Supabase ====
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+# ==== Storage ====
+# Relative SQLite paths (checkpoints, jobs, sessions, the LLM cache) resolve against this
+# directory, so where the app or the tests are started from does not matter
+DATA_DIR = os.getenv("DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+def data_path(path: str) -> str:
+    return path if path == ":memory:" else os.path.join(DATA_DIR, path)
+
+# ==== Startup ====
+# Import the heavy libraries and build clients in a background thread once the app is up,
+# so the first request does not pay for them
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() == "true"
+
+_genai = None
+_genai_lock = threading.Lock()
+
+def genai():
+    """google.generativeai, imported and configured on first use (it takes about a second to import)."""
+    global _genai
+    if _genai is None:
+        with _genai_lock:
+            if _genai is None:
+                if not GEMINI_API_KEY:
+                    raise ValueError("GEMINI_API_KEY is not set in the environment.")
+                import google.generativeai as module
+                module.configure(api_key=GEMINI_API_KEY)
+                _genai = module
+    return _genai
+
+class LazyModel:
+    """A GenerativeModel that is built on first use.
+
+    model_name is known up front (normalized the way the SDK does it), so cache keys
+    and metrics can use it without importing the SDK.
+    """
+
+    def __init__(self, model_name: str = GEMINI_MODEL, **kwargs):
+        self.model_name = model_name if "/" in model_name else f"models/{model_name}"
+        self._kwargs = kwargs
+        self._model = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = genai().GenerativeModel(model_name=self.model_name, **self._kwargs)
+        return self._model
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+def gemini_model(model_name: str = GEMINI_MODEL, **kwargs) -> LazyModel:
+    return LazyModel(model_name, **kwargs)
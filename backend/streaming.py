@@ -0,0 +1,26 @@
+import json
+
+# ==== Stream Event Types ====
+NODE_ENTERED = "node_entered"
+TOKEN = "token"
+TOOL_STARTED = "tool_started"
+TOOL_FINISHED = "tool_finished"
+JOB_FINISHED = "job_finished"
+FINAL = "final"
+ERROR = "error"
+
+def emit(event: str, **data):
+    """Sends a typed event to the graph's custom stream; a no-op outside a streaming run."""
+    from langgraph.config import get_stream_writer  # deferred: langgraph is slow to import
+    try:
+        writer = get_stream_writer()
+    except (RuntimeError, KeyError):
+        return
+    writer({"event": event, **data})
+
+def emit_token(text: str):
+    emit(TOKEN, text=text)
+
+def sse(event: str, data: dict) -> str:
+    """Formats one Server-Sent Events frame."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
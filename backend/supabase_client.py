@@ -1,16 +1,23 @@
-import os
 import json
-import dotenv
-from supabase import create_client, Client
+import asyncio
+import threading
 from google.oauth2.credentials import Credentials
 from google.auth.transport.requests import Request
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
+from concurrency import run_blocking
+from credential_cache import credential_cache
+from service_pool import service_pool
+from rate_limiter import UpstreamUnavailable
+from resilience import call, acall, hedged, ahedged
+from metrics import span
+import settings
 
-dotenv.load_dotenv()
+if TYPE_CHECKING:
+    from supabase import Client, AsyncClient
 
 # --- Supabase Configuration ---
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+SUPABASE_URL = settings.SUPABASE_URL
+SUPABASE_KEY = settings.SUPABASE_KEY
 SUPABASE_TABLE = "user_tokens"
 CALENDAR_SCOPES = [
     'https://www.googleapis.com/auth/calendar.events', 
@@ -19,45 +26,92 @@ CALENDAR_SCOPES = [
     'https://www.googleapis.com/auth/gmail.readonly'
 ]
 
-# Initialize Supabase client
-supabase: Optional[Client] = None
-if SUPABASE_URL and SUPABASE_KEY:
-    try:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    except Exception as e:
-        print(f"Error initializing Supabase client: {e}")
-        supabase = None
-else:
+if not (SUPABASE_URL and SUPABASE_KEY):
     print("Warning: SUPABASE_URL or SUPABASE_KEY is missing. Database operations will fail.")
 
-def store_credentials(user_id: str, credentials: Credentials):
-    """Stores/Updates the Google Credentials JSON for a user in the Supabase table."""
-    if not supabase: return 
+# Both clients are created on first use; the supabase package is imported then too
+_supabase: Optional["Client"] = None
+_supabase_attempted = False
+_supabase_lock = threading.Lock()
+
+def get_supabase() -> Optional["Client"]:
+    global _supabase, _supabase_attempted
+    if _supabase_attempted or not (SUPABASE_URL and SUPABASE_KEY):
+        return _supabase
+    with _supabase_lock:
+        if not _supabase_attempted:
+            try:
+                from supabase import create_client
+                _supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+            except Exception as e:
+                print(f"Error initializing Supabase client: {e}")
+            _supabase_attempted = True
+    return _supabase
 
+_async_supabase: Optional["AsyncClient"] = None
+_async_supabase_lock = asyncio.Lock()
+
+async def get_async_supabase() -> Optional["AsyncClient"]:
+    global _async_supabase
+    if _async_supabase or not (SUPABASE_URL and SUPABASE_KEY):
+        return _async_supabase
+    async with _async_supabase_lock:
+        if _async_supabase is None:
+            try:
+                from supabase import acreate_client
+                _async_supabase = await acreate_client(SUPABASE_URL, SUPABASE_KEY)
+            except Exception as e:
+                print(f"Error initializing async Supabase client: {e}")
+    return _async_supabase
+
+def _serialize_credentials(credentials: Credentials) -> dict:
     creds_dict = json.loads(credentials.to_json())
     creds_dict['expiry'] = credentials.expiry.isoformat() if credentials.expiry else None
+    return creds_dict
+
+def store_credentials(user_id: str, credentials: Credentials):
+    """Stores/Updates the Google Credentials JSON for a user in the Supabase table."""
+    client = get_supabase()
+    if not client: return
+
+    creds_dict = _serialize_credentials(credentials)
 
     try:
         # Use upsert to insert or update the row based on user_id (email)
-        supabase.table(SUPABASE_TABLE).upsert({
+        query = client.table(SUPABASE_TABLE).upsert({
             "user_id": user_id,
             "google_credentials": creds_dict
-        }).execute()
+        })
+        # Upserting the same row again is harmless, so transient failures are retried
+        with span("supabase", "upsert"):
+            call("supabase", query.execute)
         # print(f"Successfully stored credentials for user: {user_id}")
     except Exception as e:
         print(f"Supabase Store Error for {user_id}: {e}")
 
 def load_credentials(user_id: str) -> Optional[Credentials]:
+    """Returns the user's Google Credentials from the in-process cache, loading them on a miss."""
+    return credential_cache.get_or_load(user_id, _fetch_credentials)
+
+def invalidate_credentials(user_id: str):
+    """Drops cached credentials so the next load reads the freshly stored tokens."""
+    credential_cache.invalidate(user_id)
+    service_pool.invalidate_user(user_id)
+
+def _fetch_credentials(user_id: str) -> Optional[Credentials]:
     """Loads and rebuilds the Google Credentials object for a given user, refreshing if expired."""
-    if not supabase: return None
+    client = get_supabase()
+    if not client: return None
 
     try:
         # 1. Fetch credentials from Supabase
-        response = supabase.table(SUPABASE_TABLE)\
+        query = client.table(SUPABASE_TABLE)\
             .select("google_credentials")\
             .eq("user_id", user_id)\
-            .single()\
-            .execute()
+            .single()
+        # Hedged: a slow read gets a duplicate request once it passes the usual p95
+        with span("supabase", "select"):
+            response = hedged("supabase.credentials", lambda primary: call("supabase", query.execute))
         
         data = response.data
         if not data or not data.get('google_credentials'):
@@ -72,7 +126,8 @@ def load_credentials(user_id: str) -> Optional[Credentials]:
         # 3. Check for expiry and refresh if needed
         if creds.expired and creds.refresh_token:
             # print(f"Token expired for {user_id}. Attempting refresh...")
-            creds.refresh(Request())
+            with span("google_oauth", "refresh"):
+                creds.refresh(Request())
             # Store the refreshed credentials back to the database
             store_credentials(user_id, creds)
         
@@ -82,8 +137,64 @@ def load_credentials(user_id: str) -> Optional[Credentials]:
             
         return creds
         
+    except UpstreamUnavailable:
+        # Store unreachable, not "user never authorized": report it as such
+        raise
     except Exception as e:
         # This catches exceptions like "Postgrest API error: The result contains 0 rows"
         # which means the user has not authorized yet.
         # print(f"Supabase/Auth Load Error for {user_id}: {e}")
         return None
+
+async def astore_credentials(user_id: str, credentials: Credentials):
+    """Async variant of store_credentials using the async Supabase client."""
+    client = await get_async_supabase()
+    if not client: return
+
+    try:
+        query = client.table(SUPABASE_TABLE).upsert({
+            "user_id": user_id,
+            "google_credentials": _serialize_credentials(credentials)
+        })
+        with span("supabase", "upsert"):
+            await acall("supabase", query.execute)
+    except Exception as e:
+        print(f"Supabase Store Error for {user_id}: {e}")
+
+async def aload_credentials(user_id: str) -> Optional[Credentials]:
+    """Async variant of load_credentials; concurrent misses for one user share a single refresh."""
+    return await credential_cache.aget_or_load(user_id, _afetch_credentials)
+
+async def _afetch_credentials(user_id: str) -> Optional[Credentials]:
+    """Async variant of _fetch_credentials; the OAuth refresh runs in the bounded thread pool."""
+    client = await get_async_supabase()
+    if not client: return None
+
+    try:
+        query = client.table(SUPABASE_TABLE)\
+            .select("google_credentials")\
+            .eq("user_id", user_id)\
+            .single()
+        with span("supabase", "select"):
+            response = await ahedged("supabase.credentials", lambda primary: acall("supabase", query.execute))
+
+        data = response.data
+        if not data or not data.get('google_credentials'):
+            return None
+
+        creds = Credentials.from_authorized_user_info(data['google_credentials'], scopes=CALENDAR_SCOPES)
+
+        if creds.expired and creds.refresh_token:
+            with span("google_oauth", "refresh"):
+                await run_blocking(creds.refresh, Request())
+            await astore_credentials(user_id, creds)
+
+        if not creds.valid:
+            return None
+
+        return creds
+
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        return None
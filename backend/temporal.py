@@ -0,0 +1,292 @@
+import os
+import re
+import datetime
+import threading
+import contextvars
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+from typing import Optional, Tuple
+import pytz
+import settings
+
+# ==== Configuration ====
+# Used until a client reports the user's timezone
+DEFAULT_TIMEZONE = os.getenv("DEFAULT_TIMEZONE", "Asia/Kolkata")
+# What "end of day" / "EOD" means
+END_OF_DAY = os.getenv("END_OF_DAY", "18:00")
+TEMPORAL_CACHE_SIZE = int(os.getenv("TEMPORAL_CACHE_SIZE", "4096"))
+# Expressions the local grammar cannot read go to dateparser, restricted to these languages
+TEMPORAL_LANGUAGES = [lang.strip() for lang in os.getenv("TEMPORAL_LANGUAGES", "en").split(",") if lang.strip()]
+TIMEZONE_MAX_USERS = int(os.getenv("TIMEZONE_MAX_USERS", "10000"))
+
+# ==== Per-user timezone ====
+_timezone = contextvars.ContextVar("request_timezone", default=None)
+_user_timezones = OrderedDict()  # user_id -> last valid timezone the client reported
+_user_timezones_lock = threading.Lock()
+
+def set_request_timezone(user_id: Optional[str], name: Optional[str] = None) -> str:
+    """Sets the timezone for calls made in this context (and threads it spawns).
+
+    Uses the client-reported IANA name when valid, otherwise the last one reported for
+    the user, otherwise DEFAULT_TIMEZONE. Returns the name used.
+    """
+    with _user_timezones_lock:
+        if name and name in pytz.all_timezones_set:
+            if user_id:
+                _user_timezones[user_id] = name
+                _user_timezones.move_to_end(user_id)
+                while len(_user_timezones) > TIMEZONE_MAX_USERS:
+                    _user_timezones.popitem(last=False)
+        else:
+            name = _user_timezones.get(user_id, DEFAULT_TIMEZONE)
+    _timezone.set(name)
+    return name
+
+def timezone_name() -> str:
+    return _timezone.get() or DEFAULT_TIMEZONE
+
+def current_timezone():
+    return pytz.timezone(timezone_name())
+
+def now(tz=None) -> datetime.datetime:
+    """Aware current time in the request's timezone."""
+    return datetime.datetime.now(tz or current_timezone())
+
+# ==== Grammar ====
+# Patterns run against lowercased, whitespace-collapsed text; the first date rule and
+# the first time of day found win.
+_NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12,
+}
+_NUMBER = r"(?P<n>\d+|" + "|".join(_NUMBER_WORDS) + r")"
+_MONTH = (r"(?P<month>jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?"
+          r"|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)\.?")
+_WEEKDAY_NAMES = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+_WEEKDAY = (r"(?P<weekday>mon(?:day)?|tue(?:s(?:day)?)?|wed(?:nesday)?|thu(?:r(?:s(?:day)?)?)?"
+            r"|fri(?:day)?|sat(?:urday)?|sun(?:day)?)")
+_MONTHS = ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec")
+
+_ISO_DATE = re.compile(r"(?<!\d)(?P<year>\d{4})[-/](?P<month>\d{1,2})[-/](?P<day>\d{1,2})(?!\d)")
+_MONTH_DAY = re.compile(rf"\b{_MONTH}\s+(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\b(?:,?\s+(?P<year>\d{{4}})\b)?")
+_DAY_MONTH = re.compile(rf"\b(?P<day>\d{{1,2}})(?:st|nd|rd|th)?\s+(?:of\s+)?{_MONTH}(?:,?\s+(?P<year>\d{{4}})\b)?")
+_RELATIVE_DAY = re.compile(r"\b(?:the\s+)?(?P<word>day after tomorrow|today|tonight|tomorrow|tmrw|yesterday)\b")
+_WEEKDAY_PHRASE = re.compile(rf"\b(?:(?P<which>this|next|coming)\s+)?{_WEEKDAY}\b")
+_WEEK = re.compile(r"\b(?P<which>this|next)\s+week\b")
+_END_OF = re.compile(r"\b(?:end of (?:the |this |next )?(?P<unit>day|week)|(?P<eod>eod|cob|close of business)|(?P<eow>eow))\b")
+_UNIT = r"(?P<unit>min(?:ute)?s?|hours?|hrs?|days?|weeks?)"
+_OFFSETS = (
+    re.compile(rf"\bin\s+{_NUMBER}\s+{_UNIT}\b"),
+    re.compile(rf"\b{_NUMBER}\s+{_UNIT}\s+from\s+now\b"),
+)
+_CLOCK_12H = re.compile(r"(?<![\d:])(?P<hour>1[0-2]|0?[1-9])(?::(?P<minute>[0-5]\d))?\s*(?P<ampm>[ap])\.?\s?m\b\.?")
+_CLOCK_24H = re.compile(r"(?<![\d:])(?P<hour>[01]?\d|2[0-3]):(?P<minute>[0-5]\d)(?!\d)")
+_NAMED_TIME = re.compile(r"\b(?P<name>noon|midday|midnight|morning|afternoon|evening)\b")
+_NAMED_TIMES = {
+    "noon": datetime.time(12), "midday": datetime.time(12), "midnight": datetime.time(0),
+    "morning": datetime.time(9), "afternoon": datetime.time(14), "evening": datetime.time(18),
+}
+_TONIGHT = datetime.time(20)
+
+# Relative date phrases preprocess_user_text spells out; full weekday names only, so
+# words like "sun" or "sat" in ordinary text are left alone
+_RELATIVE_DATE_PHRASE = re.compile(
+    r"\b(?:day after tomorrow|today|tomorrow|(?:(?:this|next|coming)\s+)?(?:" + "|".join(_WEEKDAY_NAMES) + r"))\b",
+    re.IGNORECASE,
+)
+
+# date: a rule resolved against the reference date (see _resolve_day); time: a clock
+# time; offset: a timedelta from the reference moment ("in 2 hours")
+_Expression = namedtuple("_Expression", ["date", "time", "offset"])
+
+def _number(value: str) -> int:
+    return int(value) if value.isdigit() else _NUMBER_WORDS[value]
+
+def _clock(text: str) -> Optional[datetime.time]:
+    match = _CLOCK_12H.search(text)
+    if match:
+        hour = int(match.group("hour")) % 12 + (12 if match.group("ampm") == "p" else 0)
+        return datetime.time(hour, int(match.group("minute") or 0))
+    match = _CLOCK_24H.search(text)
+    if match:
+        return datetime.time(int(match.group("hour")), int(match.group("minute")))
+    match = _NAMED_TIME.search(text)
+    if match:
+        return _NAMED_TIMES[match.group("name")]
+    return None
+
+def _date_rule(text: str):
+    match = _ISO_DATE.search(text)
+    if match:
+        return ("on", int(match.group("year")), int(match.group("month")), int(match.group("day")))
+    for pattern in (_MONTH_DAY, _DAY_MONTH):
+        match = pattern.search(text)
+        if match:
+            month = _MONTHS.index(match.group("month")[:3]) + 1
+            year = int(match.group("year")) if match.group("year") else None
+            return ("on", year, month, int(match.group("day")))
+    match = _RELATIVE_DAY.search(text)
+    if match:
+        word = match.group("word")
+        days = {"day after tomorrow": 2, "tomorrow": 1, "tmrw": 1, "yesterday": -1}.get(word, 0)
+        return ("days", days)
+    match = _WEEKDAY_PHRASE.search(text)
+    if match:
+        weekday = [name[:3] for name in _WEEKDAY_NAMES].index(match.group("weekday")[:3])
+        # "friday" / "this friday": the coming one, today included; "next friday": after today
+        return ("weekday", weekday, 1 if match.group("which") == "next" else 0)
+    match = _WEEK.search(text)
+    if match:
+        return ("week", 1 if match.group("which") == "next" else 0)
+    return None
+
+@lru_cache(maxsize=TEMPORAL_CACHE_SIZE)
+def _parse(text: str) -> Optional[_Expression]:
+    """Parses normalized text into a reference-independent expression; None when nothing matched."""
+    date_rule, clock, offset = _date_rule(text), _clock(text), None
+
+    match = _END_OF.search(text)
+    if match:
+        if match.group("unit") == "week" or match.group("eow"):
+            # "end of next week": Friday of the week _date_rule found
+            weeks = date_rule[1] if date_rule and date_rule[0] == "week" else 0
+            date_rule = ("end_of_week", weeks) if date_rule is None or date_rule[0] == "week" else date_rule
+        date_rule = date_rule or ("days", 0)
+        clock = clock or _end_of_day()
+
+    for pattern in _OFFSETS:
+        match = pattern.search(text)
+        if match:
+            n, unit = _number(match.group("n")), match.group("unit")[0]
+            if unit in "dw":
+                date_rule = date_rule or ("days", n * (7 if unit == "w" else 1))
+            else:
+                offset = datetime.timedelta(hours=n) if unit == "h" else datetime.timedelta(minutes=n)
+            break
+
+    match = _RELATIVE_DAY.search(text)
+    if match and match.group("word") == "tonight":
+        clock = clock or _TONIGHT
+
+    if date_rule is None and clock is None and offset is None:
+        return None
+    return _Expression(date_rule, clock, offset)
+
+def _end_of_day() -> datetime.time:
+    hour, minute = END_OF_DAY.split(":")
+    return datetime.time(int(hour), int(minute))
+
+def _resolve_day(rule, today: datetime.date) -> Optional[datetime.date]:
+    kind = rule[0]
+    if kind == "on":
+        _, year, month, day = rule
+        try:
+            resolved = datetime.date(year or today.year, month, day)
+            if year is None and resolved < today:
+                # A month and day without a year mean the next one
+                resolved = datetime.date(today.year + 1, month, day)
+            return resolved
+        except ValueError:
+            return None
+    if kind == "days":
+        return today + datetime.timedelta(days=rule[1])
+    if kind == "weekday":
+        _, weekday, min_ahead = rule
+        ahead = (weekday - today.weekday()) % 7
+        if ahead < min_ahead:
+            ahead += 7
+        return today + datetime.timedelta(days=ahead)
+    if kind == "week":
+        # Start of the week: today for "this week", next Monday for "next week"
+        return today + datetime.timedelta(days=7 - today.weekday()) if rule[1] else today
+    if kind == "end_of_week":
+        friday = today + datetime.timedelta(days=4 - today.weekday() + 7 * rule[1])
+        return friday if friday >= today else friday + datetime.timedelta(days=7)
+    return None
+
+# ==== Fallback ====
+def fallback_parser():
+    """dateparser, imported on first use (it is slow to import); the startup warm-up preloads it."""
+    import dateparser
+    return dateparser
+
+@lru_cache(maxsize=TEMPORAL_CACHE_SIZE)
+def _fallback(text: str, reference: datetime.datetime, tz_name: str) -> Optional[datetime.date]:
+    parsed = fallback_parser().parse(text, languages=TEMPORAL_LANGUAGES, settings={
+        "PREFER_DATES_FROM": "future",
+        "RELATIVE_BASE": reference,
+        "TIMEZONE": tz_name,
+        "RETURN_AS_TIMEZONE_AWARE": False,
+    })
+    return parsed.date() if parsed else None
+
+# ==== Resolution ====
+def _normalize(text: str) -> str:
+    return " ".join(str(text).lower().split())
+
+def resolve(text: Optional[str], reference: Optional[datetime.datetime] = None
+            ) -> Tuple[Optional[datetime.date], Optional[datetime.time]]:
+    """(date, time of day) named by text, relative to reference (default: now in the request's timezone).
+
+    Either part is None when the text does not give it.
+    """
+    text = _normalize(text or "")
+    if not text:
+        return None, None
+    reference = reference or now()
+    expression = _parse(text)
+    if expression is None:
+        base = reference.replace(tzinfo=None, second=0, microsecond=0)
+        return _fallback(text, base, timezone_name()), None
+
+    day, clock = None, expression.time
+    if expression.offset is not None:
+        moment = reference + expression.offset
+        day, clock = moment.date(), clock or moment.time().replace(second=0, microsecond=0, tzinfo=None)
+    if expression.date is not None:
+        day = _resolve_day(expression.date, reference.date())
+    return day, clock
+
+def normalize_date(date_str: Optional[str]) -> Optional[str]:
+    """YYYY-MM-DD for the date in date_str; the input unchanged when it has none."""
+    if not date_str:
+        return None
+    day, _ = resolve(date_str)
+    return day.isoformat() if day else date_str
+
+def normalize_time(time_str: Optional[str]) -> Optional[str]:
+    """'HH:MM AM' for the time of day in time_str; the input unchanged when it has none."""
+    if not time_str:
+        return None
+    _, clock = resolve(time_str)
+    return clock.strftime("%I:%M %p") if clock else time_str
+
+def preprocess_user_text(user_text: str, reference: Optional[datetime.datetime] = None) -> str:
+    """Spells out relative dates ('tomorrow', 'next tuesday') as YYYY-MM-DD in the request's timezone."""
+    reference = reference or now()
+
+    def explicit(match):
+        day, _ = resolve(match.group(0), reference)
+        return day.isoformat() if day else match.group(0)
+
+    return _RELATIVE_DATE_PHRASE.sub(explicit, user_text)
+
+def event_window(date_str: Optional[str], time_str: Optional[str], duration_minutes=60, tz=None):
+    """Aware (start, end) for an event on date_str at time_str in tz (default: the request's timezone).
+
+    Raises ValueError when the date or the time cannot be read.
+    """
+    tz = tz or current_timezone()
+    reference = now(tz)
+    # Either field may carry both parts ("tomorrow at 4pm"); each wins for its own part
+    date_day, date_clock = resolve(date_str, reference)
+    time_day, time_clock = resolve(time_str, reference)
+    day = date_day or time_day
+    clock = time_clock if time_clock is not None else date_clock
+    if day is None:
+        raise ValueError(f"Could not read the date '{date_str}'")
+    if clock is None:
+        raise ValueError(f"Could not read the time '{time_str}'")
+    start = datetime.datetime.combine(day, clock)
+    end = start + datetime.timedelta(minutes=int(duration_minutes or 60))
+    return tz.localize(start), tz.localize(end)
@@ -0,0 +1,20 @@
+import os
+import sys
+import datetime
+import pytest
+import pytz
+
+# Backend modules are imported flat (`import temporal`), as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# settings refuses to start without a key; no test talks to Gemini
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+
+@pytest.fixture
+def fixed_now(monkeypatch):
+    """Pins temporal.now (and the request timezone) to Wednesday 2025-01-15 10:30 Asia/Kolkata;
+    returns that reference time."""
+    import temporal
+    reference = pytz.timezone("Asia/Kolkata").localize(datetime.datetime(2025, 1, 15, 10, 30))
+    monkeypatch.setattr(temporal, "now", lambda tz=None: reference)
+    temporal._timezone.set("Asia/Kolkata")
+    return reference
@@ -0,0 +1,25 @@
+import google.ai.generativelanguage as glm
+from agent_graph import GeminiFunctionAgent, cache_function_calls, cached_function_calls, context_from_call
+
+def gemini_response(name, args):
+    part = glm.Part(function_call=glm.FunctionCall(name=name, args=args))
+    return glm.GenerateContentResponse(candidates=[glm.Candidate(content=glm.Content(role="model", parts=[part]))])
+
+def test_cached_capture_keeps_list_args():
+    contents = [{"role": "user", "parts": ["set up a launch sync with a and b"]}]
+    calls = GeminiFunctionAgent._function_calls(gemini_response("capture_meeting_details", {
+        "date": "2025-01-16", "topic": "launch sync", "attendees": ["a@example.com", "b@example.com"],
+    }))
+    cache_function_calls(contents, calls)
+
+    cached = cached_function_calls(contents)
+    assert cached == calls
+    assert context_from_call(cached[0])["attendees"] == ["a@example.com", "b@example.com"]
+
+def test_write_calls_are_not_cached():
+    contents = [{"role": "user", "parts": ["email a@example.com saying hi"]}]
+    calls = GeminiFunctionAgent._function_calls(gemini_response("send_email_message", {
+        "to_email": "a@example.com", "subject": "hi", "body": "hi",
+    }))
+    cache_function_calls(contents, calls)
+    assert cached_function_calls(contents) is None
@@ -0,0 +1,49 @@
+import pytest
+from langchain_core.messages import HumanMessage
+from agent_graph import intent_router, route_intent
+
+pytestmark = pytest.mark.usefixtures("fixed_now")
+
+def routed_call(state):
+    (call,) = state["messages"][-1].tool_calls
+    return call["name"], call["args"]
+
+def test_two_turn_schedule_fills_time_from_follow_up():
+    # Turn 1 has no time: the router leaves it to Gemini, which captures the other details
+    state = {"messages": [HumanMessage(content="schedule a meeting about the roadmap tomorrow")],
+             "context": {}, "user_id": "u1"}
+    assert intent_router(state)["next"] == "agent"
+
+    # Turn 2 only answers "what time?"
+    state = {"messages": state["messages"] + [HumanMessage(content="at 4pm")],
+             "context": {"date": "2025-01-16", "topic": "the roadmap", "attendees": ["a@example.com"]},
+             "user_id": "u1"}
+    routed = intent_router(state)
+    assert routed["next"] == "tool"
+    assert routed_call(routed) == ("schedule_meeting", {
+        "date": "2025-01-16", "time": "04:00 PM", "topic": "the roadmap", "attendees": ["a@example.com"],
+    })
+    assert routed["context"]["time"] == "04:00 PM"
+
+def test_new_values_win_over_previous_context():
+    prev = {"date": "2025-01-16", "time": "03:00 PM", "topic": "old topic"}
+    routed = route_intent("schedule a meeting at 5pm", prev)
+    assert routed["function_call"]["args"] == {"date": "2025-01-16", "time": "05:00 PM", "topic": "old topic"}
+
+def test_complete_request_does_not_inherit_attendees():
+    prev = {"date": "2025-01-16", "time": "03:00 PM", "topic": "old", "attendees": ["a@example.com"]}
+    routed = route_intent("schedule a sync about hiring tomorrow at 11am", prev)
+    assert routed["function_call"] == {
+        "name": "schedule_meeting",
+        "args": {"time": "11:00 AM", "date": "2025-01-16", "topic": "hiring"},
+    }
+
+def test_incomplete_request_without_context_is_escalated():
+    assert route_intent("at 4pm", {}) is None
+    assert route_intent("schedule a meeting about budgets", {}) is None
+
+def test_past_date_is_not_routed():
+    assert route_intent("schedule a review about q4 on 2025-01-10 at 4pm", {}) is None
+
+def test_attendee_lists_are_left_to_gemini():
+    assert route_intent("schedule a call with bob@example.com tomorrow at 4pm about launch", {}) is None
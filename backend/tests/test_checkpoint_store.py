@@ -0,0 +1,41 @@
+import google.ai.generativelanguage as glm
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.base import empty_checkpoint
+from agent_graph import GeminiFunctionAgent
+from checkpoint_store import SQLiteCheckpointer, thread_config
+
+def gemini_response(*calls):
+    parts = [glm.Part(function_call=glm.FunctionCall(name=name, args=args)) for name, args in calls]
+    return glm.GenerateContentResponse(candidates=[glm.Candidate(content=glm.Content(role="model", parts=parts))])
+
+def test_function_call_args_are_plain_python():
+    response = gemini_response(("schedule_meeting", {
+        "date": "2025-01-16", "time": "04:00 PM", "topic": "launch", "attendees": ["a@example.com", "b@example.com"],
+    }))
+    (call,) = GeminiFunctionAgent._function_calls(response)
+    assert call.args["attendees"] == ["a@example.com", "b@example.com"]
+    assert type(call.args["attendees"]) is list
+
+def test_checkpoint_round_trips_nested_call_args(tmp_path):
+    response = gemini_response(
+        ("schedule_meeting", {"date": "2025-01-16", "time": "04:00 PM", "topic": "launch",
+                              "attendees": ["a@example.com"]}),
+        ("create_events_bulk", {"events": [
+            {"date": "2025-01-17", "time": "10:00 AM", "topic": "standup"},
+            {"date": "2025-01-18", "time": "10:00 AM", "topic": "standup"},
+        ]}),
+    )
+    state = {"messages": [HumanMessage(content="book them")], "context": {}, "user_id": "u1"}
+    routed = GeminiFunctionAgent._route_function_calls(state, GeminiFunctionAgent._function_calls(response))
+
+    checkpointer = SQLiteCheckpointer(str(tmp_path / "checkpoints.sqlite3"))
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"messages": routed["messages"]}
+    config = thread_config("u1", "s1")
+    checkpointer.put({"configurable": {**config["configurable"], "checkpoint_ns": ""}}, checkpoint, {}, {})
+
+    saved = checkpointer.get_tuple(config)
+    tool_calls = saved.checkpoint["channel_values"]["messages"][-1].tool_calls
+    assert tool_calls[0]["args"]["attendees"] == ["a@example.com"]
+    assert [e["topic"] for e in tool_calls[1]["args"]["events"]] == ["standup", "standup"]
+    checkpointer.close()
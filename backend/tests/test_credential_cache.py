@@ -0,0 +1,84 @@
+import asyncio
+import datetime
+import threading
+import time
+import pytest
+from google.oauth2.credentials import Credentials
+from credential_cache import CredentialCache
+
+def fresh_credentials():
+    expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(hours=1)
+    return Credentials(token="token", expiry=expiry)
+
+def test_sync_and_async_callers_share_one_refresh():
+    cache, loads = CredentialCache(), []
+
+    def load(user_id):
+        loads.append("sync")
+        time.sleep(0.2)
+        return fresh_credentials()
+
+    async def aload(user_id):
+        loads.append("async")
+        return fresh_credentials()
+
+    async def main():
+        results = {}
+        thread = threading.Thread(target=lambda: results.setdefault("sync", cache.get_or_load("u1", load)))
+        thread.start()
+        await asyncio.sleep(0.05)
+        results["async"] = await cache.aget_or_load("u1", aload)
+        thread.join()
+        return results
+
+    results = asyncio.run(main())
+    assert loads == ["sync"]
+    assert results["async"] is results["sync"]
+
+def test_async_refresh_is_shared_with_a_sync_caller():
+    cache, loads = CredentialCache(), []
+
+    async def aload(user_id):
+        loads.append("async")
+        await asyncio.sleep(0.2)
+        return fresh_credentials()
+
+    def load(user_id):
+        loads.append("sync")
+        return fresh_credentials()
+
+    async def main():
+        owner = asyncio.ensure_future(cache.aget_or_load("u1", aload))
+        await asyncio.sleep(0.05)
+        waiter = await asyncio.get_running_loop().run_in_executor(None, cache.get_or_load, "u1", load)
+        return await owner, waiter
+
+    owner, waiter = asyncio.run(main())
+    assert loads == ["async"]
+    assert owner is waiter
+
+def test_cancelled_caller_does_not_cancel_the_refresh():
+    cache = CredentialCache()
+
+    async def aload(user_id):
+        await asyncio.sleep(0.1)
+        return fresh_credentials()
+
+    async def main():
+        first = asyncio.ensure_future(cache.aget_or_load("u1", aload))
+        second = asyncio.ensure_future(cache.aget_or_load("u1", aload))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) is cache.get("u1")
+
+def test_failed_load_is_not_cached():
+    cache = CredentialCache()
+
+    def failing(user_id):
+        raise RuntimeError("refresh failed")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_load("u1", failing)
+    assert cache.get_or_load("u1", lambda user_id: fresh_credentials()) is not None
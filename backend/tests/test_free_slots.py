@@ -0,0 +1,52 @@
+import datetime
+import pytest
+import pytz
+import temporal
+from google_calendar import free_slots, merge_intervals
+
+TZ = pytz.timezone("Asia/Kolkata")
+HOUR = datetime.timedelta(hours=1)
+
+@pytest.fixture(autouse=True)
+def kolkata():
+    temporal._timezone.set("Asia/Kolkata")
+
+def at(day, hour, minute=0, second=0):
+    return TZ.localize(datetime.datetime(2025, 1, day, hour, minute, second))
+
+def test_merge_intervals_joins_overlapping_and_touching():
+    intervals = [(5, 6), (1, 3), (2, 4), (4, 5), (8, 9)]
+    assert merge_intervals(intervals) == [(1, 6), (8, 9)]
+
+def test_merge_intervals_keeps_contained_end():
+    assert merge_intervals([(1, 10), (2, 3)]) == [(1, 10)]
+    assert merge_intervals([]) == []
+
+def test_free_slots_skips_busy_time():
+    # Wednesday; busy 09:00-10:30 and 11:00-12:00
+    busy = [(at(15, 9), at(15, 10, 30)), (at(15, 11), at(15, 12))]
+    slots = free_slots(busy, at(15, 0), at(15, 23), HOUR, count=3)
+    assert slots == [(at(15, 12), at(15, 13)), (at(15, 13), at(15, 14)), (at(15, 14), at(15, 15))]
+
+def test_free_slots_stays_inside_working_hours():
+    slots = free_slots([], at(15, 16, 30), at(16, 23), HOUR, working_hours="09:00-18:00", count=3)
+    assert slots == [(at(15, 16, 30), at(15, 17, 30)), (at(16, 9), at(16, 10)), (at(16, 10), at(16, 11))]
+
+def test_free_slots_skips_weekends():
+    # Friday 17:30 onwards: the next free hour is Monday morning
+    slots = free_slots([], at(17, 17, 30), at(20, 23), HOUR, count=1)
+    assert slots == [(at(20, 9), at(20, 10))]
+    slots = free_slots([], at(17, 17, 30), at(20, 23), HOUR, count=1, include_weekends=True)
+    assert slots == [(at(18, 9), at(18, 10))]
+
+@pytest.mark.parametrize("start, expected", [
+    (at(15, 10, 0, 0), at(15, 10, 0)),
+    (at(15, 10, 0, 30), at(15, 10, 15)),
+    (at(15, 10, 14, 59), at(15, 10, 15)),
+    (at(15, 10, 15, 1), at(15, 10, 30)),
+    (at(15, 10, 52), at(15, 11, 0)),
+])
+def test_free_slots_rounds_start_up_to_quarter_hour(start, expected):
+    (slot_start, _), = free_slots([], start, at(15, 23), HOUR, count=1)
+    assert slot_start == expected
+    assert slot_start >= start
@@ -0,0 +1,66 @@
+import asyncio
+import contextvars
+import pytest
+from job_queue import JobQueue, MemoryJobStore, SQLiteJobStore, begin_turn
+from tool_registry import ToolSpec, registry
+
+sent = []
+
+def _send(user_id, to):
+    sent.append(to)
+    return {"status": "success", "to": to}
+
+async def _asend(user_id, to):
+    return _send(user_id, to)
+
+registry.register(ToolSpec(
+    {"name": "test_send", "description": "test write", "parameters": {"type": "object", "properties": {}}},
+    _send, _asend, lambda args, result: f"sent to {args['to']}",
+))
+
+@pytest.fixture(params=["memory", "sqlite"])
+def queue(request, tmp_path):
+    sent.clear()
+    store = MemoryJobStore() if request.param == "memory" else SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    return JobQueue(store, workers=0)
+
+def turn(queue, idempotency_key, to="a@example.com"):
+    """One /chat attempt: a fresh context, as each request gets."""
+    def attempt():
+        begin_turn(idempotency_key)
+        return queue.run_inline("u1", "test_send", {"to": to}, queue.call_key("u1", "test_send"))
+    return contextvars.Context().run(attempt)
+
+def test_retried_turn_does_not_repeat_inline_write(queue):
+    first = turn(queue, "k1")
+    retry = turn(queue, "k1")
+    assert sent == ["a@example.com"]
+    assert retry == first
+
+def test_new_key_runs_again(queue):
+    turn(queue, "k1")
+    turn(queue, "k2")
+    turn(queue, None)
+    assert sent == ["a@example.com"] * 3
+
+def test_async_retry_does_not_repeat_inline_write(queue):
+    async def attempt():
+        begin_turn("k1")
+        return await queue.arun_inline("u1", "test_send", {"to": "a@example.com"}, queue.call_key("u1", "test_send"))
+
+    first = asyncio.run(attempt())
+    retry = asyncio.run(attempt())
+    assert sent == ["a@example.com"]
+    assert retry == first
+
+def test_sqlite_job_keeps_list_args(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    args = {"topic": "launch", "attendees": ["a@example.com", "b@example.com"]}
+    queued = JobQueue(store, workers=0).enqueue("u1", "test_send", args)
+    assert store.claim()["args"] == args
+    assert store.get(queued["job_id"])["args"]["attendees"] == ["a@example.com", "b@example.com"]
+
+def test_sqlite_job_rejects_args_json_cannot_hold(tmp_path):
+    store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    with pytest.raises(TypeError):
+        JobQueue(store, workers=0).enqueue("u1", "test_send", {"attendees": {"a@example.com"}})
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+import pytest
+import rate_limiter
+from rate_limiter import RateLimited, TokenBucket, Upstream
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+def test_bucket_refills_at_rate_up_to_burst(clock):
+    bucket = TokenBucket(rate=2, burst=4)
+    bucket.tokens = 0
+    assert bucket.available(clock.now + 1) == 2
+    assert bucket.available(clock.now + 10) == 4
+    assert bucket.delay(clock.now + 10, n=5) == pytest.approx(0.5)
+
+def test_admit_rejects_user_past_burst(clock):
+    upstream = Upstream("chat", rate=50, burst=100, user_rate=1, user_burst=2)
+    upstream.admit("u1")
+    upstream.admit("u1")
+    with pytest.raises(RateLimited) as raised:
+        upstream.admit("u1")
+    assert raised.value.status_code == 429
+    assert raised.value.retry_after == 1
+    # Other users have their own bucket
+    upstream.admit("u2")
+
+def test_admit_allows_again_after_refill(clock):
+    upstream = Upstream("chat", rate=50, burst=100, user_rate=1, user_burst=1)
+    upstream.admit("u1")
+    with pytest.raises(RateLimited):
+        upstream.admit("u1")
+    clock.now += 1
+    upstream.admit("u1")
+    assert upstream.stats["immediate"] == 2
+    assert upstream.stats["rejected"] == 1
+
+def test_global_bucket_limits_all_users(clock):
+    upstream = Upstream("gemini", rate=1, burst=2, user_rate=10, user_burst=10)
+    upstream.admit("u1")
+    upstream.admit("u2")
+    with pytest.raises(RateLimited):
+        upstream.admit("u3")
+
+def test_acquire_rejects_when_wait_exceeds_limit(clock):
+    upstream = Upstream("gmail", rate=0.1, burst=1, user_rate=10, user_burst=10, max_wait=3)
+    upstream.acquire("u1")
+    # The next token is 10s away, beyond max_wait: rejected without queueing
+    with pytest.raises(RateLimited) as raised:
+        upstream.acquire("u2")
+    assert raised.value.retry_after == 10
+    assert upstream.stats["queued"] == 0
+
+def test_penalize_holds_back_callers(clock):
+    upstream = Upstream("calendar", rate=1, burst=5, user_rate=10, user_burst=10)
+    upstream.penalize(4)
+    with pytest.raises(RateLimited) as raised:
+        upstream.admit("u1")
+    assert raised.value.retry_after == 5
+    clock.now += 5
+    upstream.admit("u1")
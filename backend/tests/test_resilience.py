@@ -0,0 +1,48 @@
+import threading
+import time
+import pytest
+import resilience
+
+@pytest.fixture
+def key(monkeypatch, request):
+    monkeypatch.setattr(resilience, "HEDGE_ENABLED", True)
+    key = f"test.{request.node.name}"
+    # p95 of 10ms: hedges after HEDGE_MIN_DELAY (50ms)
+    resilience._window(key).samples.extend([0.01] * resilience.HEDGE_MIN_SAMPLES)
+    return key
+
+def test_primary_runs_on_the_callers_thread(key):
+    calls = []
+
+    def attempt(primary):
+        calls.append((primary, threading.get_ident()))
+        return "ok"
+
+    assert resilience.hedged(key, attempt) == "ok"
+    assert calls == [(True, threading.get_ident())]
+
+def test_fast_primary_starts_no_backup(key):
+    started = []
+    resilience.hedged(key, lambda primary: started.append(primary))
+    time.sleep(0.1)
+    assert started == [True]
+    assert resilience.latency_windows[key].hedges == 0
+
+def test_failed_slow_primary_returns_the_backups_result(key):
+    def attempt(primary):
+        if primary:
+            time.sleep(0.15)
+            raise ConnectionError("slow and failed")
+        return "backup"
+
+    assert resilience.hedged(key, attempt) == "backup"
+    assert resilience.latency_windows[key].hedges == 1
+
+def test_primary_failing_before_the_delay_raises(key):
+    def attempt(primary):
+        raise ConnectionError("fast failure")
+
+    with pytest.raises(ConnectionError):
+        resilience.hedged(key, attempt)
+    time.sleep(0.1)
+    assert resilience.latency_windows[key].hedges == 0
@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+import session_store
+from kv_store import MemoryBackend
+from session_store import HISTORY_TOKEN_BUDGET, SessionStore, estimate_tokens
+
+@pytest.fixture
+def store(monkeypatch):
+    prompts = []
+
+    async def summarize(model, prompt, operation=None):
+        prompts.append(prompt)
+        return f"summary {len(prompts)}"
+
+    monkeypatch.setattr(session_store, "agenerate_text", summarize)
+    store = SessionStore(MemoryBackend(100))
+    store.prompts = prompts
+    return store
+
+def record(store, session, n, size=40):
+    due = False
+    for i in range(n):
+        due = store.record_turn("u1", "s1", session, f"question {i} " + "x" * size, f"answer {i} " + "y" * size, {})
+    return due
+
+def test_long_turns_are_summarized_before_they_fall_out_of_the_window(store):
+    session = store.load("u1", "s1")
+    # Four turns of ~500 tokens each: well under SESSION_MAX_MESSAGES, but over the budget
+    assert record(store, session, 4, size=1000)
+    asyncio.run(store.compact("u1", "s1"))
+
+    compacted = store.load("u1", "s1")
+    assert compacted["summary"] == "summary 1"
+    assert "question 0" in store.prompts[0]
+    assert sum(estimate_tokens(m["content"]) for m in compacted["history"]) <= HISTORY_TOKEN_BUDGET // 2
+    assert compacted["history"][0]["role"] == "user"
+
+def test_short_sessions_are_left_alone(store):
+    session = store.load("u1", "s1")
+    assert not record(store, session, 3)
+    asyncio.run(store.compact("u1", "s1"))
+    assert store.prompts == []
+    assert len(store.load("u1", "s1")["history"]) == 6
+
+def test_turn_recorded_during_compaction_is_kept(store, monkeypatch):
+    session = store.load("u1", "s1")
+    record(store, session, 11)
+
+    async def summarize(model, prompt, operation=None):
+        # Another turn lands while the summary is generated
+        store.record_turn("u1", "s1", store.load("u1", "s1"), "late question", "late answer", {})
+        return "summary"
+
+    monkeypatch.setattr(session_store, "agenerate_text", summarize)
+    asyncio.run(store.compact("u1", "s1"))
+    history = store.load("u1", "s1")["history"]
+    assert history[-2:] == [{"role": "user", "content": "late question"}, {"role": "model", "content": "late answer"}]
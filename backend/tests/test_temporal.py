@@ -0,0 +1,71 @@
+import datetime
+import pytest
+from temporal import normalize_date, normalize_time, preprocess_user_text, resolve
+
+pytestmark = pytest.mark.usefixtures("fixed_now")
+
+@pytest.mark.parametrize("text, expected", [
+    ("today", datetime.date(2025, 1, 15)),
+    ("tomorrow", datetime.date(2025, 1, 16)),
+    ("day after tomorrow", datetime.date(2025, 1, 17)),
+    ("friday", datetime.date(2025, 1, 17)),
+    ("this wednesday", datetime.date(2025, 1, 15)),
+    ("next friday", datetime.date(2025, 1, 17)),
+    ("next wednesday", datetime.date(2025, 1, 22)),
+    ("next week", datetime.date(2025, 1, 20)),
+    ("in 3 days", datetime.date(2025, 1, 18)),
+    ("2025-02-03", datetime.date(2025, 2, 3)),
+    ("march 5", datetime.date(2025, 3, 5)),
+    ("5th of march", datetime.date(2025, 3, 5)),
+    # A month and day already past this year mean next year's
+    ("jan 2", datetime.date(2026, 1, 2)),
+    ("end of next week", datetime.date(2025, 1, 24)),
+])
+def test_resolve_date(text, expected, fixed_now):
+    assert resolve(text, fixed_now)[0] == expected
+
+@pytest.mark.parametrize("text, expected", [
+    ("4pm", datetime.time(16)),
+    ("12am", datetime.time(0)),
+    ("9:15 am", datetime.time(9, 15)),
+    ("14:45", datetime.time(14, 45)),
+    ("noon", datetime.time(12)),
+    ("tonight", datetime.time(20)),
+    ("eod", datetime.time(18)),
+])
+def test_resolve_time(text, expected, fixed_now):
+    assert resolve(text, fixed_now)[1] == expected
+
+def test_resolve_offset_crosses_midnight(fixed_now):
+    late = fixed_now.replace(hour=23, minute=30)
+    assert resolve("in 2 hours", late) == (datetime.date(2025, 1, 16), datetime.time(1, 30))
+
+def test_resolve_date_and_time_together(fixed_now):
+    assert resolve("tomorrow at 4pm", fixed_now) == (datetime.date(2025, 1, 16), datetime.time(16))
+
+def test_resolve_empty(fixed_now):
+    assert resolve(None, fixed_now) == (None, None)
+    assert resolve("   ", fixed_now) == (None, None)
+
+def test_normalize_date():
+    assert normalize_date("tomorrow") == "2025-01-16"
+    assert normalize_date("Next Monday") == "2025-01-20"
+    assert normalize_date(None) is None
+    assert normalize_date("") is None
+
+def test_normalize_time():
+    assert normalize_time("4pm") == "04:00 PM"
+    assert normalize_time("9:05am") == "09:05 AM"
+    assert normalize_time("18:30") == "06:30 PM"
+    assert normalize_time(None) is None
+
+def test_normalize_unreadable_is_unchanged():
+    assert normalize_time("whenever works") == "whenever works"
+
+def test_preprocess_user_text(fixed_now):
+    text = "Book a sync tomorrow at 4pm and a review next friday"
+    assert preprocess_user_text(text, fixed_now) == "Book a sync 2025-01-16 at 4pm and a review 2025-01-17"
+
+def test_preprocess_user_text_leaves_other_text(fixed_now):
+    text = "Email bob@example.com about the launch"
+    assert preprocess_user_text(text, fixed_now) == text
@@ -0,0 +1,333 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from typing import Callable, Optional
+import settings
+from concurrency import submit_blocking
+from kv_store import MemoryBackend
+from metrics import LATENCY_BUCKETS, add_timing
+from rate_limiter import UpstreamUnavailable
+
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "30"))
+TOOL_MAX_CONCURRENCY = int(os.getenv("TOOL_MAX_CONCURRENCY", "32"))
+TOOL_MAX_PER_USER = int(os.getenv("TOOL_MAX_PER_USER", "2"))
+TOOL_RESULT_CACHE_SIZE = int(os.getenv("TOOL_RESULT_CACHE_SIZE", "1024"))
+
+class ToolSpec:
+    """One tool the agent can call.
+
+    declaration: Gemini function declaration (name, description, parameters).
+    func / afunc: sync and async implementations, called with the model's args plus user_id.
+    reply: formats (args, result) as the user-facing message.
+    timeout: seconds before the call is reported as failed (or, for writes, as possibly still
+    completing); a call that overruns keeps its concurrency slot until it actually returns.
+    max_concurrency / max_per_user: in-flight calls allowed overall / for one user.
+    cache_ttl: seconds to reuse a result for identical args; only for idempotent tools.
+    Successful calls to non-idempotent tools drop the user's cached results.
+    deferrable: slow enough to run as a background job when JOBS_ENABLED is set.
+    """
+
+    def __init__(self, declaration: dict, func: Callable, afunc: Callable, reply: Callable,
+                 timeout: float = TOOL_TIMEOUT, max_concurrency: int = TOOL_MAX_CONCURRENCY,
+                 max_per_user: int = TOOL_MAX_PER_USER, idempotent: bool = False, cache_ttl: float = 0,
+                 deferrable: bool = False):
+        self.declaration = declaration
+        self.name = declaration["name"]
+        self.func = func
+        self.afunc = afunc
+        self.reply = reply
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.idempotent = idempotent
+        self.cache_ttl = cache_ttl if idempotent else 0
+        self.deferrable = deferrable
+
+class _Slots:
+    """Global and per-user in-flight limits for one tool, for both threads and coroutines."""
+
+    def __init__(self, spec: ToolSpec):
+        self.spec = spec
+        self._lock = threading.Lock()
+        self._thread_slots = threading.BoundedSemaphore(spec.max_concurrency)
+        self._async_slots = None
+        self._users = {}            # user_id -> [threading semaphore, asyncio semaphore, holders]
+
+    def _user(self, user_id: str):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                entry = self._users[user_id] = [threading.BoundedSemaphore(self.spec.max_per_user), None, 0]
+            entry[2] += 1
+            return entry
+
+    def _done(self, user_id: str, entry):
+        with self._lock:
+            entry[2] -= 1
+            if entry[2] == 0:
+                self._users.pop(user_id, None)
+
+    def acquire(self, user_id: str, timeout: float):
+        """Blocks for a slot; returns a release callback, or None if none freed up within timeout."""
+        deadline = time.monotonic() + timeout
+        entry = self._user(user_id)
+        if not entry[0].acquire(timeout=timeout):
+            self._done(user_id, entry)
+            return None
+        if not self._thread_slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+            entry[0].release()
+            self._done(user_id, entry)
+            return None
+
+        def release():
+            self._thread_slots.release()
+            entry[0].release()
+            self._done(user_id, entry)
+        return release
+
+    async def aenter(self, user_id: str):
+        entry = self._user(user_id)
+        with self._lock:
+            if self._async_slots is None:
+                self._async_slots = asyncio.Semaphore(self.spec.max_concurrency)
+            if entry[1] is None:
+                entry[1] = asyncio.Semaphore(self.spec.max_per_user)
+        try:
+            await entry[1].acquire()
+            try:
+                await self._async_slots.acquire()
+            except BaseException:
+                entry[1].release()
+                raise
+        except BaseException:
+            self._done(user_id, entry)
+            raise
+
+        def release():
+            self._async_slots.release()
+            entry[1].release()
+            self._done(user_id, entry)
+        return release
+
+class ToolRegistry:
+    """Single source for tool declarations and dispatch.
+
+    run / arun apply the tool's timeout and concurrency limits, serve idempotent
+    tools from the result cache, and record per-tool latency histograms and
+    outcome counts. They never raise: failures come back as error results.
+    """
+
+    def __init__(self, cache_size: int = TOOL_RESULT_CACHE_SIZE):
+        self._specs = {}
+        self._slots = {}
+        self._cache = MemoryBackend(cache_size)
+        self._generations = Counter()     # user_id -> bumped by every successful write
+        self._stats_lock = threading.Lock()
+        self._outcomes = Counter()
+        self._latency = defaultdict(lambda: [0] * len(LATENCY_BUCKETS))
+        self._latency_sum = Counter()
+
+    def register(self, spec: ToolSpec) -> ToolSpec:
+        self._specs[spec.name] = spec
+        self._slots[spec.name] = _Slots(spec)
+        return spec
+
+    def declarations(self) -> list:
+        return [spec.declaration for spec in self._specs.values()]
+
+    def get(self, name: str) -> Optional[ToolSpec]:
+        return self._specs.get(name)
+
+    def reply(self, name: str, args: dict, result: dict) -> str:
+        if result.get("status") == "queued":
+            return self._queued_reply(result)
+        if result.get("status") == "pending":
+            return result["message"]
+        spec = self._specs.get(name)
+        return spec.reply(args, result) if spec else f"Unknown command: {name}"
+
+    @staticmethod
+    def _queued_reply(result: dict) -> str:
+        if result.get("duplicate"):
+            return (f"That request is already in progress (job {result['job_id']}), "
+                    "I'll share the result when it's done.")
+        return f"On it, I'm working on that in the background (job {result['job_id']}). I'll share the result when it's done."
+
+    # ==== Result cache ====
+    def _cache_key(self, spec: ToolSpec, user_id: str, args: dict) -> str:
+        with self._stats_lock:
+            generation = self._generations[user_id]
+        raw = json.dumps([spec.name, user_id, generation, args], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _cached(self, spec: ToolSpec, user_id: str, args: dict):
+        if not spec.cache_ttl:
+            return None, None
+        key = self._cache_key(spec, user_id, args)
+        cached = self._cache.get(key)
+        return key, (json.loads(cached) if cached is not None else None)
+
+    def _finish(self, spec: ToolSpec, user_id: str, key: Optional[str], result: dict, elapsed: float, outcome: str):
+        if result.get("status") == "success":
+            if key:
+                self._cache.set(key, json.dumps(result, default=str), spec.cache_ttl)
+            elif not spec.idempotent:
+                # A write may change what the read tools would return
+                with self._stats_lock:
+                    self._generations[user_id] += 1
+        self._record(spec.name, elapsed, outcome)
+
+    # ==== Dispatch ====
+    def run(self, name: str, args: dict, user_id: str) -> dict:
+        spec = self._specs.get(name)
+        if spec is None:
+            return {"status": "error", "message": "Unknown function call."}
+        key, cached = self._cached(spec, user_id, args)
+        if cached is not None:
+            self._record(name, 0.0, "cached")
+            return cached
+
+        start = time.perf_counter()
+        release = self._slots[name].acquire(user_id, spec.timeout)
+        if release is None:
+            self._record(name, time.perf_counter() - start, "busy")
+            return self._busy_result(spec)
+        future = None
+        try:
+            future = submit_blocking(spec.func, **{**args, "user_id": user_id})
+            remaining = max(0.0, spec.timeout - (time.perf_counter() - start))
+            result, outcome = future.result(timeout=remaining), None
+        except FuturesTimeoutError:
+            result, outcome = self._timeout_result(spec), "timeout"
+        except UpstreamUnavailable as e:
+            result, outcome = e.as_result(), "unavailable"
+        except Exception as e:
+            result, outcome = self._error_result(spec, e), "error"
+        finally:
+            if future is not None and not future.done():
+                # The thread cannot be stopped; it keeps the slot until it returns
+                future.add_done_callback(self._finished_late(spec, user_id, release))
+            else:
+                release()
+        self._finish(spec, user_id, key, result, time.perf_counter() - start, outcome or result.get("status", "error"))
+        return result
+
+    async def arun(self, name: str, args: dict, user_id: str) -> dict:
+        spec = self._specs.get(name)
+        if spec is None:
+            return {"status": "error", "message": "Unknown function call."}
+        key, cached = self._cached(spec, user_id, args)
+        if cached is not None:
+            self._record(name, 0.0, "cached")
+            return cached
+
+        started = asyncio.Event()
+
+        async def call():
+            release = await self._slots[name].aenter(user_id)
+            started.set()
+            try:
+                return await spec.afunc(**{**args, "user_id": user_id})
+            finally:
+                release()
+
+        start = time.perf_counter()
+        task = asyncio.ensure_future(call())
+        try:
+            # Waiting for a slot counts against the timeout, so a backlog cannot hang the turn
+            result, outcome = await asyncio.wait_for(asyncio.shield(task), spec.timeout), None
+        except asyncio.TimeoutError:
+            if started.is_set():
+                # Cancelling would not stop the blocking call underneath and would free its slot
+                # early, so let it finish in the background holding the slot
+                task.add_done_callback(self._finished_late(spec, user_id))
+                result, outcome = self._timeout_result(spec), "timeout"
+            else:
+                task.cancel()
+                result, outcome = self._busy_result(spec), "busy"
+        except asyncio.CancelledError:
+            if not started.is_set():
+                task.cancel()
+            raise
+        except UpstreamUnavailable as e:
+            result, outcome = e.as_result(), "unavailable"
+        except Exception as e:
+            result, outcome = self._error_result(spec, e), "error"
+        self._finish(spec, user_id, key, result, time.perf_counter() - start, outcome or result.get("status", "error"))
+        return result
+
+    @staticmethod
+    def _busy_result(spec: ToolSpec) -> dict:
+        return {"status": "error", "message": f"Too many {spec.name} calls in progress, try again shortly."}
+
+    @staticmethod
+    def _timeout_result(spec: ToolSpec) -> dict:
+        print(f"Tool {spec.name} timed out after {spec.timeout:g}s")
+        if not spec.idempotent:
+            # A write that overran may still go through; a retry could send or book it twice
+            return {"status": "pending", "message": (
+                f"This is taking longer than {spec.timeout:g}s and may still complete. "
+                "Please check before trying again."
+            )}
+        return {"status": "error", "message": f"Timed out after {spec.timeout:g}s."}
+
+    def _finished_late(self, spec: ToolSpec, user_id: str, release: Optional[Callable] = None) -> Callable:
+        """Done-callback for a call that outlived its timeout: frees its slot and logs the outcome."""
+        def done(future):
+            if release:
+                release()
+            if future.cancelled():
+                return
+            error = future.exception()
+            result = {"status": "error"} if error else future.result()
+            print(f"Tool {spec.name} finished after its timeout: {error!r}" if error
+                  else f"Tool {spec.name} finished after its timeout: {result.get('status')}")
+            if result.get("status") == "success" and not spec.idempotent:
+                with self._stats_lock:
+                    self._generations[user_id] += 1
+        return done
+
+    @staticmethod
+    def _error_result(spec: ToolSpec, e: Exception) -> dict:
+        print(f"Tool {spec.name} failed: {e!r}")
+        return {"status": "error", "message": str(e) or type(e).__name__}
+
+    # ==== Stats ====
+    def _record(self, name: str, elapsed: float, outcome: str):
+        add_timing(f"tool.{name}", elapsed)
+        with self._stats_lock:
+            self._outcomes[f"{name}:{outcome}"] += 1
+            if outcome == "cached":
+                return
+            buckets = self._latency[name]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if elapsed <= bound:
+                    buckets[i] += 1
+                    break
+            self._latency_sum[name] += elapsed
+
+    def snapshot(self) -> dict:
+        """Per tool: outcome counts and a cumulative latency histogram (le -> count)."""
+        with self._stats_lock:
+            stats = {}
+            for name in self._specs:
+                outcomes = {
+                    key.split(":", 1)[1]: count for key, count in self._outcomes.items()
+                    if key.split(":", 1)[0] == name
+                }
+                cumulative, histogram = 0, {}
+                for bound, count in zip(LATENCY_BUCKETS, self._latency[name]):
+                    cumulative += count
+                    histogram["+Inf" if bound == float("inf") else f"{bound:g}"] = cumulative
+                stats[name] = {
+                    "outcomes": outcomes,
+                    "latency_seconds": {"buckets": histogram, "count": cumulative, "sum": round(self._latency_sum[name], 6)},
+                }
+            return stats
+
+registry = ToolRegistry()
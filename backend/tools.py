@@ -0,0 +1,217 @@
+from google_calendar import (
+    create_event, acreate_event, find_free_slots, afind_free_slots, create_events_bulk, acreate_events_bulk,
+    list_events, alist_events,
+)
+from gmail_tools import (
+    send_email_message, summarize_last_email, summarize_recent_emails,
+    asend_email_message, asummarize_last_email, asummarize_recent_emails,
+)
+from tool_registry import ToolSpec, registry
+
+# Each tool is declared once here: its Gemini schema, implementations, user-facing
+# reply and limits. The agent model's declarations and the tool node's dispatch are
+# both generated from the registry.
+
+# ==== Function Declarations ====
+schedule_meeting_function = {
+    "name": "schedule_meeting",
+    "description": "Schedules a meeting at a given time and date. Only use this for scheduling.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "date": {"type": "string"},
+            "time": {"type": "string"},
+            "topic": {"type": "string"},
+            "attendees": {"type": "array", "items": {"type": "string"}, "description": "Email addresses to invite."},
+            "flexible": {"type": "boolean", "description": "If the time is busy for anyone, book the first common free slot instead."},
+        },
+        "required": ["date", "time", "topic"]
+    }
+}
+
+# Email sending function declaration
+send_email_function = {
+    "name": "send_email_message",
+    "description": "Sends an email to a recipient with a subject and body.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "to_email": {"type": "string", "description": "The recipient's full email address."},
+            "subject": {"type": "string", "description": "The subject line of the email."},
+            "body": {"type": "string", "description": "The content of the email message."}
+        },
+        "required": ["to_email", "subject", "body"]
+    }
+}
+
+# Email summarization function declaration
+summarize_email_function = {
+    "name": "summarize_last_email",
+    "description": "Fetches and summarizes the content of the last received email in the user's inbox.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "full_body": {"type": "boolean", "description": "Summarize the full email body instead of the preview snippet. Only when the user asks for detail."}
+        },
+        "required": []
+    }
+}
+
+# Free slot search function declaration
+find_free_slots_function = {
+    "name": "find_free_slots",
+    "description": "Finds the earliest free time slots in the user's calendar, e.g. 'when am I free this week for an hour?'.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "duration_minutes": {"type": "integer", "description": "Length of the slot in minutes (default 60)."},
+            "start_date": {"type": "string", "description": "First day to search, YYYY-MM-DD (default today)."},
+            "days": {"type": "integer", "description": "How many days to search from start_date (default 7)."},
+            "working_hours": {"type": "string", "description": "Daily search window as HH:MM-HH:MM (default 09:00-18:00)."},
+            "count": {"type": "integer", "description": "How many slots to return (default 3)."}
+        },
+        "required": []
+    }
+}
+
+# Bulk event creation function declaration
+create_events_bulk_function = {
+    "name": "create_events_bulk",
+    "description": "Creates several calendar events at once, e.g. 'set up 1:1s with these 8 people next week'.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "events": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "date": {"type": "string"},
+                        "time": {"type": "string"},
+                        "topic": {"type": "string"},
+                        "duration_minutes": {"type": "integer", "description": "Length in minutes (default 60)."},
+                        "attendees": {"type": "array", "items": {"type": "string"}, "description": "Email addresses to invite."}
+                    },
+                    "required": ["date", "time", "topic"]
+                }
+            }
+        },
+        "required": ["events"]
+    }
+}
+
+# Multi-email digest function declaration
+summarize_recent_emails_function = {
+    "name": "summarize_recent_emails",
+    "description": "Summarizes several recent emails in one digest, e.g. 'what came in this morning?'.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "n": {"type": "integer", "description": "How many of the newest emails to include (default 5)."},
+            "label": {"type": "string", "description": "Gmail label ID to read from, e.g. INBOX (default)."},
+            "query": {"type": "string", "description": "Optional Gmail search query, e.g. 'newer_than:1d' or 'from:bob@x.com'."}
+        },
+        "required": []
+    }
+}
+
+# Event listing function declaration
+list_events_function = {
+    "name": "list_events",
+    "description": "Lists the events in the user's calendar, e.g. 'what's on my calendar tomorrow?'.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "time_min": {"type": "string", "description": "Start of the range, a date or ISO timestamp (default today)."},
+            "time_max": {"type": "string", "description": "End of the range, exclusive (default 7 days after time_min)."},
+            "max_results": {"type": "integer", "description": "How many events to return (default 50)."}
+        },
+        "required": []
+    }
+}
+
+# ==== Replies ====
+def schedule_meeting_reply(args: dict, result: dict) -> str:
+    if result.get('status') == 'success':
+        reply = f"Meeting scheduled: {result.get('eventLink', 'See result for details')}"
+        if result.get('attendees'):
+            reply += f" Invited: {', '.join(result['attendees'])}."
+        if result.get('note'):
+            reply += f" {result['note']}"
+        return reply
+    return f"Failed to schedule: {result.get('message', 'Unknown error')}"
+
+def send_email_reply(args: dict, result: dict) -> str:
+    if result.get('status') == 'success':
+        return f"Email sent successfully to {args.get('to_email')}. Status: {result.get('status')}."
+    return f"Failed to send email: {result.get('message', 'Unknown error')}"
+
+def summarize_email_reply(args: dict, result: dict) -> str:
+    if result.get('status') == 'success':
+        return f"Last email summary: **{result['summary']}**"
+    return f"Failed to summarize email: {result.get('message', 'Unknown error')}"
+
+def summarize_recent_emails_reply(args: dict, result: dict) -> str:
+    if result.get('status') == 'success':
+        return f"Digest of your last {result['count']} emails:\n{result['digest']}"
+    return f"Failed to summarize emails: {result.get('message', 'Unknown error')}"
+
+def find_free_slots_reply(args: dict, result: dict) -> str:
+    if result.get('status') == 'success':
+        return "You're free at:\n" + "\n".join(f"- {slot['label']}" for slot in result['slots'])
+    return f"Failed to find free slots: {result.get('message', 'Unknown error')}"
+
+def list_events_reply(args: dict, result: dict) -> str:
+    if result.get('status') != 'success':
+        return f"Failed to list events: {result.get('message', 'Unknown error')}"
+    if not result['items']:
+        return "No events in that range."
+    lines = []
+    for event in result['items']:
+        start = event['start'].get('dateTime') or event['start'].get('date')
+        lines.append(f"- {start}: {event.get('summary') or 'Untitled event'}")
+    if result.get('nextPageToken'):
+        lines.append("(more events not shown)")
+    return "Your events:\n" + "\n".join(lines)
+
+def create_events_bulk_reply(args: dict, result: dict) -> str:
+    if not result.get('results'):
+        return f"Failed to create events: {result.get('message', 'Unknown error')}"
+    lines = [
+        f"- {item.get('topic')}: {item['eventLink']}" if item['status'] == 'success'
+        else f"- {item.get('topic')}: failed ({item.get('message')})"
+        for item in result['results']
+    ]
+    return result['message'] + "\n" + "\n".join(lines)
+
+# ==== Registry ====
+# Writes (scheduling, sending) are never cached and get one call per user at a time;
+# reads are idempotent and reuse a result for identical args for a short while.
+registry.register(ToolSpec(
+    schedule_meeting_function, create_event, acreate_event, schedule_meeting_reply,
+    max_per_user=1, deferrable=True,
+))
+registry.register(ToolSpec(
+    send_email_function, send_email_message, asend_email_message, send_email_reply,
+    max_per_user=1, deferrable=True,
+))
+registry.register(ToolSpec(
+    summarize_email_function, summarize_last_email, asummarize_last_email, summarize_email_reply,
+    idempotent=True, cache_ttl=30, deferrable=True,
+))
+registry.register(ToolSpec(
+    summarize_recent_emails_function, summarize_recent_emails, asummarize_recent_emails, summarize_recent_emails_reply,
+    timeout=60, idempotent=True, cache_ttl=30, deferrable=True,
+))
+registry.register(ToolSpec(
+    find_free_slots_function, find_free_slots, afind_free_slots, find_free_slots_reply,
+    idempotent=True, cache_ttl=15,
+))
+registry.register(ToolSpec(
+    list_events_function, list_events, alist_events, list_events_reply,
+    idempotent=True, cache_ttl=15,
+))
+registry.register(ToolSpec(
+    create_events_bulk_function, create_events_bulk, acreate_events_bulk, create_events_bulk_reply,
+    timeout=60, max_per_user=1, deferrable=True,
+))
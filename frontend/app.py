@@ -173,6 +173,10 @@ if "chat" not in st.session_state:
 if "context" not in st.session_state:
     st.session_state.context = {}
 
+# Server-side session holding this conversation's history; assigned by the first reply
+if "session_id" not in st.session_state:
+    st.session_state.session_id = None
+
 def format_response(reply):
     if isinstance(reply, dict) and reply.get("status") == "success":
         event_link = reply.get('eventLink', '')
@@ -215,7 +219,8 @@ if user_input:
     with st.spinner("🤔 Let me help you with that..."):
         res = requests.post("http://localhost:8000/chat", json={
         "message": user_input,
-        "context": st.session_state.context
+        "context": st.session_state.context,
+        "session_id": st.session_state.session_id
     })
 
         try:
@@ -223,6 +228,7 @@ if user_input:
             raw_reply = data.get("reply", "Something went wrong.")
             print(raw_reply)  # Debugging line to see raw reply
             st.session_state.context = data.get("context", {})
+            st.session_state.session_id = data.get("session_id") or st.session_state.session_id
             # Try to parse reply as dict if it looks like one
             if isinstance(raw_reply, str) and raw_reply.strip().startswith("{"):
                 try:
@@ -248,6 +254,8 @@ if st.session_state.chat:
     with col2:
         if st.button("🗑️ Clear Chat", type="secondary", use_container_width=True):
             st.session_state.chat = []
+            st.session_state.context = {}
+            st.session_state.session_id = None
             st.rerun()
 
 # Footer with additional info
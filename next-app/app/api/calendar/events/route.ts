@@ -20,8 +20,8 @@ async function authenticateUser(req: NextRequest) {
 }
 
 /**
- * Handles GET requests to fetch data from the backend.
- * Route: /api/calendar/events (Proxies to /chat POST request)
+ * Handles GET requests to list calendar events.
+ * Route: /api/calendar/events (Proxies to the backend's GET /calendar/events; no model calls)
  */
 export async function GET(req: NextRequest) {
   const auth = await authenticateUser(req);
@@ -30,37 +30,29 @@ export async function GET(req: NextRequest) {
   }
   const { user_id } = auth;
 
+  // Range and paging options are passed through as-is: time_min, time_max, page_token, max_results, timezone
+  const params = new URLSearchParams(req.nextUrl.searchParams);
+  params.set("user_id", user_id as string);
+
   try {
-    // Forward the request to the FastAPI backend, passing the user_id and an empty message,
-    // which is required by the backend's chat structure (HumanMessage content).
-    const response = await fetch(`${BACKEND_URL}/chat`, {
-      method: "POST", // We use POST to securely pass the user_id in the body
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ user_id: user_id, message: "fetch calendar events" }), // <-- FIX: Added empty message
-    });
+    const headers: Record<string, string> = {};
+    const ifNoneMatch = req.headers.get("if-none-match");
+    if (ifNoneMatch) headers["If-None-Match"] = ifNoneMatch;
 
-    const data = await response.json();
+    const response = await fetch(`${BACKEND_URL}/calendar/events?${params}`, { headers, cache: "no-store" });
+    const etag = response.headers.get("etag");
+    const passThrough: Record<string, string> = { "Cache-Control": "private, no-cache" };
+    if (etag) passThrough["ETag"] = etag;
 
-    if (!response.ok) {
-      // Forward the error status from the backend (e.g., 401 if token is missing)
-      return NextResponse.json({ error: data.message || "Backend API error" }, { status: response.status });
+    if (response.status === 304) {
+      return new NextResponse(null, { status: 304, headers: passThrough });
     }
 
-    // Application-level error check: If the chat response contains a known failure message
-    // (like from a failed tool use for calendar actions or email summary), return a 400 error status.
-    const replyMessage = data.reply || "";
-    if (
-      replyMessage.startsWith("Failed to schedule:") ||
-      replyMessage.startsWith("Failed to summarize email:") || // <-- Added check for email summarization failure
-      replyMessage.includes("Authorization error:")
-    ) {
-        console.error("Application-level transactional error detected in chat reply:", replyMessage);
-        // Returning 400 Bad Request to signal a transactional failure to the client.
-        return NextResponse.json({ error: replyMessage }, { status: 400 });
+    const data = await response.json();
+    if (!response.ok) {
+      return NextResponse.json({ error: data.message || "Backend API error" }, { status: response.status });
     }
-
-    // Forward the successful response data
-    return NextResponse.json(data);
+    return NextResponse.json(data, { headers: passThrough });
   } catch (err: any) {
     // Explicitly note the failure to connect to the backend URL
     console.error("Proxy error during GET /calendar/events:", err.message);
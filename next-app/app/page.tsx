@@ -313,6 +313,26 @@ export default function AstraApp() {
     const [inputMessage, setInputMessage] = useState("");
     const [isLoading, setIsLoading] = useState(false);
     const [context, setContext] = useState({}); // State for conversational context
+    // Server-side session holding this conversation's history; assigned by the first reply
+    const [sessionId, setSessionId] = useState<string | null>(null);
+
+    // Polls a background job until it finishes, then shows its reply
+    const pollJob = async (jobId: string, userId: string) => {
+      for (let attempt = 0; attempt < 60; attempt++) {
+        await new Promise((resolve) => setTimeout(resolve, 2000));
+        try {
+          const res = await fetch(`http://localhost:8000/jobs/${jobId}?user_id=${encodeURIComponent(userId)}`);
+          if (!res.ok) return;
+          const job = await res.json();
+          if (["succeeded", "failed", "interrupted"].includes(job.status)) {
+            setChatMessages((prev) => [...prev, { role: "assistant", content: job.reply }]);
+            return;
+          }
+        } catch (error) {
+          console.error("Job status error:", error);
+        }
+      }
+    };
 
     const handleSendMessage = async (e: React.FormEvent) => {
       e.preventDefault();
@@ -332,19 +352,36 @@ export default function AstraApp() {
       setInputMessage("");
       setIsLoading(true);
 
-      try {
-        const res = await fetch("http://localhost:8000/chat", {
-          method: "POST",
-          headers: { "Content-Type": "application/json" },
-          body: JSON.stringify({
-            message: userMessage,
-            context: context,
-            user_id: userId, // <-- CRITICAL: Pass the user ID (email)
-          }),
-        });
+      // One key per message, sent again on every retry so the backend never repeats its emails or bookings
+      const idempotencyKey = crypto.randomUUID();
+      const body = JSON.stringify({
+        message: userMessage,
+        context: context,
+        session_id: sessionId,
+        user_id: userId, // <-- CRITICAL: Pass the user ID (email)
+        timezone: Intl.DateTimeFormat().resolvedOptions().timeZone, // relative dates and new events use it
+        idempotency_key: idempotencyKey,
+      });
 
-        const data = await res.json();
+      try {
+        let res: Response | undefined;
+        for (let attempt = 1; ; attempt++) {
+          try {
+            res = await fetch("http://localhost:8000/chat", {
+              method: "POST",
+              headers: { "Content-Type": "application/json", "Idempotency-Key": idempotencyKey },
+              body,
+            });
+            if (res.status < 500 || attempt === 3) break;
+          } catch (error) {
+            if (attempt === 3) throw error;
+          }
+          await new Promise((resolve) => setTimeout(resolve, 1000 * attempt));
+        }
+
+        const data = await res!.json();
         setContext(data.context);
+        if (data.session_id) setSessionId(data.session_id);
         
         setChatMessages((prev) => [
           ...prev,
@@ -353,6 +390,8 @@ export default function AstraApp() {
             content: data.reply || "Sorry, I encountered an unknown error.",
           },
         ]);
+        // Slow actions (emails, events, summaries) may finish in the background
+        (data.jobs || []).forEach((jobId: string) => pollJob(jobId, userId));
       } catch (error) {
         console.error("Chat API Error:", error);
         setChatMessages((prev) => [
@@ -442,7 +481,9 @@ export default function AstraApp() {
       try {
         // This frontend API route relies on the short-lived access token,
         // which NextAuth provides via its JWT/session handling for the calendar API
-        const res = await fetch("/api/calendar/events");
+        // Revalidated with the ETag the route returns, so unchanged pages come back as 304s
+        const timezone = encodeURIComponent(Intl.DateTimeFormat().resolvedOptions().timeZone);
+        const res = await fetch(`/api/calendar/events?timezone=${timezone}`);
         const data = await res.json();
         if (data.items) setEvents(data.items);
       } catch (err) {